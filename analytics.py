@@ -0,0 +1,207 @@
+#!/usr/bin/env python
+
+"""
+analytics.py -- Udacity conference server-side Python App Engine
+    registration analytics: events recorded after each registration
+    commits, rolled up offline into hourly and daily buckets
+
+"""
+
+import logging
+import random
+import time
+from datetime import datetime
+from datetime import timedelta
+
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+
+from models import AggregationCheckpoint
+from models import RegistrationEvent
+from models import RegistrationStat
+
+# spreads the created index over this many ranges, so that a burst of
+# registrations does not hit a single index range
+REGISTRATION_EVENT_SHARDS = 16
+AGGREGATION_URL = '/tasks/aggregate_registrations'
+AGGREGATION_PAGE = 500
+# stats per transaction; together with the checkpoint they stay within
+# the 25 entity groups of a cross-group transaction
+AGGREGATION_STATS_MAX = 24
+# events younger than this may still be invisible to queries
+AGGREGATION_SETTLE = timedelta(minutes=2)
+AGGREGATION_TASK_SECONDS = 60
+EPOCH = datetime(1970, 1, 1)
+GRANULARITIES = ('hour', 'day')
+
+
+def recordRegistrationEvent(c_key, delta):
+    """Record a registration (+1) or cancellation (-1) once the current
+    transaction (if any) commits. Analytics must never fail a
+    registration, so errors are only logged."""
+    wsck = c_key.urlsafe()
+
+    def record():
+        try:
+            RegistrationEvent(shard=random.randrange(REGISTRATION_EVENT_SHARDS),
+                              conference=wsck, delta=delta).put()
+        except Exception:
+            logging.exception('Recording registration event for %s failed',
+                              wsck)
+
+    ndb.get_context().call_on_commit(record)
+
+
+def statKey(websafeConferenceKey, granularity, bucket):
+    return ndb.Key(RegistrationStat, '%s|%s|%s' % (
+        websafeConferenceKey, granularity, bucket.strftime('%Y%m%d%H')))
+
+
+def _buckets(created):
+    hour = created.replace(minute=0, second=0, microsecond=0)
+    return (('hour', hour), ('day', hour.replace(hour=0)))
+
+
+def _checkpointKey(shard):
+    return ndb.Key(AggregationCheckpoint, 'registrations-%d' % shard)
+
+
+@ndb.transactional(xg=True)
+def _applyBatch(cp_key, expected, last, events, counts):
+    """Add counts ({stat key: [registrations, cancellations]}) to the
+    stats and move the checkpoint from `expected` to `last`, atomically.
+
+    Returns False, changing nothing, if another run moved the
+    checkpoint first.
+    """
+    cp = cp_key.get() or AggregationCheckpoint(key=cp_key, last=EPOCH)
+    if cp.last != expected:
+        return False
+    keys = counts.keys()
+    stats = []
+    for key, stat in zip(keys, ndb.get_multi(keys)):
+        if not stat:
+            websafeConferenceKey, granularity, bucket = key.id().split('|')
+            stat = RegistrationStat(key=key, conference=websafeConferenceKey,
+                granularity=granularity,
+                bucket=datetime.strptime(bucket, '%Y%m%d%H'))
+        stat.registrations += counts[key][0]
+        stat.cancellations += counts[key][1]
+        stats.append(stat)
+    cp.last = last
+    cp.events += events
+    ndb.put_multi(stats + [cp])
+    return True
+
+
+def enqueueAggregation(shard):
+    taskqueue.add(params={'shard': shard}, url=AGGREGATION_URL)
+
+
+def startAggregation():
+    """Roll up new events of all shards (cron)."""
+    for shard in range(REGISTRATION_EVENT_SHARDS):
+        enqueueAggregation(shard)
+
+
+def _countEvents(events):
+    """Return {stat key: [registrations, cancellations]} of events."""
+    counts = {}
+    for event in events:
+        for granularity, bucket in _buckets(event.created):
+            count = counts.setdefault(
+                statKey(event.conference, granularity, bucket), [0, 0])
+            count[0 if event.delta > 0 else 1] += 1
+    return counts
+
+
+def _instants(events):
+    """Group events (ordered by creation) of the same instant, so that
+    a checkpoint never falls between them."""
+    group = []
+    for event in events:
+        if group and event.created != group[-1].created:
+            yield group
+            group = []
+        group.append(event)
+    if group:
+        yield group
+
+
+def aggregateShard(shard):
+    """Roll events of one shard up into stats, for up to
+    AGGREGATION_TASK_SECONDS; chains a task to go on from the
+    checkpoint.
+
+    Events are read in pages with a cursor and applied in transactions
+    of at most AGGREGATION_STATS_MAX stats, each moving the shard's
+    checkpoint. A batch is only applied if the checkpoint has not moved
+    since it was read, so retried or overlapping runs never count an
+    event twice.
+    """
+    deadline = time.time() + AGGREGATION_TASK_SECONDS
+    cursor = None
+    cp_key = _checkpointKey(shard)
+    cp = cp_key.get()
+    last = cp.last if cp else EPOCH
+    query = RegistrationEvent.query(
+        RegistrationEvent.shard == shard,
+        RegistrationEvent.created > last,
+        RegistrationEvent.created <= datetime.utcnow() - AGGREGATION_SETTLE
+        ).order(RegistrationEvent.created)
+
+    while time.time() < deadline:
+        events, cursor, more = query.fetch_page(AGGREGATION_PAGE,
+            start_cursor=cursor)
+
+        batch = []
+        counts = {}
+        for instant in _instants(events):
+            instantCounts = _countEvents(instant)
+            if batch and len(set(counts).union(instantCounts)) > \
+                    AGGREGATION_STATS_MAX:
+                if not _applyBatch(cp_key, last, batch[-1].created,
+                                   len(batch), counts):
+                    logging.info('Registration shard %d is aggregated by '
+                                 'another run', shard)
+                    return
+                last = batch[-1].created
+                batch = []
+                counts = {}
+            batch.extend(instant)
+            for key, (registrations, cancellations) in instantCounts.items():
+                count = counts.setdefault(key, [0, 0])
+                count[0] += registrations
+                count[1] += cancellations
+        if batch:
+            if not _applyBatch(cp_key, last, batch[-1].created, len(batch),
+                               counts):
+                logging.info('Registration shard %d is aggregated by '
+                             'another run', shard)
+                return
+            last = batch[-1].created
+
+        if not (more and cursor):
+            return
+    enqueueAggregation(shard)
+
+
+def getRegistrationStats(websafeConferenceKey, granularity):
+    """Return the RegistrationStats of a conference in bucket order."""
+    return RegistrationStat.query(
+        RegistrationStat.conference == websafeConferenceKey,
+        RegistrationStat.granularity == granularity
+        ).order(RegistrationStat.bucket).fetch()
+
+
+def forecastSoldOut(stats, seatsAvailable, hours=24):
+    """Return when a conference will sell out at its net registration
+    rate of the last `hours`, or None if it is not selling."""
+    if seatsAvailable <= 0:
+        return None
+    since = datetime.utcnow() - timedelta(hours=hours)
+    net = sum(stat.registrations - stat.cancellations for stat in stats
+              if stat.bucket >= since)
+    if net <= 0:
+        return None
+    return datetime.utcnow() + timedelta(hours=hours * seatsAvailable / float(net))
@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+
+"""
+announcements.py -- Udacity conference server-side Python App Engine
+    announcement and featured speaker strings, cached in two tiers
+
+"""
+
+import hashlib
+import time
+
+from google.appengine.api import memcache
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+
+from models import Conference
+from models import Session
+
+from cache import TwoTierCache
+
+MEMCACHE_ANNOUNCEMENTS_KEY = "RECENT_ANNOUNCEMENTS"
+MEMCACHE_FEATURED_SPEAKER_KEY = "RECENT FEATURED SPEAKER"
+ANNOUNCEMENT_TPL = ('Last chance to attend! The following conferences '
+                    'are nearly sold out: %s')
+FEATURED_SPEAKER_TPL = ('Featured speaker in %s: %s with the sessions: %s')
+FEATURED_SPEAKER_WINDOW = 30    # seconds during which speaker checks coalesce
+MEMCACHE_FEATURED_SPEAKER_ENQUEUED_KEY = "FEATURED_SPEAKER_TASKS_ENQUEUED"
+MEMCACHE_FEATURED_SPEAKER_COALESCED_KEY = "FEATURED_SPEAKER_TASKS_COALESCED"
+MEMCACHE_FEATURED_SPEAKER_EXECUTED_KEY = "FEATURED_SPEAKER_TASKS_EXECUTED"
+
+# rarely changing strings read on every page load of the web client
+ANNOUNCEMENT_CACHE = TwoTierCache('ANNOUNCEMENT', ttl=10)
+FEATURED_SPEAKER_CACHE = TwoTierCache('FEATURED_SPEAKER', ttl=10)
+
+
+def cacheAnnouncement():
+    """Create Announcement & assign to memcache; used by
+    memcache cron job & putAnnouncement().
+    """
+    confs = Conference.query(ndb.AND(
+        Conference.seatsAvailable <= 5,
+        Conference.seatsAvailable > 0)
+    ).fetch(projection=[Conference.name])
+
+    if confs:
+        # If there are almost sold out conferences,
+        # format announcement and set it in memcache
+        announcement = ANNOUNCEMENT_TPL % (
+            ', '.join(conf.name for conf in confs))
+    else:
+        # If there are no sold out conferences,
+        # clear the announcement
+        announcement = ""
+    ANNOUNCEMENT_CACHE.set(MEMCACHE_ANNOUNCEMENTS_KEY, announcement)
+
+    return announcement
+
+
+def enqueueFeaturedSpeakerCheck(websafeConferenceKey, websafeSpeakerKey):
+    """Schedule a featured speaker check, at most one per conference
+    and speaker per FEATURED_SPEAKER_WINDOW.
+
+    The task is named after the window and runs once it has closed,
+    so it sees every session added for the speaker in the meantime.
+    """
+    now = time.time()
+    window = int(now) // FEATURED_SPEAKER_WINDOW
+    pair = hashlib.md5('%s/%s' % (websafeConferenceKey,
+        websafeSpeakerKey)).hexdigest()
+    try:
+        taskqueue.add(name='featured-speaker-%s-%d' % (pair, window),
+            params={'websafeConferenceKey': websafeConferenceKey,
+                'websafeSpeakerKey': websafeSpeakerKey},
+            url='/tasks/check_featured_speaker',
+            countdown=(window + 1) * FEATURED_SPEAKER_WINDOW - now + 1
+        )
+    except (taskqueue.TaskAlreadyExistsError,
+            taskqueue.TombstonedTaskError):
+        memcache.incr(MEMCACHE_FEATURED_SPEAKER_COALESCED_KEY,
+            initial_value=0)
+    else:
+        memcache.incr(MEMCACHE_FEATURED_SPEAKER_ENQUEUED_KEY,
+            initial_value=0)
+
+
+def featuredSpeakerTaskStats():
+    """Return counts of featured speaker tasks enqueued, coalesced
+    into an already pending task, and executed."""
+    counts = memcache.get_multi([
+        MEMCACHE_FEATURED_SPEAKER_ENQUEUED_KEY,
+        MEMCACHE_FEATURED_SPEAKER_COALESCED_KEY,
+        MEMCACHE_FEATURED_SPEAKER_EXECUTED_KEY])
+    return {
+        'enqueued': counts.get(MEMCACHE_FEATURED_SPEAKER_ENQUEUED_KEY, 0),
+        'coalesced': counts.get(MEMCACHE_FEATURED_SPEAKER_COALESCED_KEY, 0),
+        'executed': counts.get(MEMCACHE_FEATURED_SPEAKER_EXECUTED_KEY, 0),
+    }
+
+
+def cacheFeaturedSpeaker(websafeConferenceKey, websafeSpeakerKey):
+    """Find featured speaker & assign to memcache; used by
+    getFeaturedSpeaker().
+    """
+    memcache.incr(MEMCACHE_FEATURED_SPEAKER_EXECUTED_KEY, initial_value=0)
+    c_key = ndb.Key(urlsafe=websafeConferenceKey)
+    sp_key = ndb.Key(urlsafe=websafeSpeakerKey)
+    sessions = Session.query(ancestor=c_key)
+    sessions = sessions.filter(Session.speaker==sp_key)
+
+    if sessions.count() > 1:
+        # if there is more than one session for this
+        # speaker, format a featured speaker announcement
+        # and put it to memcache
+        # this will overwrite the last featured speaker
+        sessionNames = ", ".join([session.sessionName for session in sessions])
+        speaker = sp_key.get()
+        conf    = c_key.get()
+
+        announcement = FEATURED_SPEAKER_TPL % (
+            conf.name, speaker.name, sessionNames)
+
+        FEATURED_SPEAKER_CACHE.set(MEMCACHE_FEATURED_SPEAKER_KEY,
+            announcement)
+    else:
+        announcement = ""
+
+    return announcement
+
+
+def getAnnouncement():
+    """Return the current announcement, or an empty string."""
+    return ANNOUNCEMENT_CACHE.get(MEMCACHE_ANNOUNCEMENTS_KEY) or ""
+
+
+def getFeaturedSpeaker():
+    """Return the current featured speaker announcement, or an empty
+    string."""
+    return FEATURED_SPEAKER_CACHE.get(MEMCACHE_FEATURED_SPEAKER_KEY) or ""
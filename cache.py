@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+
+"""
+cache.py -- Udacity conference server-side Python App Engine
+    two-tier cache: a small in-process LRU in front of memcache, and
+    the memcached generation counters it and other caches invalidate by
+
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+from google.appengine.api import memcache
+
+CAS_TRIES = 5
+
+def getGeneration(key):
+    """Return the generation counter memcached under `key`,
+    (re)initializing it if evicted.
+
+    A fresh generation starts at the current time in milliseconds, so it
+    cannot collide with values left over from before the eviction.
+    """
+    generation = memcache.get(key)
+    if generation is None:
+        memcache.add(key, int(time.time() * 1000))
+        generation = memcache.get(key)
+    return generation
+
+
+def bumpGeneration(key):
+    """Move the generation counter under `key` on, making every value
+    cached under the previous one unreachable; returns the new
+    generation (None if memcache is unavailable)."""
+    return memcache.incr(key, initial_value=int(time.time() * 1000))
+
+
+def casUpdate(key, merge, tries=CAS_TRIES, ttl=0):
+    """Replace the memcached value of `key` with merge(value), value
+    being None if there is none, retrying on concurrent updates; merge
+    returns None to leave the value as it is. Returns False on too much
+    contention."""
+    client = memcache.Client()
+    for _ in range(tries):
+        current = client.gets(key)
+        value = merge(current)
+        if value is None:
+            return True
+        if current is None:
+            if client.add(key, value, time=ttl):
+                return True
+        elif client.cas(key, value, time=ttl):
+            return True
+    return False
+
+
+class TwoTierCache(object):
+    """Bounded, thread-safe in-process LRU with a short TTL in front of
+    memcache.
+
+    Memcache values are stored under a per-namespace generation number.
+    set() and invalidate() bump the generation, which makes every value
+    of the previous generation unreachable at once. Instances notice the
+    new generation, and drop their local copies, once their entries are
+    older than `ttl` seconds. Until then a hit costs no RPC at all.
+    """
+
+    def __init__(self, namespace, maxsize=128, ttl=10):
+        self.namespace = namespace
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()   # key -> (value, generation, expires)
+
+    def _genKey(self):
+        return '%s:GEN' % self.namespace
+
+    def _valueKey(self, key, generation):
+        return '%s:%s:%s' % (self.namespace, generation, key)
+
+    def _generation(self):
+        return getGeneration(self._genKey())
+
+    def _remember(self, key, value, generation):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (value, generation, time.time() + self.ttl)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def get(self, key, loader=None):
+        """Return the value for `key`, or None if it is not cached.
+
+        On a miss in both tiers, `loader` (if given) is called and its
+        result cached under the current generation.
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._entries[key] = entry      # most recently used
+        if entry is not None and entry[2] > now:
+            return entry[0]
+
+        generation = self._generation()
+        if entry is not None and entry[1] == generation:
+            # nothing changed since we cached it; just extend its life
+            self._remember(key, entry[0], generation)
+            return entry[0]
+
+        value = memcache.get(self._valueKey(key, generation))
+        if value is None and loader is not None:
+            value = loader()
+            if value is not None:
+                memcache.add(self._valueKey(key, generation), value)
+        if value is None:
+            with self._lock:
+                self._entries.pop(key, None)
+        else:
+            self._remember(key, value, generation)
+        return value
+
+    def set(self, key, value):
+        """Store `value` under a new generation, invalidating all other
+        values of this namespace."""
+        generation = bumpGeneration(self._genKey())
+        if generation is None:
+            generation = self._generation()
+        memcache.set(self._valueKey(key, generation), value)
+        self._remember(key, value, generation)
+
+    def invalidate(self):
+        """Invalidate every value of this namespace, in all instances
+        within `ttl` seconds."""
+        bumpGeneration(self._genKey())
+        with self._lock:
+            self._entries.clear()
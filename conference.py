@@ -13,17 +13,29 @@ __author__ = 'wesc+api@google.com (Wesley Chun), tanvir@mrsft.com (Tanvir Hasan)
 
 
 from datetime import datetime
+from datetime import timedelta
+import logging
+import time
 
 import endpoints
 from protorpc import messages
 from protorpc import message_types
 from protorpc import remote
 
-from google.appengine.api import memcache
-from google.appengine.api import taskqueue
+from google.appengine.api import datastore_errors
+from google.appengine.datastore.datastore_query import Cursor
 from google.appengine.ext import ndb
 
+from models import Attendee
+from models import AttendeeForm
+from models import AttendeeForms
 from models import ConflictException
+from models import FacetForm
+from models import FacetForms
+from models import FacetQueryForm
+from models import SoldOutException
+from models import SyncForm
+from models import TombstoneForm
 from models import Profile
 from models import ProfileMiniForm
 from models import ProfileForm
@@ -35,20 +47,32 @@ from models import ConferenceForm
 from models import ConferenceForms
 from models import ConferenceQueryForm
 from models import ConferenceQueryForms
+from models import RegistrationBatchForm
+from models import RegistrationForm
+from models import RegistrationOutcome
+from models import RegistrationOutcomeForm
+from models import RegistrationOutcomeForms
+from models import RegistrationStatForm
+from models import RegistrationStatsForm
+from models import SeatHold
+from models import SeatHoldForm
 from models import Session
 from models import SessionForm
 from models import SessionMiniForm
 from models import SessionForms
+from models import SessionSlotForm
+from models import SessionSlotForms
 from models import SessionQueryByTypeForm
 from models import SessionQueryBySpeakerForm
 from models import SessionQueryBeforeExcludingForm
-from models import SessionType
 from models import Speaker
 from models import SpeakerForm
 from models import SpeakerForms
 from models import SpeakerMiniForm
 from models import TopicForm
 from models import TopicForms
+from models import WaitlistEntry
+from models import WaitlistForm
 
 
 from settings import WEB_CLIENT_ID
@@ -58,13 +82,35 @@ from settings import ANDROID_AUDIENCE
 
 from utils import getUserId
 
+import analytics
+import announcements
+import contention
+import deletion
+import facets
+import outbox
+import profiling
+import querycache
+import ratelimit
+import recommendations
+import registration
+import schedule
+import sync
+import versions
+
 EMAIL_SCOPE = endpoints.EMAIL_SCOPE
 API_EXPLORER_CLIENT_ID = endpoints.API_EXPLORER_CLIENT_ID
-MEMCACHE_ANNOUNCEMENTS_KEY = "RECENT_ANNOUNCEMENTS"
-MEMCACHE_FEATURED_SPEAKER_KEY = "RECENT FEATURED SPEAKER"
-ANNOUNCEMENT_TPL = ('Last chance to attend! The following conferences '
-                    'are nearly sold out: %s')
-FEATURED_SPEAKER_TPL = ('Featured speaker in %s: %s with the sessions: %s')
+CONF_ETAG_TPL = '"c%d"'
+SESSIONS_ETAG_TPL = '"s%d"'
+SEAT_HOLD_SECONDS = 120
+# holding again extends a hold, but never past this age
+SEAT_HOLD_MAX_SECONDS = 600
+ATTENDEES_PAGE_SIZE = 100
+SLOT_MINUTES = 30
+SPEAKERS_PAGE_SIZE = 20
+# a cross-group transaction spans at most 25 entity groups: the
+# profile plus this many conferences
+REGISTRATION_CHUNK = 24
+REGISTRATION_BATCH_MAX = 100
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
 CONF_DEFAULTS = {
@@ -99,6 +145,12 @@ CONF_GET_REQUEST = endpoints.ResourceContainer(
     websafeConferenceKey=messages.StringField(1)
 )
 
+CONF_ETAG_GET_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    websafeConferenceKey=messages.StringField(1),
+    ifNoneMatch=messages.StringField(2)
+)
+
 CONF_POST_REQUEST = endpoints.ResourceContainer(
     ConferenceForm,
     websafeConferenceKey=messages.StringField(1)
@@ -110,7 +162,8 @@ SESSION_POST_REQUEST = endpoints.ResourceContainer(
 
 SESSION_QUERY_REQUEST = endpoints.ResourceContainer(
     message_types.VoidMessage,
-    websafeConferenceKey=messages.StringField(1)
+    websafeConferenceKey=messages.StringField(1),
+    ifNoneMatch=messages.StringField(2)
 )
 
 SESSION_QUERY_BY_TYPE_REQUEST = endpoints.ResourceContainer(
@@ -118,6 +171,20 @@ SESSION_QUERY_BY_TYPE_REQUEST = endpoints.ResourceContainer(
     websafeConferenceKey=messages.StringField(1)
 )
 
+SESSIONS_IN_WINDOW_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    websafeConferenceKey=messages.StringField(1),
+    date=messages.StringField(2),
+    startTime=messages.StringField(3),
+    endTime=messages.StringField(4),
+    slotMinutes=messages.IntegerField(5)
+)
+
+SESSION_GET_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    websafeSessionKey=messages.StringField(1)
+)
+
 WISHLIST_REQUEST = endpoints.ResourceContainer(
     message_types.VoidMessage,
     websafeSessionKey=messages.StringField(1)
@@ -133,6 +200,39 @@ SESSIONS_BEFORE_EXCLUDING_POST_REQUEST = endpoints.ResourceContainer (
     websafeConferenceKey=messages.StringField(1)
 )
 
+SPEAKER_POST_REQUEST = endpoints.ResourceContainer(
+    SpeakerMiniForm,
+    websafeSpeakerKey=messages.StringField(1)
+)
+
+ATTENDEES_GET_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    websafeConferenceKey=messages.StringField(1),
+    pageToken=messages.StringField(2),
+    limit=messages.IntegerField(3)
+)
+
+SPEAKER_DIRECTORY_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    prefix=messages.StringField(1),
+    pageToken=messages.StringField(2),
+    limit=messages.IntegerField(3),
+    includeBio=messages.BooleanField(4)
+)
+
+SYNC_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    syncToken=messages.StringField(1),
+    websafeConferenceKey=messages.StringField(2),
+    limit=messages.IntegerField(3)
+)
+
+REGISTRATION_STATS_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    websafeConferenceKey=messages.StringField(1),
+    granularity=messages.StringField(2)
+)
+
 FEATURED_SPEAKER_GET_REQUEST = endpoints.ResourceContainer (
     message_types.VoidMessage,
     websafeConferenceKey=messages.StringField(1),
@@ -141,6 +241,17 @@ FEATURED_SPEAKER_GET_REQUEST = endpoints.ResourceContainer (
 
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
+def _requestConference(self, request, *args, **kwds):
+    """Return the websafe key of the entity group that transactions on
+    the conference of a request contend for: the root of the conference,
+    i.e. its organizer's Profile."""
+    try:
+        return ndb.Key(urlsafe=request.websafeConferenceKey).root().urlsafe()
+    except Exception:
+        # the transaction itself reports the corrupt key
+        return request.websafeConferenceKey
+
+
 @endpoints.api( name='conference', version='v1', audiences=[ANDROID_AUDIENCE],
     allowed_client_ids=[WEB_CLIENT_ID, API_EXPLORER_CLIENT_ID, ANDROID_CLIENT_ID, IOS_CLIENT_ID],
     scopes=[EMAIL_SCOPE])
@@ -210,6 +321,7 @@ class ConferenceApi(remote.Service):
     # /profile, GET, getProfile()
     @endpoints.method(message_types.VoidMessage, ProfileForm,
             path='profile', http_method='GET', name='getProfile')
+    @profiling.profiled
     def getProfile(self, request):
         """Return user profile."""
         return self._doProfile()
@@ -217,6 +329,7 @@ class ConferenceApi(remote.Service):
     # /profile, POST, saveProfile()
     @endpoints.method(ProfileMiniForm, ProfileForm,
             path='profile', http_method='POST', name='saveProfile')
+    @profiling.profiled
     def saveProfile(self, request):
         """Update & return user profile."""
         return self._doProfile(request)
@@ -258,6 +371,8 @@ class ConferenceApi(remote.Service):
         data = {field.name: getattr(request, field.name) for field in request.all_fields()}
         del data['websafeKey']
         del data['organizerDisplayName']
+        del data['etag']
+        del data['notModified']
 
         # add default values for those missing (both data model & outbound Message)
         for df in CONF_DEFAULTS:
@@ -288,17 +403,23 @@ class ConferenceApi(remote.Service):
         c_key = ndb.Key(Conference, c_id, parent=p_key)
         data['key'] = c_key
         data['organizerUserId'] = request.organizerUserId = user_id
+        data['attendeeCount'] = 0
 
         # create Conference & return (modified) ConferenceForm
-        Conference(**data).put()
-        taskqueue.add(params={'email': user.email(),
-            'conferenceInfo': repr(request)},
-            url='/tasks/send_confirmation_email'
+        conf = Conference(**data)
+        conf.put()
+        versions.bumpCatalogGeneration()
+        facets.enqueueFacetDelta(conf, {}, facets.conferenceFacets(conf))
+        outbox.enqueueMail(user.email(),
+            'You created a new Conference!',
+            'Hi, you have created a following '
+            'conference:\r\n\r\n%s' % repr(request),
+            idempotencyKey='conference-created:%s' % c_key.urlsafe()
         )
 
         return request
 
-    @ndb.transactional()
+    @contention.transactional('updateConference', _requestConference)
     def _updateConferenceObject(self, request):
         user = endpoints.get_current_user()
         if not user:
@@ -320,9 +441,14 @@ class ConferenceApi(remote.Service):
             raise endpoints.ForbiddenException(
                 'Only the owner can update the conference.')
 
+        oldName = conf.name
+        oldFacets = facets.conferenceFacets(conf)
+
         # Not getting all the fields, so don't create a new object; just
         # copy relevant fields from ConferenceForm to Conference object
         for field in request.all_fields():
+            if field.name in ('etag', 'notModified'):
+                continue
             data = getattr(request, field.name)
             # only copy fields where we get data
             if data not in (None, []):
@@ -333,9 +459,50 @@ class ConferenceApi(remote.Service):
                         conf.month = data.month
                 # write to Conference object
                 setattr(conf, field.name, data)
+        versions.touchConference(conf)
         conf.put()
+        # sessions carry the conference name; rewrite them in the background
+        if conf.name != oldName:
+            schedule.enqueueSessionNamesFanOut('conference', conf.key.urlsafe(),
+                transactional=True)
+        facets.enqueueFacetDelta(conf, oldFacets,
+            facets.conferenceFacets(conf), transactional=True)
         prof = ndb.Key(Profile, user_id).get()
-        return self._copyConferenceToForm(conf, getattr(prof, 'displayName'))
+        cf = self._copyConferenceToForm(conf, getattr(prof, 'displayName'))
+        cf.etag = CONF_ETAG_TPL % conf.version
+        return cf
+
+    @ndb.transactional(xg=True)
+    def _deleteConferenceObject(self, request):
+        """Delete a conference and schedule cleaning up its sessions,
+        registrations and wishlists."""
+        user = endpoints.get_current_user()
+        if not user:
+            raise endpoints.UnauthorizedException('Authorization required')
+        user_id = getUserId(user)
+
+        try:
+            c_key = ndb.Key(urlsafe=request.websafeConferenceKey)
+        except Exception:
+            raise endpoints.BadRequestException(
+                'websafeConferenceKey given is corrupted')
+        conf = c_key.get()
+        if not conf:
+            raise endpoints.NotFoundException(
+                'No conference found with key: %s' % request.websafeConferenceKey)
+        if user_id != conf.organizerUserId:
+            raise endpoints.ForbiddenException(
+                'Only the owner can delete the conference.')
+
+        # cached ETags must not outlive the conference
+        versions.touchConference(conf)
+        c_key.delete()
+        sync.tombstone(c_key, c_key).put()
+        facets.enqueueFacetDelta(conf, facets.conferenceFacets(conf), {},
+            transactional=True)
+        deletion.enqueueConferenceDeletion(request.websafeConferenceKey,
+            transactional=True)
+        return BooleanMessage(data=True)
 
     def _getConferenceQuery(self, request):
         """Return formatted query from the submitted filters."""
@@ -355,12 +522,29 @@ class ConferenceApi(remote.Service):
             formatted_query = ndb.query.FilterNode(filtr["field"], filtr["operator"], filtr["value"])
             q = q.filter(formatted_query)
         return q
+
+    def _getIfNoneMatch(self, request):
+        """Return the client's If-None-Match value, from the request
+        parameter or, failing that, the HTTP header."""
+        ifNoneMatch = getattr(request, 'ifNoneMatch', None)
+        if not ifNoneMatch and getattr(self, 'request_state', None):
+            ifNoneMatch = self.request_state.headers.get('If-None-Match')
+        return ifNoneMatch
+
+    @staticmethod
+    def _etagMatches(etag, ifNoneMatch):
+        """Check an ETag against an If-None-Match value."""
+        if not ifNoneMatch:
+            return False
+        candidates = [c.strip() for c in ifNoneMatch.split(',')]
+        return '*' in candidates or etag in candidates
     ## end conference helpers
 
     ## conference api methods
     # /conference, POST, createConference()
     @endpoints.method(ConferenceForm, ConferenceForm, path='conference',
             http_method='POST', name='createConference')
+    @profiling.profiled
     def createConference(self, request):
         """Create new conference."""
         return self._createConferenceObject(request)
@@ -369,47 +553,81 @@ class ConferenceApi(remote.Service):
     @endpoints.method(CONF_POST_REQUEST, ConferenceForm,
             path='conference/{websafeConferenceKey}',
             http_method='PUT', name='updateConference')
+    @profiling.profiled
     def updateConference(self, request):
         """Update conference w/provided fields & return w/updated info."""
         return self._updateConferenceObject(request)
 
+    # /conferences/{websafeConferenceKey}, DELETE, deleteConference
+    @endpoints.method(CONF_GET_REQUEST, BooleanMessage,
+            path='conferences/{websafeConferenceKey}',
+            http_method='DELETE', name='deleteConference')
+    @profiling.profiled
+    def deleteConference(self, request):
+        """Delete conference; its sessions, registrations and wishlist
+        entries are removed in the background."""
+        return self._deleteConferenceObject(request)
+
     # /conference/{websafeConferenceKey}, GET, getConference()
-    @endpoints.method(CONF_GET_REQUEST, ConferenceForm,
+    @endpoints.method(CONF_ETAG_GET_REQUEST, ConferenceForm,
             path='conference/{websafeConferenceKey}',
             http_method='GET', name='getConference')
+    @profiling.profiled
     def getConference(self, request):
         """Return requested conference (by websafeConferenceKey)."""
+        wsck = request.websafeConferenceKey
+
+        # answer conditional requests from the memcached version alone
+        ifNoneMatch = self._getIfNoneMatch(request)
+        if ifNoneMatch:
+            version = versions.getConferenceVersion(wsck)
+            if version is not None:
+                etag = CONF_ETAG_TPL % version
+                if self._etagMatches(etag, ifNoneMatch):
+                    return ConferenceForm(websafeKey=wsck, etag=etag,
+                        notModified=True)
+
         # get Conference object from request; bail if not found
-        conf = ndb.Key(urlsafe=request.websafeConferenceKey).get()
+        conf = ndb.Key(urlsafe=wsck).get()
         if not conf:
             raise endpoints.NotFoundException(
-                'No conference found with key: %s' % request.websafeConferenceKey)
+                'No conference found with key: %s' % wsck)
         prof = conf.key.parent().get()
         if not prof:
             raise endpoints.NotFoundException(
                 'Conference does not have an ancestor.')
+        versions.primeConferenceVersion(wsck, conf.version or 0)
+
         # return ConferenceForm
-        return self._copyConferenceToForm(conf, getattr(prof, 'displayName'))
+        cf = self._copyConferenceToForm(conf, getattr(prof, 'displayName'))
+        cf.etag = CONF_ETAG_TPL % (conf.version or 0)
+        return cf
 
     # /conferences, POST, queryConferences()
     @endpoints.method(ConferenceQueryForms, ConferenceForms,
             path='conferences',
             http_method='POST',
             name='queryConferences')
+    @profiling.profiled
     def queryConferences(self, request):
-        """Query for conferences."""
-        conferences = self._getConferenceQuery(request)
-
-         # return individual ConferenceForm object per Conference
-        return ConferenceForms(
-            items=[self._copyConferenceToForm(conf, "") \
-            for conf in conferences]
-        )
+        """Query for conferences; results are cached per filter set
+        until any conference changes."""
+        _, filters = self._formatFilters(request.filters)
+
+        def run():
+            conferences = self._getConferenceQuery(request)
+            # return individual ConferenceForm object per Conference
+            return ConferenceForms(
+                items=[self._copyConferenceToForm(conf, "") \
+                for conf in conferences]
+            )
+        return querycache.cachedQuery(filters, run)
 
     # /conferences/created, GET, getConferencesCreated()
     @endpoints.method(message_types.VoidMessage, ConferenceForms,
             path='conferences/created',
             http_method='GET', name='getConferencesCreated')
+    @profiling.profiled
     def getConferencesCreated(self, request):
         """Return conferences created by user."""
         # make sure user is authed
@@ -430,11 +648,14 @@ class ConferenceApi(remote.Service):
     @endpoints.method(message_types.VoidMessage, ConferenceForms,
             path='conferences/attending',
             http_method='GET', name='getConferencesToAttend')
+    @profiling.profiled
     def getConferencesToAttend(self, request):
         """Get list of conferences that user has registered for."""
         prof = self._getProfileFromUser() # get user Profile
         conf_keys = [ndb.Key(urlsafe=wsck) for wsck in prof.conferenceKeysToAttend]
-        conferences = ndb.get_multi(conf_keys)
+        # skip conferences deleted since (their references are being
+        # cleaned up in the background)
+        conferences = [conf for conf in ndb.get_multi(conf_keys) if conf]
 
         # get organizers
         organisers = [ndb.Key(Profile, conf.organizerUserId) for conf in conferences]
@@ -443,55 +664,64 @@ class ConferenceApi(remote.Service):
         # put display names in a dict for easier fetching
         names = {}
         for profile in profiles:
-            names[profile.key.id()] = profile.displayName
+            if profile:
+                names[profile.key.id()] = profile.displayName
 
         # return set of ConferenceForm objects per Conference
-        return ConferenceForms(items=[self._copyConferenceToForm(conf, names[conf.organizerUserId])\
+        return ConferenceForms(items=[self._copyConferenceToForm(conf, names.get(conf.organizerUserId, ''))\
          for conf in conferences]
         )
 
+    # /sync, GET, syncChanges()
+    @endpoints.method(SYNC_REQUEST, SyncForm,
+            path='sync',
+            http_method='GET', name='sync')
+    @profiling.profiled
+    def syncChanges(self, request):
+        """Return conferences and sessions created, updated or deleted
+        since syncToken (all of them without one), a page at a time;
+        optionally only those of one conference."""
+        user = endpoints.get_current_user()
+        if not user:
+            raise endpoints.UnauthorizedException('Authorization required')
+
+        c_key = None
+        if request.websafeConferenceKey:
+            try:
+                c_key = ndb.Key(urlsafe=request.websafeConferenceKey)
+            except Exception:
+                raise endpoints.BadRequestException(
+                    'websafeConferenceKey given is corrupted')
+        limit = min(request.limit or sync.SYNC_PAGE_SIZE, 1000)
+        try:
+            changes, token, more, reset = sync.changesSince(
+                request.syncToken, c_key, limit)
+        except ValueError:
+            # only a token can be invalid; anything else is a server bug
+            raise endpoints.BadRequestException('syncToken given is invalid')
+
+        # get organizers' display names in one go
+        conferences = changes['conferences']
+        organisers = ndb.get_multi(set(ndb.Key(Profile, conf.organizerUserId)
+            for conf in conferences))
+        names = dict((prof.key.id(), prof.displayName)
+            for prof in organisers if prof)
+
+        return SyncForm(
+            conferences=[self._copyConferenceToForm(conf,
+                names.get(conf.organizerUserId, '')) for conf in conferences],
+            sessions=[schedule.copySessionToForm(session)
+                for session in changes['sessions']],
+            deleted=[TombstoneForm(kind=tomb.kind, websafeKey=tomb.key.id())
+                for tomb in changes['deleted']],
+            syncToken=token, more=more, reset=reset
+        )
+
     ## end conference api methods
 
 # - - - Sessions - - - - - - - - - - - - - - - - - - - - - -
 
     ## session helpers
-    def _copySessionToForm(self, session):
-        """Copy relevant fields from Session to SessionForm."""
-        sf = SessionForm()
-        for field in sf.all_fields():
-            if hasattr(session, field.name):
-                # convert Date to date string and Time to time string
-                if field.name.endswith('date') or field.name.endswith('Time'):
-                    setattr(sf, field.name, str(getattr(session, field.name)))
-                # convert session typeOfSession string to Enum; 
-                elif field.name == 'typeOfSession':
-                    #setattr(sf, field.name, getattr(session, field.name))
-                    setattr(sf, field.name, getattr(SessionType, getattr(session, field.name)))               
-                # just copy others                   
-                else:
-                    setattr(sf, field.name, getattr(session, field.name))
-
-        # show the session's own websafe key
-        setattr(sf, 'websafeKey', session.key.urlsafe())
-
-        # show the conference name
-        if session.key and session.key.parent():
-            conf = session.key.parent().get()
-            setattr(sf, 'conferenceName', getattr(conf, 'name'))
-        else:
-            setattr(sf, 'conferenceName', 'not set')
-
-        # if the session has a speaker assigned, show their name and websafe key
-        if hasattr(session, 'speaker'):
-            sp_key = getattr(session, 'speaker')
-            if sp_key:
-                speaker = sp_key.get()
-                setattr(sf, 'speakerName', getattr(speaker, 'name'))
-                setattr(sf, 'websafeSpeakerKey', speaker.key.urlsafe())
-
-        sf.check_initialized()
-        return sf
-
     def _createSessionObject(self, request):
         """Create Session object, returning SessionForm/request."""
 
@@ -556,8 +786,12 @@ class ConferenceApi(remote.Service):
                 raise endpoints.BadRequestException("websafeSpeakerKey given is corrupted")
             if not sp_key:
                 raise endpoints.BadRequestException("websafeSpeakerKey given is invalid")
-            else:
-                data['speaker'] = sp_key
+            speaker = sp_key.get()
+            if not speaker:
+                raise endpoints.NotFoundException(
+                    "No speaker found with key: %s" % request.websafeSpeakerKey)
+            data['speaker'] = sp_key
+            data['speakerName'] = speaker.name
         elif request.speakerName:
             # is there exactly one speaker of this name?
             speakers = Speaker.query()
@@ -569,14 +803,18 @@ class ConferenceApi(remote.Service):
                 raise endpoints.BadRequestException(
                     "Speaker name ambiguous: %s" % request.speakerName)
             else:
-                data['speaker'] = speakers.get().key
+                speaker = speakers.get()
+                data['speaker'] = speaker.key
+                data['speakerName'] = speaker.name
+        else:
+            data['speakerName'] = None
 
         # remove unnecessary data copied over from request
         del data['websafeConferenceKey']
-        if hasattr(data, 'conferenceName'):
-            del data['conferenceName']
         del data['websafeSpeakerKey']
-        del data['speakerName']
+
+        # denormalize the conference name onto the session
+        data['conferenceName'] = conf.name
 
         # allocate new Session ID with Conference key as parent
         s_id = Session.allocate_ids(size=1, parent=c_key)[0]
@@ -587,19 +825,15 @@ class ConferenceApi(remote.Service):
         # create Session & return (modified) SessionForm
         session = Session(**data)
         session.put()
+        schedule.sessionsChanged(c_key)
 
         # add a task to check if the speaker of this new session is
         # now a featured speaker
         if hasattr(session, 'speaker') and getattr(session, 'speaker'):
-            print "adding task now to queue"
-            taskqueue.add(params={'websafeConferenceKey': request.websafeConferenceKey,
-                'websafeSpeakerKey': getattr(session, 'speaker').urlsafe()},
-                url='/tasks/check_featured_speaker'
-            )
-        else:
-            print "session has no speaker any more"
+            announcements.enqueueFeaturedSpeakerCheck(request.websafeConferenceKey,
+                getattr(session, 'speaker').urlsafe())
 
-        return self._copySessionToForm(session)
+        return schedule.copySessionToForm(session)
 
     def _getSessionQuery(self, request):
         """Return formatted query from the submitted filters."""
@@ -627,6 +861,8 @@ class ConferenceApi(remote.Service):
     @endpoints.method(SESSION_POST_REQUEST, SessionForm, 
             path='session/{websafeConferenceKey}',
             http_method='POST', name='createSession')
+    @ratelimit.rateLimited('createSession')
+    @profiling.profiled
     def createSession(self, request):
         """Create new session."""
         return self._createSessionObject(request)
@@ -635,6 +871,7 @@ class ConferenceApi(remote.Service):
     @endpoints.method(SESSION_QUERY_REQUEST, SessionForms,
             path='sessions/{websafeConferenceKey}',
             http_method='GET', name='getConferenceSessions')
+    @profiling.profiled
     def getConferenceSessions(self, request):
         """Return all sessions in a given conference."""
         # make sure user is authed
@@ -655,42 +892,134 @@ class ConferenceApi(remote.Service):
         if not c_key:
             raise endpoints.BadRequestException("websafeConferenceKey given is invalid") 
 
+        # answer conditional requests from the memcached version alone
+        ifNoneMatch = self._getIfNoneMatch(request)
+        if ifNoneMatch:
+            version = versions.getConferenceVersion(request.websafeConferenceKey)
+            if version is not None:
+                etag = SESSIONS_ETAG_TPL % version
+                if self._etagMatches(etag, ifNoneMatch):
+                    return SessionForms(etag=etag, notModified=True)
+
         # does the conference (still) exist?
         conf = c_key.get()
         if not conf:
             raise endpoints.NotFoundException("Conference with this key does not exist")
-
-        # create ancestor query for all key matches for this user
-        sessions = Session.query(ancestor=c_key)
-        # return set of SessionForm objects per Conference
-        return SessionForms(
-            items=[self._copySessionToForm(session) for session in sessions]
-        )
+        versions.primeConferenceVersion(request.websafeConferenceKey,
+            conf.version or 0)
+
+        # serve the precomputed schedule if there is one; snapshots are
+        # only built by tasks, never in this read
+        started = time.time()
+        scheduleVersion = conf.scheduleVersion or 0
+        forms = schedule.getScheduleSnapshot(request.websafeConferenceKey,
+            scheduleVersion)
+        if forms is not None:
+            logging.debug('Schedule served from snapshot in %.1fms',
+                (time.time() - started) * 1000)
+        else:
+            # create ancestor query for all key matches for this user
+            sessions = Session.query(ancestor=c_key)
+            # return set of SessionForm objects per Conference
+            forms = SessionForms(
+                items=[schedule.copySessionToForm(session) for session in sessions]
+            )
+            schedule.enqueueScheduleSnapshot(request.websafeConferenceKey,
+                scheduleVersion)
+            logging.debug('Schedule built from the datastore in %.1fms',
+                (time.time() - started) * 1000)
+        forms.etag = SESSIONS_ETAG_TPL % (conf.version or 0)
+        return forms
 
 
     # /sessions_by_type/{websafeConferenceKey}, POST, getConferenceSessionsByType()
     @endpoints.method(SESSION_QUERY_BY_TYPE_REQUEST, SessionForms,
             path='sessions/{websafeConferenceKey}',
             http_method='POST', name='getConferenceSessionsByType')
+    @profiling.profiled
     def getConferenceSessionsByType(self, request):
         """Return all sessions of the specified type in a given conference"""
         sessions = Session.query(ancestor=ndb.Key(urlsafe=request.websafeConferenceKey))
         #typeOfSession = getattr(SessionType, getattr(request, 'typeOfSession'))
         sessions = sessions.filter(Session.typeOfSession == str(getattr(request, 'typeOfSession')))
         return SessionForms(
-            items=[self._copySessionToForm(session) for session in sessions]
+            items=[schedule.copySessionToForm(session) for session in sessions]
         )
 
+    # /sessions/{websafeConferenceKey}/window, GET, getSessionsInWindow()
+    @endpoints.method(SESSIONS_IN_WINDOW_REQUEST, SessionSlotForms,
+            path='sessions/{websafeConferenceKey}/window',
+            http_method='GET', name='getSessionsInWindow')
+    @profiling.profiled
+    def getSessionsInWindow(self, request):
+        """Return the sessions of a conference day starting between
+        startTime (inclusive) and endTime (exclusive), grouped into
+        slots of slotMinutes."""
+        try:
+            c_key = ndb.Key(urlsafe=request.websafeConferenceKey)
+        except Exception:
+            raise endpoints.BadRequestException(
+                "websafeConferenceKey given is corrupted")
+        if not (request.date and request.startTime and request.endTime):
+            raise endpoints.BadRequestException(
+                "Fields 'date', 'startTime' and 'endTime' required")
+        try:
+            date = datetime.strptime(request.date[:10], "%Y-%m-%d").date()
+            startTime = datetime.strptime(request.startTime[:5], "%H:%M").time()
+            endTime = datetime.strptime(request.endTime[:5], "%H:%M").time()
+        except ValueError:
+            raise endpoints.BadRequestException(
+                "Use YYYY-MM-DD for 'date' and HH:MM for the times")
+        slotMinutes = request.slotMinutes or SLOT_MINUTES
+        if not 0 < slotMinutes <= 24 * 60:
+            raise endpoints.BadRequestException(
+                "'slotMinutes' must be between 1 and 1440")
+
+        # one range scan over the ancestor/date/startTime index
+        sessions = Session.query(ancestor=c_key).filter(
+            Session.date == date).filter(
+            Session.startTime >= startTime).filter(
+            Session.startTime < endTime).order(Session.startTime)
+
+        slots = []
+        for session in sessions:
+            minutes = session.startTime.hour * 60 + session.startTime.minute
+            slotStart = minutes - minutes % slotMinutes
+            label = '%02d:%02d' % divmod(slotStart, 60)
+            if not slots or slots[-1].startTime != label:
+                slots.append(SessionSlotForm(startTime=label))
+            slots[-1].items.append(schedule.copySessionToForm(session))
+        return SessionSlotForms(date=str(date), slots=slots)
+
+    # /session/{websafeSessionKey}/related, GET, getRelatedSessions()
+    @endpoints.method(SESSION_GET_REQUEST, SessionForms,
+            path='session/{websafeSessionKey}/related',
+            http_method='GET', name='getRelatedSessions')
+    @profiling.profiled
+    def getRelatedSessions(self, request):
+        """Return the sessions most often wishlisted together with the
+        given one, best first (recomputed daily)."""
+        related = recommendations.getRelatedSessions(request.websafeSessionKey)
+        try:
+            s_keys = [ndb.Key(urlsafe=wssk) for wssk, _ in related]
+        except Exception:
+            raise endpoints.BadRequestException(
+                'websafeSessionKey given is corrupted')
+        # skip sessions deleted since the last rebuild
+        return SessionForms(items=[schedule.copySessionToForm(session)
+            for session in ndb.get_multi(s_keys) if session])
+
     # /sessions_by_speaker, POST, getSessionsBySpeaker()
     @endpoints.method(SessionQueryBySpeakerForm, SessionForms,
             path='sessions_by_speaker',
             http_method='POST', name='getSessionsBySpeaker')
+    @profiling.profiled
     def getSessionsBySpeaker(self, request):
         """Return all sessions by the specified speaker in all conferences"""
         sessions = Session.query()
         sessions = sessions.filter(Session.speaker == ndb.Key(urlsafe=getattr(request, 'speaker')))
         return SessionForms(
-            items=[self._copySessionToForm(session) for session in sessions]
+            items=[schedule.copySessionToForm(session) for session in sessions]
         )
     ## end session api methods
 
@@ -729,6 +1058,7 @@ class ConferenceApi(remote.Service):
         # make Speaker key from ID
         s_key = ndb.Key(Speaker, s_id)
         data['key'] = s_key
+        data['creatorUserId'] = user_id
 
         # create Speaker & return SpeakerForm
         speaker = Speaker(**data)
@@ -736,6 +1066,58 @@ class ConferenceApi(remote.Service):
 
         return self._copySpeakerToForm(speaker)
 
+    @staticmethod
+    def _maySpeakerBeEditedBy(speaker, user_id):
+        """Return whether a user created a speaker or organizes one of
+        the conferences the speaker has sessions in."""
+        if speaker.creatorUserId == user_id:
+            return True
+        # sessions are children of conferences, which are children of
+        # their organizer's profile
+        for s_key in Session.query(Session.speaker == speaker.key).iter(
+                keys_only=True):
+            if s_key.pairs()[0] == ('Profile', user_id):
+                return True
+        return False
+
+    def _updateSpeakerObject(self, request):
+        """Update Speaker object, returning SpeakerForm."""
+
+        # check for auth'ed and valid user
+        user = endpoints.get_current_user()
+        if not user:
+            raise endpoints.UnauthorizedException('Authorization required')
+
+        try:
+            sp_key = ndb.Key(urlsafe=request.websafeSpeakerKey)
+        except Exception:
+            raise endpoints.BadRequestException("websafeSpeakerKey given is corrupted")
+        speaker = sp_key.get()
+        if not speaker:
+            raise endpoints.NotFoundException(
+                'No speaker found with key: %s' % request.websafeSpeakerKey)
+
+        # check that user created the speaker or organizes a conference
+        # that has a session of the speaker
+        if not self._maySpeakerBeEditedBy(speaker, getUserId(user)):
+            raise endpoints.ForbiddenException(
+                'Only the creator of the speaker or organizers of their '
+                'conferences can update the speaker.')
+
+        # copy only fields where we get data
+        oldName = speaker.name
+        for field in ('name', 'bio'):
+            data = getattr(request, field)
+            if data:
+                setattr(speaker, field, data)
+        speaker.put()
+
+        # sessions carry the speaker name; rewrite them in the background
+        if speaker.name != oldName:
+            schedule.enqueueSessionNamesFanOut('speaker', sp_key.urlsafe())
+
+        return self._copySpeakerToForm(speaker)
+
     ## end speaker helper methods
 
     ## speaker api methods
@@ -743,14 +1125,62 @@ class ConferenceApi(remote.Service):
     @endpoints.method(SpeakerMiniForm, SpeakerForm, 
             path='speaker',
             http_method='POST', name='createSpeaker')
+    @profiling.profiled
     def createSpeaker(self, request):
         """Create new speaker"""
         return self._createSpeakerObject(request)
 
+    # /speaker/{websafeSpeakerKey}, PUT, updateSpeaker()
+    @endpoints.method(SPEAKER_POST_REQUEST, SpeakerForm,
+            path='speaker/{websafeSpeakerKey}',
+            http_method='PUT', name='updateSpeaker')
+    @profiling.profiled
+    def updateSpeaker(self, request):
+        """Update speaker w/provided fields & return w/updated info."""
+        return self._updateSpeakerObject(request)
+
+    # /speakers/directory, GET, getSpeakerDirectory()
+    @endpoints.method(SPEAKER_DIRECTORY_REQUEST, SpeakerForms,
+            path='speakers/directory',
+            http_method='GET', name='getSpeakerDirectory')
+    @profiling.profiled
+    def getSpeakerDirectory(self, request):
+        """Return one page of speakers ordered by name, optionally only
+        those whose name starts with prefix (case-insensitive). Bios are
+        left out unless includeBio is set."""
+        try:
+            cursor = Cursor(urlsafe=request.pageToken) if request.pageToken else None
+        except Exception:
+            raise endpoints.BadRequestException('pageToken given is corrupted')
+        limit = min(request.limit or SPEAKERS_PAGE_SIZE, 100)
+
+        speakers = Speaker.query().order(Speaker.nameLower)
+        if request.prefix:
+            prefix = request.prefix.lower()
+            speakers = speakers.filter(Speaker.nameLower >= prefix,
+                                       Speaker.nameLower < prefix + u'\ufffd')
+
+        if request.includeBio:
+            speakers, next_cursor, more = speakers.fetch_page(
+                limit, start_cursor=cursor)
+            items = [self._copySpeakerToForm(speaker) for speaker in speakers]
+        else:
+            # names only, straight from the index; bios are never read
+            speakers, next_cursor, more = speakers.fetch_page(
+                limit, start_cursor=cursor,
+                projection=[Speaker.nameLower, Speaker.name])
+            items = [SpeakerForm(name=speaker.name,
+                websafeKey=speaker.key.urlsafe()) for speaker in speakers]
+
+        return SpeakerForms(items=items,
+            nextPageToken=next_cursor.urlsafe() if more and next_cursor else None
+        )
+
     # /speakers, GET, getSpeakers()
     @endpoints.method(message_types.VoidMessage, SpeakerForms,
             path='speakers',
             http_method='GET', name='getSpeakers')
+    @profiling.profiled
     def getSpeakers(self, request):
         """Return all speakers"""
         speakers = Speaker.query()
@@ -762,7 +1192,8 @@ class ConferenceApi(remote.Service):
 # - - - Registration - - - - - - - - - - - - - - - - - - - -
 
     ## registration helpers
-    @ndb.transactional(xg=True)
+    @contention.transactional('conferenceRegistration', _requestConference,
+        xg=True)
     def _conferenceRegistration(self, request, reg=True):
         """Register or unregister user for selected conference."""
         retval = None
@@ -785,12 +1216,11 @@ class ConferenceApi(remote.Service):
 
             # check if seats avail
             if conf.seatsAvailable <= 0:
-                raise ConflictException(
+                raise SoldOutException(
                     "There are no seats available.")
 
             # register user, take away one seat
-            prof.conferenceKeysToAttend.append(wsck)
-            conf.seatsAvailable -= 1
+            registration.addRegistration(prof, conf)
             retval = True
 
         # unregister
@@ -799,36 +1229,414 @@ class ConferenceApi(remote.Service):
             if wsck in prof.conferenceKeysToAttend:
 
                 # unregister user, add back one seat
-                prof.conferenceKeysToAttend.remove(wsck)
-                conf.seatsAvailable += 1
+                registration.removeRegistration(prof, conf)
                 retval = True
             else:
                 retval = False
 
         # write things back to the datastore & return
+        if retval:
+            versions.touchConference(conf)
         prof.put()
         conf.put()
         return BooleanMessage(data=retval)
+
+    @ndb.transactional(xg=True)
+    def _registerChunk(self, p_key, c_keys):
+        """Register a profile for up to REGISTRATION_CHUNK conferences in
+        one transaction, re-checking seats; return {c_key: outcome}."""
+        prof = p_key.get()
+        outcomes = {}
+        changed = []
+        for c_key, conf in zip(c_keys, ndb.get_multi(c_keys)):
+            if not conf:
+                # deleted since the caller read it
+                outcomes[c_key] = RegistrationOutcome.NOT_FOUND
+                continue
+            wsck = conf.key.urlsafe()
+            if wsck in prof.conferenceKeysToAttend:
+                outcomes[conf.key] = RegistrationOutcome.ALREADY_REGISTERED
+            elif conf.seatsAvailable <= 0:
+                outcomes[conf.key] = RegistrationOutcome.SOLD_OUT
+            else:
+                registration.addRegistration(prof, conf)
+                versions.touchConference(conf)
+                changed.append(conf)
+                outcomes[conf.key] = RegistrationOutcome.REGISTERED
+        if changed:
+            ndb.put_multi([prof] + changed)
+        return outcomes
+
     ## end registration helpers
 
+    ## seat hold helpers
+    @staticmethod
+    def _seatHoldKey(c_key, p_key):
+        """Return the key of a profile's seat hold for a conference."""
+        return ndb.Key(SeatHold, p_key.id(), parent=c_key)
+
+    @ndb.transactional()
+    def _holdSeat(self, c_key, p_key):
+        """Take a seat from a conference for SEAT_HOLD_SECONDS.
+
+        Only touches the conference entity group. Holding again while a
+        hold exists just extends it, up to SEAT_HOLD_MAX_SECONDS after
+        the hold was made.
+        """
+        conf = c_key.get()
+        if not conf:
+            raise endpoints.NotFoundException(
+                'No conference found with key: %s' % c_key.urlsafe())
+
+        now = datetime.utcnow()
+        hold_key = self._seatHoldKey(c_key, p_key)
+        hold = hold_key.get()
+        if not hold:
+            if conf.seatsAvailable <= 0:
+                raise SoldOutException("There are no seats available.")
+            conf.seatsAvailable -= 1
+            versions.touchConference(conf)
+            conf.put()
+            hold = SeatHold(key=hold_key, created=now)
+        # holds made before they recorded their creation
+        created = hold.created or \
+            hold.expires - timedelta(seconds=SEAT_HOLD_SECONDS)
+        latest = created + timedelta(seconds=SEAT_HOLD_MAX_SECONDS)
+        if now >= latest:
+            raise ConflictException(
+                "Your seat hold cannot be extended any further.")
+        hold.expires = min(now + timedelta(seconds=SEAT_HOLD_SECONDS), latest)
+        hold.put()
+        return hold
+
+    @ndb.transactional(xg=True)
+    def _confirmSeatHold(self, c_key, p_key):
+        """Turn an unexpired seat hold into a registration."""
+        hold_key = self._seatHoldKey(c_key, p_key)
+        hold = hold_key.get()
+        if not hold or hold.expires < datetime.utcnow():
+            raise ConflictException(
+                "You have no seat on hold for this conference.")
+
+        prof = p_key.get()
+        if c_key.urlsafe() in prof.conferenceKeysToAttend:
+            raise ConflictException(
+                "You have already registered for this conference")
+        # the seat was taken when the hold was made
+        conf = c_key.get()
+        registration.addRegistration(prof, conf, seatTaken=True)
+        prof.put()
+        conf.put()
+        hold_key.delete()
+
+    ## end seat hold helpers
+
+    ## waitlist helpers
+    @staticmethod
+    def _waitlistEntryKey(c_key, p_key):
+        """Return the key of a profile's waitlist entry for a conference."""
+        return ndb.Key(WaitlistEntry, '%s|%s' % (c_key.urlsafe(), p_key.id()))
+
+    def _joinWaitlist(self, prof, c_key):
+        """Put a profile on the waitlist of a conference (idempotent) and
+        return its WaitlistEntry."""
+        return WaitlistEntry.get_or_insert(
+            self._waitlistEntryKey(c_key, prof.key).id(),
+            conference=c_key, profile=prof.key)
+
+    def _getProfileAndConference(self, request):
+        """Return the current user's Profile and the requested Conference,
+        checking that the conference exists."""
+        prof = self._getProfileFromUser() # get user Profile
+        try:
+            c_key = ndb.Key(urlsafe=request.websafeConferenceKey)
+        except Exception:
+            raise endpoints.BadRequestException(
+                'websafeConferenceKey given is corrupted')
+        conf = c_key.get()
+        if not conf:
+            raise endpoints.NotFoundException(
+                'No conference found with key: %s' % request.websafeConferenceKey)
+        return prof, conf
+
+    ## end waitlist helpers
+
     ## registration api methods
     # /conference/{websafeConferenceKey}, POST, registerForConference()
-    @endpoints.method(CONF_GET_REQUEST, BooleanMessage,
+    @endpoints.method(CONF_GET_REQUEST, RegistrationForm,
             path='conference/{websafeConferenceKey}',
             http_method='POST', name='registerForConference')
+    @ratelimit.rateLimited('registerForConference')
+    @profiling.profiled
     def registerForConference(self, request):
-        """Register user for selected conference."""
-        return self._conferenceRegistration(request)
+        """Register user for selected conference; put user on the
+        waitlist if it is sold out.
+
+        A sold-out conference is not an error: the response says that
+        the user is waitlisted and where, so clients do not retry.
+        """
+        try:
+            retval = self._conferenceRegistration(request)
+        except SoldOutException:
+            prof, conf = self._getProfileAndConference(request)
+            entry = self._joinWaitlist(prof, conf.key)
+            return RegistrationForm(data=False, waitlisted=True,
+                waitlistPosition=registration.waitlistPosition(entry))
+        return RegistrationForm(data=retval.data, waitlisted=False)
+
+    # /conferences/register, POST, registerForConferences()
+    @endpoints.method(RegistrationBatchForm, RegistrationOutcomeForms,
+            path='conferences/register',
+            http_method='POST', name='registerForConferences')
+    @ratelimit.rateLimited('registerForConferences')
+    @profiling.profiled
+    def registerForConferences(self, request):
+        """Register user for several conferences at once, returning the
+        outcome per conference. Sold-out conferences are skipped."""
+        if len(request.websafeConferenceKeys) > REGISTRATION_BATCH_MAX:
+            raise endpoints.BadRequestException(
+                'At most %d conferences per request' % REGISTRATION_BATCH_MAX)
+        prof = self._getProfileFromUser() # get user Profile
+
+        # outcomes of invalid keys by the string given, of the others by
+        # key: the same conference may be given in different spellings
+        invalid = {}
+        outcomes = {}
+        keyOf = {}
+        keys = []
+        for wsck in request.websafeConferenceKeys:
+            try:
+                c_key = ndb.Key(urlsafe=wsck)
+            except Exception:
+                invalid[wsck] = RegistrationOutcome.INVALID_KEY
+                continue
+            if c_key.kind() != Conference._get_kind():
+                invalid[wsck] = RegistrationOutcome.INVALID_KEY
+                continue
+            keyOf[wsck] = c_key
+            if c_key not in keys:
+                keys.append(c_key)
+
+        # weed out what cannot succeed with one batch read; the
+        # transactions below re-check everything
+        candidates = []
+        for c_key, conf in zip(keys, ndb.get_multi(keys)):
+            if not conf:
+                outcomes[c_key] = RegistrationOutcome.NOT_FOUND
+            elif c_key.urlsafe() in prof.conferenceKeysToAttend:
+                outcomes[c_key] = RegistrationOutcome.ALREADY_REGISTERED
+            elif conf.seatsAvailable <= 0:
+                outcomes[c_key] = RegistrationOutcome.SOLD_OUT
+            else:
+                candidates.append(c_key)
+
+        for i in range(0, len(candidates), REGISTRATION_CHUNK):
+            chunk = candidates[i:i + REGISTRATION_CHUNK]
+            try:
+                result = self._registerChunk(prof.key, chunk)
+            except datastore_errors.TransactionFailedError:
+                logging.warning('Batch registration of %s failed for %d '
+                    'conferences', prof.key.id(), len(chunk))
+                result = dict((c_key, RegistrationOutcome.FAILED)
+                    for c_key in chunk)
+            outcomes.update(result)
+
+        return RegistrationOutcomeForms(items=[
+            RegistrationOutcomeForm(websafeConferenceKey=websafeKey,
+                outcome=invalid[websafeKey] if websafeKey in invalid
+                    else outcomes[keyOf[websafeKey]])
+            for websafeKey in request.websafeConferenceKeys])
 
     # /conference/{websafeConferenceKey}, DELETE, unregisterFromConference()
     @endpoints.method(CONF_GET_REQUEST, BooleanMessage,
             path='conference/{websafeConferenceKey}',
             http_method='DELETE', name='unregisterFromConference')
+    @profiling.profiled
     def unregisterFromConference(self, request):
         """Unregister user for selected conference."""
-        return self._conferenceRegistration(request, reg=False)
+        retval = self._conferenceRegistration(request, reg=False)
+        # hand the freed seat to the waitlist
+        if retval.data:
+            registration.enqueueWaitlistPromotion(request.websafeConferenceKey)
+        return retval
     ## end registration api methods
 
+    ## waitlist api methods
+    # /conference/{websafeConferenceKey}/waitlist, POST, joinWaitlist()
+    @endpoints.method(CONF_GET_REQUEST, WaitlistForm,
+            path='conference/{websafeConferenceKey}/waitlist',
+            http_method='POST', name='joinWaitlist')
+    @profiling.profiled
+    def joinWaitlist(self, request):
+        """Put user on the waitlist of a sold-out conference."""
+        prof, conf = self._getProfileAndConference(request)
+        if request.websafeConferenceKey in prof.conferenceKeysToAttend:
+            raise ConflictException(
+                "You have already registered for this conference")
+        if conf.seatsAvailable > 0:
+            raise endpoints.BadRequestException(
+                "Seats are available; register for the conference instead.")
+        entry = self._joinWaitlist(prof, conf.key)
+        return WaitlistForm(websafeConferenceKey=request.websafeConferenceKey,
+            position=registration.waitlistPosition(entry))
+
+    # /conference/{websafeConferenceKey}/waitlist, GET, getWaitlistPosition()
+    @endpoints.method(CONF_GET_REQUEST, WaitlistForm,
+            path='conference/{websafeConferenceKey}/waitlist',
+            http_method='GET', name='getWaitlistPosition')
+    @profiling.profiled
+    def getWaitlistPosition(self, request):
+        """Return user's position on the waitlist of a conference."""
+        prof, conf = self._getProfileAndConference(request)
+        entry = self._waitlistEntryKey(conf.key, prof.key).get()
+        if not entry:
+            raise endpoints.NotFoundException(
+                'You are not on the waitlist of this conference.')
+        return WaitlistForm(websafeConferenceKey=request.websafeConferenceKey,
+            position=registration.waitlistPosition(entry))
+
+    # /conference/{websafeConferenceKey}/waitlist, DELETE, leaveWaitlist()
+    @endpoints.method(CONF_GET_REQUEST, BooleanMessage,
+            path='conference/{websafeConferenceKey}/waitlist',
+            http_method='DELETE', name='leaveWaitlist')
+    @profiling.profiled
+    def leaveWaitlist(self, request):
+        """Take user off the waitlist of a conference."""
+        prof, conf = self._getProfileAndConference(request)
+        e_key = self._waitlistEntryKey(conf.key, prof.key)
+        if not e_key.get():
+            return BooleanMessage(data=False)
+        e_key.delete()
+        registration.waitlistChanged(conf.key)
+        return BooleanMessage(data=True)
+    ## end waitlist api methods
+
+    ## seat hold api methods
+    # /conference/{websafeConferenceKey}/hold, POST, holdSeat()
+    @endpoints.method(CONF_GET_REQUEST, SeatHoldForm,
+            path='conference/{websafeConferenceKey}/hold',
+            http_method='POST', name='holdSeat')
+    @ratelimit.rateLimited('holdSeat')
+    @profiling.profiled
+    def holdSeat(self, request):
+        """Hold a seat at selected conference for a few minutes."""
+        prof, conf = self._getProfileAndConference(request)
+        if request.websafeConferenceKey in prof.conferenceKeysToAttend:
+            raise ConflictException(
+                "You have already registered for this conference")
+        hold = self._holdSeat(conf.key, prof.key)
+        return SeatHoldForm(websafeConferenceKey=request.websafeConferenceKey,
+            expires=str(hold.expires))
+
+    # /conference/{websafeConferenceKey}/hold/confirm, POST, confirmSeatHold()
+    @endpoints.method(CONF_GET_REQUEST, BooleanMessage,
+            path='conference/{websafeConferenceKey}/hold/confirm',
+            http_method='POST', name='confirmSeatHold')
+    @profiling.profiled
+    def confirmSeatHold(self, request):
+        """Register user for selected conference using a held seat."""
+        prof, conf = self._getProfileAndConference(request)
+        self._confirmSeatHold(conf.key, prof.key)
+        return BooleanMessage(data=True)
+    ## end seat hold api methods
+
+    ## attendee api methods
+    # /conference/{websafeConferenceKey}/attendees, GET, getConferenceAttendees()
+    @endpoints.method(ATTENDEES_GET_REQUEST, AttendeeForms,
+            path='conference/{websafeConferenceKey}/attendees',
+            http_method='GET', name='getConferenceAttendees')
+    @profiling.profiled
+    def getConferenceAttendees(self, request):
+        """Return one page of the attendees of a conference (organizer
+        only) along with the total attendee count."""
+        user = endpoints.get_current_user()
+        if not user:
+            raise endpoints.UnauthorizedException('Authorization required')
+        user_id = getUserId(user)
+
+        try:
+            c_key = ndb.Key(urlsafe=request.websafeConferenceKey)
+        except Exception:
+            raise endpoints.BadRequestException(
+                'websafeConferenceKey given is corrupted')
+        conf = c_key.get()
+        if not conf:
+            raise endpoints.NotFoundException(
+                'No conference found with key: %s' % request.websafeConferenceKey)
+        if user_id != conf.organizerUserId:
+            raise endpoints.ForbiddenException(
+                'Only the organizer can see the attendees.')
+
+        try:
+            cursor = Cursor(urlsafe=request.pageToken) if request.pageToken else None
+        except Exception:
+            raise endpoints.BadRequestException('pageToken given is corrupted')
+        limit = min(request.limit or ATTENDEES_PAGE_SIZE, 1000)
+        attendees, next_cursor, more = Attendee.query(ancestor=c_key
+            ).fetch_page(limit, start_cursor=cursor)
+
+        registration.initAttendeeCount(conf)
+        return AttendeeForms(
+            items=[AttendeeForm(userId=attendee.key.id(),
+                displayName=attendee.displayName,
+                mainEmail=attendee.mainEmail,
+                registered=str(attendee.registered))
+                for attendee in attendees],
+            count=conf.attendeeCount,
+            nextPageToken=next_cursor.urlsafe() if more and next_cursor else None
+        )
+
+    # /conference/{websafeConferenceKey}/registrations, GET, getRegistrationStats()
+    @endpoints.method(REGISTRATION_STATS_REQUEST, RegistrationStatsForm,
+            path='conference/{websafeConferenceKey}/registrations',
+            http_method='GET', name='getRegistrationStats')
+    @profiling.profiled
+    def getRegistrationStats(self, request):
+        """Return registrations per hour (or day) of a conference, with a
+        sell-out forecast (organizer only). The series is aggregated
+        offline, so the last few hours may still be missing."""
+        user = endpoints.get_current_user()
+        if not user:
+            raise endpoints.UnauthorizedException('Authorization required')
+        user_id = getUserId(user)
+
+        granularity = request.granularity or 'hour'
+        if granularity not in analytics.GRANULARITIES:
+            raise endpoints.BadRequestException(
+                "'granularity' must be one of: %s"
+                % ', '.join(analytics.GRANULARITIES))
+        try:
+            c_key = ndb.Key(urlsafe=request.websafeConferenceKey)
+        except Exception:
+            raise endpoints.BadRequestException(
+                'websafeConferenceKey given is corrupted')
+        conf = c_key.get()
+        if not conf:
+            raise endpoints.NotFoundException(
+                'No conference found with key: %s' % request.websafeConferenceKey)
+        if user_id != conf.organizerUserId:
+            raise endpoints.ForbiddenException(
+                'Only the organizer can see registration stats.')
+
+        stats = analytics.getRegistrationStats(request.websafeConferenceKey,
+            granularity)
+        soldOut = analytics.forecastSoldOut(
+            analytics.getRegistrationStats(request.websafeConferenceKey, 'hour')
+                if granularity != 'hour' else stats,
+            conf.seatsAvailable)
+        return RegistrationStatsForm(
+            websafeConferenceKey=request.websafeConferenceKey,
+            granularity=granularity,
+            items=[RegistrationStatForm(bucket=str(stat.bucket),
+                registrations=stat.registrations,
+                cancellations=stat.cancellations,
+                net=stat.registrations - stat.cancellations)
+                for stat in stats],
+            seatsAvailable=conf.seatsAvailable,
+            forecastSoldOut=str(soldOut) if soldOut else None
+        )
+    ## end attendee api methods
+
 # - - - Wishlist - - - - - - - - - - - - - - - - - - - - - -
 
     ## wishlist helpers
@@ -879,6 +1687,8 @@ class ConferenceApi(remote.Service):
     @endpoints.method(WISHLIST_REQUEST, BooleanMessage,
             path='wishlist/{websafeSessionKey}',
             http_method='POST', name='addSessionToWishlist')
+    @ratelimit.rateLimited('addSessionToWishlist')
+    @profiling.profiled
     def addSessionToWishlist(self, request):
         """Add session to user's wishlist."""
         return self._wishlistToggle(request)
@@ -887,6 +1697,7 @@ class ConferenceApi(remote.Service):
     @endpoints.method(WISHLIST_REQUEST, BooleanMessage,
             path='wishlist/{websafeSessionKey}',
             http_method='DELETE', name='removeSessionFromWishlist')
+    @profiling.profiled
     def removeSessionFromWishlist(self, request):
         """Remove session from user's wishlist."""
         return self._wishlistToggle(request, add=False)
@@ -895,14 +1706,17 @@ class ConferenceApi(remote.Service):
     @endpoints.method(message_types.VoidMessage, SessionForms,
             path='wishlist',
             http_method='GET', name='getWishlistSessions')
+    @profiling.profiled
     def getWishlistSessions(self, request):
         """Return all sessions on user's wishlist"""
         prof = self._getProfileFromUser() # get user Profile
         session_keys = [ndb.Key(urlsafe=wssk) for wssk in prof.sessionWishlist]
-        sessions = ndb.get_multi(session_keys)
+        # skip sessions deleted since
+        sessions = [session for session in ndb.get_multi(session_keys)
+            if session]
 
         # return set of SessionForm objects
-        return SessionForms(items=[self._copySessionToForm(session) \
+        return SessionForms(items=[schedule.copySessionToForm(session) \
             for session in sessions]
         )
 
@@ -910,6 +1724,7 @@ class ConferenceApi(remote.Service):
     @endpoints.method(CONF_WISHLIST_GET_REQUEST, SessionForms,
         path='wishlist/{websafeConferenceKey}',
         http_method='GET', name='getSessionsInWishlist')
+    @profiling.profiled
     def getSessionsInWishlist(self, request):
         """Return all sessions on user's wishlist in a given conference"""
         prof = self._getProfileFromUser() # get user Profile
@@ -925,7 +1740,7 @@ class ConferenceApi(remote.Service):
         sessions = sessions.filter(Session.key.IN(wl_session_keys))
 
         # return set of SessionForm objects
-        return SessionForms(items=[self._copySessionToForm(session) \
+        return SessionForms(items=[schedule.copySessionToForm(session) \
             for session in sessions]
         )
 
@@ -964,39 +1779,42 @@ class ConferenceApi(remote.Service):
         return (inequality_field, formatted_filters)
     ## end search & filtering helpers
 
-# - - - Announcements - - - - - - - - - - - - - - - - - - - -
-
-    @staticmethod
-    def _cacheAnnouncement():
-        """Create Announcement & assign to memcache; used by
-        memcache cron job & putAnnouncement().
-        """
-        confs = Conference.query(ndb.AND(
-            Conference.seatsAvailable <= 5,
-            Conference.seatsAvailable > 0)
-        ).fetch(projection=[Conference.name])
-
-        if confs:
-            # If there are almost sold out conferences,
-            # format announcement and set it in memcache
-            announcement = ANNOUNCEMENT_TPL % (
-                ', '.join(conf.name for conf in confs))
-            memcache.set(MEMCACHE_ANNOUNCEMENTS_KEY, announcement)
-        else:
-            # If there are no sold out conferences,
-            # delete the memcache announcements entry
-            announcement = ""
-            memcache.delete(MEMCACHE_ANNOUNCEMENTS_KEY)
+# - - - Facet counts - - - - - - - - - - - - - - - - - - - -
+
+    # /conferences/facets, POST, getConferenceFacets()
+    @endpoints.method(FacetQueryForm, FacetForms,
+            path='conferences/facets',
+            http_method='POST', name='getConferenceFacets')
+    @profiling.profiled
+    def getConferenceFacets(self, request):
+        """Return conference counts per city, month and topic, optionally
+        within one filter (e.g. field CITY, value London)."""
+        context = ''
+        if request.field:
+            try:
+                field = CONF_FIELDS[request.field]
+            except KeyError:
+                raise endpoints.BadRequestException(
+                    "Filter contains invalid field.")
+            if field not in facets.FACET_FIELDS:
+                raise endpoints.BadRequestException(
+                    "Facets are only counted for CITY, MONTH and TOPIC.")
+            context = '%s=%s' % (field, request.value)
 
-        return announcement
+        totals = facets.getFacetCounts(context)
+        return FacetForms(items=[FacetForm(field=f, value=v, count=n)
+            for (f, v), n in sorted(totals.items()) if n > 0])
 
+# - - - Announcements - - - - - - - - - - - - - - - - - - - -
 
     @endpoints.method(message_types.VoidMessage, StringMessage,
             path='conference/announcement/get',
             http_method='GET', name='getAnnouncement')
+    @profiling.profiled
     def getAnnouncement(self, request):
-        """Return Announcement from memcache."""
-        return StringMessage(data=memcache.get(MEMCACHE_ANNOUNCEMENTS_KEY) or "")
+        """Return Announcement from cache."""
+        return StringMessage(
+            data=announcements.getAnnouncement())
 
 # - - - Query showcase (task 3)- - - - - - - - - - - - - - -
 
@@ -1004,6 +1822,7 @@ class ConferenceApi(remote.Service):
     # /topics, 'GET', getTopics()
     @endpoints.method(message_types.VoidMessage, TopicForms,
         path='topics', http_method='GET', name='getTopics')
+    @profiling.profiled
     def getTopics(self, request):
         """Return a list of all topics"""
         topics = set()
@@ -1020,6 +1839,7 @@ class ConferenceApi(remote.Service):
     @endpoints.method(TopicForm, ConferenceForms,
         path='/conferencesbytopic',
         http_method='POST', name='getConferencesByTopic')
+    @profiling.profiled
     def getConferencesByTopic(self, request):
         """Return all conferences on a given topic"""
         confs = Conference.query()
@@ -1047,6 +1867,7 @@ class ConferenceApi(remote.Service):
     @endpoints.method(SESSIONS_BEFORE_EXCLUDING_POST_REQUEST, SessionForms,
         path='sessionquery/{websafeConferenceKey}',
         http_method='POST', name='getSessionsBeforeExcluding')
+    @profiling.profiled
     def getSessionsBeforeExcluding(self, request):
         """Return all session after the given time and not matching the
         given session type."""
@@ -1067,47 +1888,21 @@ class ConferenceApi(remote.Service):
         sessions = rightTimeSessions.filter(Session.key.IN(filter_keys))
 
         # return set of SessionForm objects
-        return SessionForms(items=[self._copySessionToForm(session) \
+        return SessionForms(items=[schedule.copySessionToForm(session) \
             for session in sessions]
         )
 
 # - - - Featured speaker (task 4)  - - - - - - - - - - - - -
 
-    @staticmethod
-    def _cacheFeaturedSpeaker(websafeConferenceKey, websafeSpeakerKey):
-        """Find featured speaker & assign to memcache; used by
-        getFeaturedSpeaker().
-        """
-        c_key = ndb.Key(urlsafe=websafeConferenceKey)
-        sp_key = ndb.Key(urlsafe=websafeSpeakerKey)
-        sessions = Session.query(ancestor=c_key)
-        sessions = sessions.filter(Session.speaker==sp_key)
-
-        if sessions.count() > 1:
-            # if there is more than one session for this
-            # speaker, format a featured speaker announcement
-            # and put it to memcache
-            # this will overwrite the last featured speaker
-            sessionNames = ", ".join([session.sessionName for session in sessions])
-            speaker = sp_key.get()
-            conf    = c_key.get()
-
-            announcement = FEATURED_SPEAKER_TPL % (
-                conf.name, speaker.name, sessionNames)
-
-            memcache.set(MEMCACHE_FEATURED_SPEAKER_KEY, announcement)
-        else:
-            announcement = ""
-
-        return announcement
-
     # /featuredspeaker, GET, getFeaturedSpeaker()
     @endpoints.method(message_types.VoidMessage, StringMessage,
             path='featuredspeaker',
             http_method='GET', name='getFeaturedSpeaker')
+    @profiling.profiled
     def getFeaturedSpeaker(self, request):
-        """Return Featured Speaker from memcache."""
-        return StringMessage(data=memcache.get(MEMCACHE_FEATURED_SPEAKER_KEY) or "")
+        """Return Featured Speaker from cache."""
+        return StringMessage(
+            data=announcements.getFeaturedSpeaker())
 
 
 # - - - API registration - - - - - - - - - - - - - - - - - -
@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+
+"""
+contention.py -- Udacity conference server-side Python App Engine
+    transactions with jittered backoff and per entity group contention
+    telemetry, kept in memcache
+
+"""
+
+import functools
+import logging
+import random
+import time
+
+from google.appengine.api import datastore_errors
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+
+from cache import casUpdate
+from settings import DEFAULT_TRANSACTION_RETRY
+from settings import TRANSACTION_RETRIES
+
+BACKOFF_BASE_SECONDS = 0.05
+BACKOFF_MAX_SECONDS = 1.0
+# counters are kept per window; the report sums the latest windows
+STATS_WINDOW_SECONDS = 3600
+MEMCACHE_COUNTER_PREFIX = 'TXSTATS_'
+MEMCACHE_COUNTER_TPL = '%d_%s_%s_%s'      # window, name, group, counter
+MEMCACHE_SEEN_TPL = 'TXSTATS_SEEN_%d_%s_%s'
+MEMCACHE_GROUPS_TPL = 'TXSTATS_GROUPS_%d'
+COUNTERS = ('calls', 'attempts', 'conflicts', 'failures', 'millis')
+# (name, group) pairs indexed per window; the rest are counted but not
+# reported
+MAX_GROUPS_PER_WINDOW = 1000
+
+
+def _window(now=None):
+    return int((now or time.time()) // STATS_WINDOW_SECONDS)
+
+
+def _indexGroup(window, name, group):
+    """Add (name, group) to the groups of a window, once per window."""
+    if not memcache.add(MEMCACHE_SEEN_TPL % (window, name, group), 1,
+                        time=2 * STATS_WINDOW_SECONDS):
+        return
+
+    def merge(groups):
+        groups = groups or []
+        if len(groups) >= MAX_GROUPS_PER_WINDOW:
+            return None
+        return groups + [(name, group)]
+
+    if not casUpdate(MEMCACHE_GROUPS_TPL % window, merge,
+                     ttl=2 * STATS_WINDOW_SECONDS):
+        logging.info('Transaction stats of %s on %s not indexed', name,
+                     group)
+
+
+def _record(name, group, attempts, conflicts, failed, seconds):
+    window = _window()
+    counts = {'calls': 1, 'attempts': attempts, 'conflicts': conflicts,
+              'failures': int(failed), 'millis': int(seconds * 1000)}
+    memcache.offset_multi(dict(
+        (MEMCACHE_COUNTER_TPL % (window, name, group, counter), delta)
+        for counter, delta in counts.items() if delta),
+        key_prefix=MEMCACHE_COUNTER_PREFIX, initial_value=0)
+    _indexGroup(window, name, group)
+
+
+def transactional(name, groupOf, xg=False):
+    """Decorate a function to run in a transaction that is retried with
+    jittered exponential backoff within the budget
+    TRANSACTION_RETRIES[name], counting attempts, conflicts, give-ups
+    and time spent per entity group (groupOf(*args, **kwds)).
+
+    ndb's own retries are turned off so that every attempt is seen.
+    Called within a transaction, the function just joins it.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwds):
+            if ndb.in_transaction():
+                return func(*args, **kwds)
+            retries, budget = TRANSACTION_RETRIES.get(name,
+                DEFAULT_TRANSACTION_RETRY)
+            group = groupOf(*args, **kwds)
+            started = time.time()
+            attempts = conflicts = 0
+            failed = False
+            backoff = BACKOFF_BASE_SECONDS
+            try:
+                while True:
+                    attempts += 1
+                    try:
+                        return ndb.transaction(lambda: func(*args, **kwds),
+                                               retries=0, xg=xg)
+                    except datastore_errors.TransactionFailedError:
+                        conflicts += 1
+                        # "full jitter": colliding callers spread out
+                        # instead of colliding again in lockstep
+                        delay = random.uniform(0, backoff)
+                        if attempts > retries or \
+                                time.time() + delay - started > budget:
+                            failed = True
+                            raise
+                        time.sleep(delay)
+                        backoff = min(2 * backoff, BACKOFF_MAX_SECONDS)
+            finally:
+                try:
+                    _record(name, group, attempts, conflicts, failed,
+                            time.time() - started)
+                except Exception:
+                    logging.exception('Recording transaction stats of %s '
+                                      'failed', name)
+        return wrapper
+    return decorator
+
+
+def transactionStats(windows=2, limit=20):
+    """Return the `limit` hottest (name, entity group) pairs of the
+    latest `windows` stats windows, most conflicts first."""
+    current = _window()
+    pairs = set()
+    for window in range(current - windows + 1, current + 1):
+        for name, group in memcache.get(MEMCACHE_GROUPS_TPL % window) or []:
+            pairs.add((window, name, group))
+    counters = memcache.get_multi(
+        [MEMCACHE_COUNTER_TPL % (window, name, group, counter)
+         for window, name, group in pairs for counter in COUNTERS],
+        key_prefix=MEMCACHE_COUNTER_PREFIX)
+
+    totals = {}
+    for window, name, group in pairs:
+        total = totals.setdefault((name, group), dict.fromkeys(COUNTERS, 0))
+        for counter in COUNTERS:
+            total[counter] += counters.get(MEMCACHE_COUNTER_TPL % (
+                window, name, group, counter), 0)
+
+    hottest = sorted(totals.items(), key=lambda (_, t):
+                     (t['conflicts'], t['millis']), reverse=True)[:limit]
+    names = _groupNames([group for (_, group), _ in hottest])
+    report = []
+    for ((name, group), counts), groupName in zip(hottest, names):
+        report.append(dict(counts, transaction=name, group=group,
+            groupName=groupName,
+            conflictRate=round(counts['conflicts'] /
+                               float(counts['attempts'] or 1), 3),
+            meanMillis=counts['millis'] // (counts['calls'] or 1)))
+    return report
+
+def _groupNames(groups):
+    """Return the names of the entities with the given websafe keys,
+    None for keys that are corrupt or have no name."""
+    keys = []
+    for group in groups:
+        try:
+            keys.append(ndb.Key(urlsafe=group))
+        except Exception:
+            keys.append(None)
+    entities = ndb.get_multi([key for key in keys if key])
+    # groups are mostly organizers' profiles
+    names = dict((entity.key, getattr(entity, 'name', None) or
+                  getattr(entity, 'displayName', None))
+                 for entity in entities if entity)
+    return [names.get(key) for key in keys]
@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+
+"""
+deletion.py -- Udacity conference server-side Python App Engine
+    cascading conference deletion: after the Conference entity is gone,
+    chained tasks delete its children and strip references to it from
+    profiles, one bounded batch per task
+
+"""
+
+import logging
+
+from google.appengine.api import memcache
+from google.appengine.api import taskqueue
+from google.appengine.datastore.datastore_query import Cursor
+from google.appengine.ext import ndb
+
+from models import Attendee
+from models import Profile
+from models import ScheduleSnapshot
+from models import Session
+from models import WaitlistEntry
+
+import schedule
+import sync
+
+DELETE_URL = '/tasks/delete_conference'
+DELETE_BATCH = 500
+PROFILE_BATCH = 100
+# sessions per batch; their keys go into IN queries of at most 30 values
+SESSION_BATCH = 90
+IN_QUERY_MAX = 30
+
+# phases of a deletion, in order
+PHASES = ('sessions', 'attendees', 'children', 'profiles', 'waitlist')
+
+
+def enqueueConferenceDeletion(websafeConferenceKey, phase=PHASES[0],
+                              cursor=None, transactional=False):
+    """Schedule (the next batch of) cleaning up after a deleted
+    conference."""
+    params = {'websafeConferenceKey': websafeConferenceKey, 'phase': phase}
+    if cursor:
+        params['cursor'] = cursor.urlsafe()
+    taskqueue.add(params=params, url=DELETE_URL, transactional=transactional)
+
+
+@ndb.transactional_tasklet()
+def _stripProfile(p_key, websafeConferenceKey, websafeSessionKeys):
+    """Remove a conference registration and wishlisted sessions from a
+    profile."""
+    prof = yield p_key.get_async()
+    if not prof:
+        return
+    attend = [wsck for wsck in prof.conferenceKeysToAttend
+        if wsck != websafeConferenceKey]
+    wishlist = [wssk for wssk in prof.sessionWishlist
+        if wssk not in websafeSessionKeys]
+    if (len(attend) != len(prof.conferenceKeysToAttend) or
+            len(wishlist) != len(prof.sessionWishlist)):
+        prof.conferenceKeysToAttend = attend
+        prof.sessionWishlist = wishlist
+        yield prof.put_async()
+
+
+def _stripProfiles(p_keys, websafeConferenceKey, websafeSessionKeys=()):
+    """Strip references from profiles, one transaction each, all in
+    parallel."""
+    websafeSessionKeys = set(websafeSessionKeys)
+    ndb.Future.wait_all([
+        _stripProfile(p_key, websafeConferenceKey, websafeSessionKeys)
+        for p_key in set(p_keys)])
+
+
+def _deleteSessions(c_key):
+    """Take a batch of sessions off all wishlists, then delete them."""
+    s_keys = Session.query(ancestor=c_key).fetch(SESSION_BATCH,
+        keys_only=True)
+    wssks = [s_key.urlsafe() for s_key in s_keys]
+    p_keys = []
+    for i in range(0, len(wssks), IN_QUERY_MAX):
+        p_keys.extend(Profile.query(
+            Profile.sessionWishlist.IN(wssks[i:i + IN_QUERY_MAX])
+            ).fetch(keys_only=True))
+    _stripProfiles(p_keys, c_key.urlsafe(), wssks)
+    ndb.put_multi([sync.tombstone(s_key, c_key) for s_key in s_keys])
+    ndb.delete_multi(s_keys)
+    return len(s_keys) == SESSION_BATCH, None
+
+
+def _deleteAttendees(c_key):
+    """Unregister a batch of attendees on the roster, then delete their
+    roster entries."""
+    a_keys = Attendee.query(ancestor=c_key).fetch(PROFILE_BATCH,
+        keys_only=True)
+    _stripProfiles([ndb.Key(Profile, a_key.id()) for a_key in a_keys],
+        c_key.urlsafe())
+    ndb.delete_multi(a_keys)
+    return len(a_keys) == PROFILE_BATCH, None
+
+
+def _deleteChildren(c_key):
+    """Delete a batch of remaining children (e.g. seat holds)."""
+    keys = ndb.Query(ancestor=c_key).fetch(DELETE_BATCH, keys_only=True)
+    ndb.delete_multi(keys)
+    return len(keys) == DELETE_BATCH, None
+
+
+def _stripRemainingProfiles(c_key, cursor):
+    """Unregister a batch of profiles that registered before the roster
+    was kept."""
+    p_keys, next_cursor, more = Profile.query(
+        Profile.conferenceKeysToAttend == c_key.urlsafe()
+        ).fetch_page(PROFILE_BATCH, start_cursor=cursor, keys_only=True)
+    _stripProfiles(p_keys, c_key.urlsafe())
+    return more, next_cursor
+
+
+def _deleteWaitlist(c_key, cursor):
+    """Delete a batch of waitlist entries."""
+    e_keys, next_cursor, more = WaitlistEntry.query(
+        WaitlistEntry.conference == c_key
+        ).fetch_page(DELETE_BATCH, start_cursor=cursor, keys_only=True)
+    ndb.delete_multi(e_keys)
+    return more, next_cursor
+
+
+def deleteConferenceBatch(websafeConferenceKey, phase, cursor=None):
+    """Run one batch of a phase of cleaning up after a deleted
+    conference and chain the task for the next one."""
+    c_key = ndb.Key(urlsafe=websafeConferenceKey)
+    if c_key.get() is not None:
+        # only ever clean up after a conference that is really gone
+        logging.warning('Not cleaning up after live conference %s',
+                        websafeConferenceKey)
+        return
+    if phase == 'sessions':
+        more, next_cursor = _deleteSessions(c_key)
+    elif phase == 'attendees':
+        more, next_cursor = _deleteAttendees(c_key)
+    elif phase == 'children':
+        more, next_cursor = _deleteChildren(c_key)
+    elif phase == 'profiles':
+        more, next_cursor = _stripRemainingProfiles(c_key, cursor)
+    else:
+        more, next_cursor = _deleteWaitlist(c_key, cursor)
+
+    if more:
+        enqueueConferenceDeletion(websafeConferenceKey, phase, next_cursor)
+    elif phase != PHASES[-1]:
+        enqueueConferenceDeletion(websafeConferenceKey,
+            PHASES[PHASES.index(phase) + 1])
+    else:
+        memcache.delete(schedule.MEMCACHE_SCHEDULE_SNAPSHOT_KEY %
+            websafeConferenceKey)
+        ndb.Key(ScheduleSnapshot, websafeConferenceKey).delete()
+
+
+def parseCursor(urlsafe):
+    """Return the Cursor for a task parameter, or None."""
+    return Cursor(urlsafe=urlsafe) if urlsafe else None
@@ -0,0 +1,315 @@
+#!/usr/bin/env python
+
+"""
+facets.py -- Udacity conference server-side Python App Engine
+    incrementally maintained, sharded conference counts per
+    city, month and topic
+
+"""
+
+import json
+import logging
+import random
+from datetime import datetime
+from datetime import timedelta
+
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+
+from models import Conference
+from models import ConferenceFacetShard
+from models import FacetConferenceVersion
+from models import FacetDelta
+from models import FacetGeneration
+from models import Tombstone
+
+FACET_SHARDS = 10
+FACET_FIELDS = ('city', 'month', 'topics')
+FACET_REBUILD_BATCH = 200
+FACET_DELTA_URL = '/tasks/apply_facet_delta'
+# a rebuild running longer than this is taken for dead: deltas stop
+# waiting for it, and it may not switch generations any more
+FACET_REBUILD_TIMEOUT = timedelta(minutes=15)
+GENERATION_KEY = ndb.Key(FacetGeneration, 'facets')
+
+
+class FacetRebuildInProgress(Exception):
+    """A delta cannot be applied until the running rebuild is done."""
+
+
+def conferenceFacets(conf):
+    """Return the facet counts a conference contributes to, as a dict
+    of filter context -> facet -> value -> 1.
+
+    The empty context covers all conferences; 'city=London' covers the
+    conferences matching that filter, and so on for each facet value
+    of the conference.
+    """
+    values = []
+    for field in FACET_FIELDS:
+        fieldValues = getattr(conf, field)
+        if field != 'topics':
+            fieldValues = [fieldValues]
+        values.extend((field, unicode(value)) for value in fieldValues
+            if value)
+
+    contexts = [''] + ['%s=%s' % fv for fv in values]
+    facets = {}
+    for context in contexts:
+        for field, value in values:
+            facets.setdefault(context, {}).setdefault(field, {})[value] = 1
+    return facets
+
+
+def _shardKey(generation, context, shard):
+    if not generation:
+        # shards written before the first rebuild
+        return ndb.Key(ConferenceFacetShard, '%s#%d' % (context, shard))
+    return ndb.Key(ConferenceFacetShard,
+        '%d|%s#%d' % (generation, context, shard))
+
+
+def _versionKey(generation, websafeConferenceKey):
+    return ndb.Key(FacetConferenceVersion,
+        '%d|%s' % (generation, websafeConferenceKey))
+
+
+def _deltaKey(generation, websafeConferenceKey, version):
+    return ndb.Key(FacetDelta,
+        '%d|%s|%d' % (generation, websafeConferenceKey, version))
+
+
+def _rebuildRunning(pointer):
+    return bool(pointer and pointer.building and pointer.buildingSince and
+        datetime.utcnow() - pointer.buildingSince < FACET_REBUILD_TIMEOUT)
+
+
+def _generationOf(key):
+    """Return the generation in the id of a shard, version or delta key
+    (0 for shards written before the first rebuild)."""
+    prefix, sep, _ = key.id().partition('|')
+    return int(prefix) if sep and prefix.isdigit() else 0
+
+
+def enqueueFacetDelta(conf, oldFacets, newFacets, transactional=False):
+    """Schedule applying the difference between two facet sets of a
+    conference to the facet counts; `conf` is the conference as written
+    (or deleted), its version already bumped."""
+    delta = {}
+    for facets, sign in ((oldFacets, -1), (newFacets, 1)):
+        for context, fields in facets.items():
+            for field, values in fields.items():
+                for value in values:
+                    counts = delta.setdefault(context, {}).setdefault(field, {})
+                    counts[value] = counts.get(value, 0) + sign
+                    if not counts[value]:
+                        del counts[value]
+    delta = dict((context, fields) for context, fields in delta.items()
+        if any(fields.values()))
+    if delta:
+        taskqueue.add(payload=json.dumps({
+                'conference': conf.key.urlsafe(),
+                'version': conf.version or 0,
+                'delta': delta}),
+            url=FACET_DELTA_URL,
+            transactional=transactional
+        )
+
+
+def _addToFacetShard(shard_key, delta):
+    """Add a delta (facet -> value -> n) to one counter shard."""
+    shard = shard_key.get() or ConferenceFacetShard(key=shard_key)
+    counts = shard.counts or {}
+    for field, values in delta.items():
+        fieldCounts = counts.setdefault(field, {})
+        for value, n in values.items():
+            fieldCounts[value] = fieldCounts.get(value, 0) + n
+            if not fieldCounts[value]:
+                del fieldCounts[value]
+    shard.counts = counts
+    shard.put()
+
+
+@ndb.transactional(xg=True)
+def _applyContextDelta(generation, websafeConferenceKey, version, context,
+                       fields):
+    """Add one filter context of a conference change at `version` to a
+    random counter shard of `generation`, unless it was added before;
+    returns whether it was added.
+
+    Only three entity groups take part: the pointer (read, so that no
+    rebuild can start or switch generations under the write), the
+    delta's marker and the shard.
+    """
+    pointer = GENERATION_KEY.get()
+    if _rebuildRunning(pointer) or \
+            (pointer.current if pointer else 0) != generation:
+        raise FacetRebuildInProgress('facet generation %d is not current'
+            % generation)
+    if websafeConferenceKey:
+        d_key = _deltaKey(generation, websafeConferenceKey, version)
+        marker = d_key.get() or FacetDelta(key=d_key)
+        if context in marker.contexts:
+            return False
+        marker.contexts.append(context)
+        marker.put()
+    _addToFacetShard(_shardKey(generation, context,
+        random.randint(0, FACET_SHARDS - 1)), fields)
+    return True
+
+
+def _countedByRebuild(pointer, websafeConferenceKey, version):
+    """Return whether the rebuild of the current generation has already
+    counted a conference change at `version`: the rebuild saw the
+    conference at that version or later, or the conference was deleted
+    before the rebuild was done and so never counted."""
+    if not pointer or not pointer.current:
+        return False
+    counted = _versionKey(pointer.current, websafeConferenceKey).get()
+    if counted is not None:
+        return version <= counted.version
+    tombstone = ndb.Key(Tombstone, websafeConferenceKey).get()
+    return bool(tombstone and pointer.swapped and
+        tombstone.deleted < pointer.swapped)
+
+
+def applyFacetDelta(payload):
+    """Apply a facet delta task, one filter context per transaction.
+
+    Deltas add up in any order, so each (conference, version) is applied
+    exactly once: contexts already added are recorded per delta, and
+    changes the latest rebuild has counted are skipped. While a rebuild
+    runs, raises FacetRebuildInProgress to have the task retried.
+    """
+    if 'delta' not in payload:
+        # enqueued before deltas were versioned
+        payload = {'conference': None, 'version': 0, 'delta': payload}
+    wsck, version = payload['conference'], payload['version']
+    pointer = GENERATION_KEY.get()
+    if _rebuildRunning(pointer):
+        raise FacetRebuildInProgress('facet counts are being rebuilt')
+    if wsck and _countedByRebuild(pointer, wsck, version):
+        logging.info('Facet delta of %s at version %d counted by the '
+            'rebuild', wsck, version)
+        return
+    generation = pointer.current if pointer else 0
+    applied = [_applyContextDelta(generation, wsck, version, context, fields)
+        for context, fields in sorted(payload['delta'].items())]
+    if not any(applied):
+        logging.info('Facet delta of %s at version %d already applied',
+            wsck, version)
+
+
+@ndb.transactional()
+def _startRebuild():
+    """Hold off deltas and return the generation to rebuild, or None if
+    a rebuild is running already. One that has timed out is abandoned;
+    its partial generation is dropped with the other old ones."""
+    pointer = GENERATION_KEY.get() or FacetGeneration(key=GENERATION_KEY)
+    if _rebuildRunning(pointer):
+        return None
+    pointer.building = max(pointer.current, pointer.building or 0) + 1
+    pointer.buildingSince = datetime.utcnow()
+    pointer.put()
+    return pointer.building
+
+
+@ndb.transactional()
+def _finishRebuild(generation):
+    """Switch to a rebuilt generation; returns False if the rebuild was
+    abandoned meanwhile, as deltas may then have gone to the old one."""
+    pointer = GENERATION_KEY.get()
+    if pointer.building != generation or not _rebuildRunning(pointer):
+        if pointer.building == generation:
+            pointer.building = None
+            pointer.put()
+        return False
+    pointer.current = generation
+    pointer.swapped = datetime.utcnow()
+    pointer.building = None
+    pointer.put()
+    return True
+
+
+@ndb.transactional()
+def _abandonRebuild(generation):
+    pointer = GENERATION_KEY.get()
+    if pointer.building == generation:
+        pointer.building = None
+        pointer.put()
+
+
+def _countGeneration(generation):
+    """Count all conferences into the shards of `generation`, recording
+    the version each was counted at; returns the number of contexts."""
+    totals = {}
+    cursor = None
+    more = True
+    while more:
+        confs, cursor, more = Conference.query().fetch_page(
+            FACET_REBUILD_BATCH, start_cursor=cursor)
+        for conf in confs:
+            for context, fields in conferenceFacets(conf).items():
+                for field, values in fields.items():
+                    counts = totals.setdefault(context, {}
+                        ).setdefault(field, {})
+                    for value in values:
+                        counts[value] = counts.get(value, 0) + 1
+        ndb.put_multi([FacetConferenceVersion(
+            key=_versionKey(generation, conf.key.urlsafe()),
+            version=conf.version or 0) for conf in confs])
+
+    # the whole count of a context goes to its first shard
+    ndb.put_multi([ConferenceFacetShard(
+            key=_shardKey(generation, context, 0), counts=contextCounts)
+        for context, contextCounts in totals.items()])
+    return len(totals)
+
+
+def rebuildFacets():
+    """Recount all facets from scratch into a new generation of shards,
+    paging through conferences, then switch readers and deltas over to
+    it and drop the other generations.
+
+    Deltas wait while the rebuild runs; afterwards those of changes it
+    has counted are skipped and the others applied on top. A rebuild
+    that fails lets deltas go on at once; one that dies without notice
+    holds them for at most FACET_REBUILD_TIMEOUT.
+    """
+    generation = _startRebuild()
+    if generation is None:
+        logging.info('Facet counts are being rebuilt already')
+        return
+    try:
+        contexts = _countGeneration(generation)
+    except Exception:
+        _abandonRebuild(generation)
+        raise
+    if not _finishRebuild(generation):
+        logging.warning('Facet rebuild of generation %d timed out',
+            generation)
+        return
+
+    # later generations belong to a rebuild that may have started since
+    for model in (ConferenceFacetShard, FacetConferenceVersion, FacetDelta):
+        ndb.delete_multi([key for key in model.query().iter(keys_only=True)
+            if _generationOf(key) < generation])
+    logging.info('Rebuilt facet counts of %d filter contexts (generation '
+        '%d)', contexts, generation)
+
+
+def getFacetCounts(context):
+    """Return the conference counts of a filter context as a dict of
+    (facet, value) -> count, reading all its shards at once."""
+    pointer = GENERATION_KEY.get()
+    generation = pointer.current if pointer else 0
+    shards = ndb.get_multi([_shardKey(generation, context, i)
+        for i in range(FACET_SHARDS)])
+    totals = {}
+    for shard in shards:
+        if not shard:
+            continue
+        for field, values in shard.counts.items():
+            for value, n in values.items():
+                totals[(field, value)] = totals.get((field, value), 0) + n
+    return totals
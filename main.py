@@ -2,7 +2,9 @@
 
 """
 main.py -- Udacity conference server-side Python App Engine
-    HTTP controller handlers for memcache & task queue access
+    HTTP controller routes for warmup, streaming reads, memcache & task
+    queue access; handlers are imported on first use (see tasks.py,
+    stream.py, warmup.py)
 
 """
 
@@ -10,39 +12,33 @@ __author__ = 'wesc+api@google.com (Wesley Chun)'
 __author__ = 'tanvir@mrsft.com (Tanvir Hasan)'
 
 import webapp2
-from google.appengine.api import app_identity
-from google.appengine.api import mail
-from conference import ConferenceApi
-
-class SetAnnouncementHandler(webapp2.RequestHandler):
-    def get(self):
-        """Set Announcement in Memcache."""
-        ConferenceApi._cacheAnnouncement()
-        self.response.set_status(204)
-
-class CheckFeaturedSpeakerHandler(webapp2.RequestHandler):
-    def post(self):
-        """Set Featured Speaker in Memcache"""
-        ConferenceApi._cacheFeaturedSpeaker(
-            self.request.get('websafeConferenceKey'), 
-            self.request.get('websafeSpeakerKey'))
-
-class SendConfirmationEmailHandler(webapp2.RequestHandler):
-    def post(self):
-        """Send email confirming Conference creation."""
-        mail.send_mail(
-            'noreply@%s.appspotmail.com' % (
-                app_identity.get_application_id()),     # from
-            self.request.get('email'),                  # to
-            'You created a new Conference!',            # subj
-            'Hi, you have created a following '         # body
-            'conference:\r\n\r\n%s' % self.request.get(
-                'conferenceInfo')
-        )
-
 
 app = webapp2.WSGIApplication([
-    ('/crons/set_announcement', SetAnnouncementHandler),
-    ('/tasks/send_confirmation_email', SendConfirmationEmailHandler),
-    ('/tasks/check_featured_speaker', CheckFeaturedSpeakerHandler)
+    ('/_ah/warmup', 'warmup.WarmupHandler'),
+    ('/stream/conference/([^/]+)/sessions', 'stream.ConferenceSessionsHandler'),
+    ('/crons/set_announcement', 'tasks.SetAnnouncementHandler'),
+    ('/crons/release_seat_holds', 'tasks.ReleaseSeatHoldsHandler'),
+    ('/crons/rebuild_facets', 'tasks.RebuildFacetsHandler'),
+    ('/crons/rebuild_related_sessions', 'tasks.RebuildRelatedSessionsHandler'),
+    ('/crons/purge_tombstones', 'tasks.PurgeTombstonesHandler'),
+    ('/crons/aggregate_registrations',
+        'tasks.StartRegistrationAggregationHandler'),
+    ('/tasks/send_confirmation_email', 'tasks.SendConfirmationEmailHandler'),
+    ('/tasks/drain_mail_outbox', 'tasks.DrainMailOutboxHandler'),
+    ('/crons/drain_mail_outbox', 'tasks.DrainMailOutboxHandler'),
+    ('/tasks/check_featured_speaker', 'tasks.CheckFeaturedSpeakerHandler'),
+    ('/tasks/update_session_names', 'tasks.UpdateSessionNamesHandler'),
+    ('/tasks/promote_waitlist', 'tasks.PromoteWaitlistHandler'),
+    ('/tasks/apply_facet_delta', 'tasks.ApplyFacetDeltaHandler'),
+    ('/tasks/build_schedule_snapshot', 'tasks.BuildScheduleSnapshotHandler'),
+    ('/tasks/delete_conference', 'tasks.DeleteConferenceHandler'),
+    ('/tasks/aggregate_registrations', 'tasks.AggregateRegistrationsHandler'),
+    ('/tasks/run_migration', 'tasks.RunMigrationHandler'),
+    ('/admin/rate_limit_stats', 'tasks.RateLimitStatsHandler'),
+    ('/admin/migrations', 'tasks.MigrationsHandler'),
+    ('/admin/profiling', 'tasks.ProfilingHandler'),
+    ('/admin/transaction_stats', 'tasks.TransactionStatsHandler'),
+    ('/admin/query_cache_stats', 'tasks.QueryCacheStatsHandler'),
+    ('/admin/fan_out_stats', 'tasks.FanOutStatsHandler'),
+    ('/admin/mail_outbox_stats', 'tasks.MailOutboxStatsHandler')
 ], debug=True)
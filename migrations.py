@@ -0,0 +1,280 @@
+#!/usr/bin/env python
+
+"""
+migrations.py -- Udacity conference server-side Python App Engine
+    resumable schema migrations: registered, versioned functions run
+    over all entities of a kind by chained tasks, one batch each
+
+"""
+
+import logging
+from datetime import datetime
+
+from google.appengine.api import taskqueue
+from google.appengine.datastore.datastore_query import Cursor
+from google.appengine.ext import ndb
+
+from models import Attendee
+from models import Conference
+from models import MigrationStatus
+from models import Profile
+from models import Session
+from models import Speaker
+
+import registration
+
+MIGRATION_URL = '/tasks/run_migration'
+MIGRATION_QUEUE = 'migrations'
+MIGRATION_BATCH = 100
+# pause between batches, on top of the rate limit of the queue
+MIGRATION_THROTTLE_SECONDS = 1
+
+_migrations = {}
+
+
+class Migration(object):
+    """A registered migration: `func(entity)` brings one entity of
+    `model` up to date in place and returns True if it changed it.
+
+    Functions must be idempotent: after a crash the last batch is run
+    again. Migrations of entities that requests also write (set
+    `transactional`) re-read and put each changed entity in its own
+    transaction, so no concurrent update is lost.
+    """
+
+    def __init__(self, version, func, model, batch, transactional,
+                 selfWriting):
+        self.version = version
+        self.name = func.__name__
+        self.func = func
+        self.model = model
+        self.batch = batch
+        self.transactional = transactional
+        self.selfWriting = selfWriting
+
+
+def migration(version, model, batch=MIGRATION_BATCH, transactional=False,
+              selfWriting=False):
+    """Register the decorated function as migration number `version`
+    of `model`.
+
+    A `selfWriting` migration writes other entities than the one it is
+    given, in transactions of its own: it is called as
+    `func(entity, dryRun)` and nothing is put for it.
+    """
+    def decorator(func):
+        for m in _migrations.values():
+            if m.version == version or m.name == func.__name__:
+                raise ValueError('Migration %s (%d) registered twice'
+                                 % (func.__name__, version))
+        _migrations[func.__name__] = Migration(version, func, model, batch,
+                                               transactional, selfWriting)
+        return func
+    return decorator
+
+
+def registeredMigrations():
+    """Return all migrations in version order."""
+    return sorted(_migrations.values(), key=lambda m: m.version)
+
+
+def _enqueueBatch(name, run, batch, countdown=0):
+    taskqueue.add(queue_name=MIGRATION_QUEUE, url=MIGRATION_URL,
+        params={'name': name, 'run': run, 'batch': batch},
+        countdown=countdown, transactional=True)
+
+
+@ndb.transactional()
+def startMigration(name, dryRun=False):
+    """Start (or restart from scratch) a migration; raises ValueError
+    for unknown or running migrations."""
+    if name not in _migrations:
+        raise ValueError('No migration named %s' % name)
+    status = MigrationStatus.get_by_id(name) or MigrationStatus(id=name)
+    if status.state == 'running':
+        raise ValueError('Migration %s is running' % name)
+    status.populate(state='running', dryRun=dryRun, run=status.run + 1,
+        cursor=None, batches=0, processed=0, changed=0, lastError=None,
+        started=datetime.utcnow(), finished=None)
+    status.put()
+    _enqueueBatch(name, status.run, 0)
+    return status
+
+
+# xg: migrations may read other entity groups, e.g. a session's speaker
+@ndb.transactional(xg=True)
+def _migrateInTransaction(m, key):
+    entity = key.get()
+    if entity and m.func(entity):
+        entity.put()
+        return True
+    return False
+
+
+@ndb.transactional()
+def _checkpoint(name, run, batch, cursor, processed, changed):
+    """Record a finished batch and chain the next one, unless another
+    execution of the same batch got there first."""
+    status = MigrationStatus.get_by_id(name)
+    if status.run != run or status.batches != batch:
+        return False
+    status.cursor = cursor.urlsafe() if cursor else None
+    status.batches += 1
+    status.processed += processed
+    status.changed += changed
+    status.lastError = None
+    if cursor:
+        _enqueueBatch(name, run, status.batches,
+                      countdown=MIGRATION_THROTTLE_SECONDS)
+    else:
+        status.state = 'done'
+        status.finished = datetime.utcnow()
+    status.put()
+    return True
+
+
+def runMigrationBatch(name, run, batch):
+    """Migrate the batch after the checkpoint of a running migration.
+
+    Tasks that do not match the checkpoint (duplicates, or left over
+    from an earlier run) do nothing. Errors are recorded and re-raised
+    so that the task queue retries the batch.
+    """
+    m = _migrations.get(name)
+    status = MigrationStatus.get_by_id(name)
+    if not (m and status and status.state == 'running' and
+            status.run == run and status.batches == batch):
+        logging.info('Ignoring stale batch %d of migration %s', batch, name)
+        return
+
+    try:
+        entities, cursor, more = m.model.query().fetch_page(m.batch,
+            start_cursor=Cursor(urlsafe=status.cursor)
+                if status.cursor else None)
+        if m.selfWriting:
+            changed = len([e for e in entities if m.func(e, status.dryRun)])
+        elif status.dryRun:
+            changed = len([e for e in entities if m.func(e)])
+        elif m.transactional:
+            changed = len([e for e in entities
+                if m.func(e) and _migrateInTransaction(m, e.key)])
+        else:
+            stale = [e for e in entities if m.func(e)]
+            ndb.put_multi(stale)
+            changed = len(stale)
+    except Exception as e:
+        status.lastError = '%s: %s' % (type(e).__name__, e)
+        status.put()
+        raise
+
+    if _checkpoint(name, run, batch, cursor if more else None,
+                   len(entities), changed):
+        logging.info('Migration %s%s: batch %d, %d of %d entities changed',
+            name, ' (dry run)' if status.dryRun else '', batch, changed,
+            len(entities))
+
+
+def migrationProgress():
+    """Return the state of all migrations, in version order."""
+    statuses = ndb.get_multi([ndb.Key(MigrationStatus, m.name)
+                              for m in registeredMigrations()])
+    progress = []
+    for m, status in zip(registeredMigrations(), statuses):
+        entry = {'version': m.version, 'name': m.name,
+                 'kind': m.model._get_kind(), 'state': 'pending'}
+        if status:
+            elapsed = ((status.finished or status.updated) -
+                       status.started).total_seconds()
+            entry.update(state=status.state, dryRun=status.dryRun,
+                batches=status.batches, processed=status.processed,
+                changed=status.changed, lastError=status.lastError,
+                started=str(status.started),
+                entitiesPerSecond=round(status.processed / elapsed, 1)
+                    if elapsed > 0 else None)
+        progress.append(entry)
+    return progress
+
+
+# - - - migrations - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+@migration(1, Speaker, transactional=True)
+def speakerNameLower(speaker):
+    """Store nameLower. A stored value cannot be told from a computed
+    one, so every speaker is put again."""
+    return True
+
+
+@migration(2, Session, transactional=True)
+def sessionDenormalizedNames(session):
+    """Copy the conference and speaker names onto sessions."""
+    changed = False
+    if not session.conferenceName and session.key.parent():
+        conf = session.key.parent().get()
+        if conf:
+            session.conferenceName = conf.name
+            changed = True
+    if session.speaker and not session.speakerName:
+        speaker = session.speaker.get()
+        if speaker:
+            session.speakerName = speaker.name
+            changed = True
+    return changed
+
+
+@migration(3, Session, transactional=True)
+def sessionModified(session):
+    """Give sessions a modification time (set on put)."""
+    return session.modified is None
+
+
+@migration(4, Conference, transactional=True)
+def conferenceModified(conf):
+    """Give conferences a modification time (set on put)."""
+    return conf.modified is None
+
+
+@migration(5, Conference, transactional=True)
+def conferenceAttendeeCount(conf):
+    """Store the attendee count of conferences created before it was
+    kept."""
+    if conf.attendeeCount is not None:
+        return False
+    registration.initAttendeeCount(conf)
+    return True
+
+
+@ndb.transactional(xg=True)
+def _addAttendee(p_key, c_key):
+    """Add a profile to the roster of a conference if it is (still)
+    registered and not on the roster yet."""
+    prof = p_key.get()
+    a_key = ndb.Key(Attendee, p_key.id(), parent=c_key)
+    if not prof or c_key.urlsafe() not in prof.conferenceKeysToAttend or \
+            a_key.get() or not c_key.get():
+        return False
+    Attendee(key=a_key, displayName=prof.displayName,
+             mainEmail=prof.mainEmail).put()
+    return True
+
+
+@migration(6, Profile, selfWriting=True)
+def attendeeRoster(prof, dryRun):
+    """Add the registrations made before rosters were kept to the
+    rosters of their conferences."""
+    c_keys = []
+    for wsck in prof.conferenceKeysToAttend:
+        try:
+            c_keys.append(ndb.Key(urlsafe=wsck))
+        except Exception:
+            logging.warning('Profile %s lists a corrupt conference key',
+                            prof.key.id())
+    a_keys = [ndb.Key(Attendee, prof.key.id(), parent=c_key)
+              for c_key in c_keys]
+    missing = [a_key.parent() for a_key, attendee in
+               zip(a_keys, ndb.get_multi(a_keys)) if not attendee]
+    if dryRun:
+        return bool(missing)
+    # one transaction per conference, each re-checking the profile, so
+    # that an unregistration in the meantime is not undone
+    added = [c_key for c_key in missing if _addAttendee(prof.key, c_key)]
+    return bool(added)
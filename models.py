@@ -76,6 +76,11 @@ class Conference(ndb.Model):
     endDate         = ndb.DateProperty()
     maxAttendees    = ndb.IntegerProperty()
     seatsAvailable  = ndb.IntegerProperty()
+    version         = ndb.IntegerProperty(default=0)
+    # bumped only when sessions change; tags schedule snapshots
+    scheduleVersion = ndb.IntegerProperty(default=0)
+    attendeeCount   = ndb.IntegerProperty()
+    modified        = ndb.DateTimeProperty(auto_now=True)
 
 class ConferenceForm(messages.Message):
     """ConferenceForm -- Conference outbound form message"""
@@ -91,6 +96,8 @@ class ConferenceForm(messages.Message):
     endDate         = messages.StringField(10)
     websafeKey      = messages.StringField(11)
     organizerDisplayName = messages.StringField(12)
+    etag            = messages.StringField(13)
+    notModified     = messages.BooleanField(14)
 
 class ConferenceForms(messages.Message):
     """ConferenceForms -- multiple Conference outbound form message"""
@@ -106,12 +113,175 @@ class ConferenceQueryForms(messages.Message):
     """ConferenceQueryForms -- multiple ConferenceQueryForm inbound form message"""
     filters = messages.MessageField(ConferenceQueryForm, 1, repeated=True)
 
+class ConferenceFacetShard(ndb.Model):
+    """ConferenceFacetShard -- one shard of the conference counts per facet
+    value within a filter context, e.g. {'topics': {'Web': 3}}"""
+    counts = ndb.JsonProperty(default={})
+
+class FacetGeneration(ndb.Model):
+    """FacetGeneration -- the generation of facet shards in use, and the
+    one being rebuilt (if any); a single entity"""
+    current       = ndb.IntegerProperty(default=0, indexed=False)
+    swapped       = ndb.DateTimeProperty(indexed=False)
+    building      = ndb.IntegerProperty(indexed=False)
+    buildingSince = ndb.DateTimeProperty(indexed=False)
+
+class FacetConferenceVersion(ndb.Model):
+    """FacetConferenceVersion -- conference version counted by the rebuild
+    of a generation of facet shards, keyed '<generation>|<websafe key>'"""
+    version = ndb.IntegerProperty(indexed=False)
+
+class FacetDelta(ndb.Model):
+    """FacetDelta -- filter contexts of one conference change already
+    added to a generation of facet shards, keyed
+    '<generation>|<websafe key>|<version>'"""
+    contexts = ndb.StringProperty(repeated=True, indexed=False)
+
+class FacetQueryForm(messages.Message):
+    """FacetQueryForm -- Facet count inbound form message; an empty field
+    asks for counts over all conferences"""
+    field = messages.StringField(1)
+    value = messages.StringField(2)
+
+class FacetForm(messages.Message):
+    """FacetForm -- Facet count outbound form message"""
+    field = messages.StringField(1)
+    value = messages.StringField(2)
+    count = messages.IntegerField(3)
+
+class FacetForms(messages.Message):
+    """FacetForms -- multiple Facet count outbound form message"""
+    items = messages.MessageField(FacetForm, 1, repeated=True)
+
+# - - - Attendees - - - - - - - - - - - - - - - - - -
+
+class Attendee(ndb.Model):
+    """Attendee -- roster entry; child of the Conference, keyed by user id"""
+    displayName = ndb.StringProperty(indexed=False)
+    mainEmail   = ndb.StringProperty(indexed=False)
+    registered  = ndb.DateTimeProperty(auto_now_add=True, indexed=False)
+
+class AttendeeForm(messages.Message):
+    """AttendeeForm -- Attendee outbound form message"""
+    userId      = messages.StringField(1)
+    displayName = messages.StringField(2)
+    mainEmail   = messages.StringField(3)
+    registered  = messages.StringField(4)
+
+class AttendeeForms(messages.Message):
+    """AttendeeForms -- one page of Attendee outbound form messages"""
+    items         = messages.MessageField(AttendeeForm, 1, repeated=True)
+    count         = messages.IntegerField(2)
+    nextPageToken = messages.StringField(3)
+
+# - - - Registration analytics - - - - - - - - - - - -
+
+class RegistrationEvent(ndb.Model):
+    """RegistrationEvent -- append-only record of a registration (+1) or
+    cancellation (-1); root entity, indexed under a random shard"""
+    shard      = ndb.IntegerProperty()
+    conference = ndb.StringProperty(indexed=False)
+    delta      = ndb.IntegerProperty(indexed=False)
+    created    = ndb.DateTimeProperty(auto_now_add=True)
+
+class RegistrationStat(ndb.Model):
+    """RegistrationStat -- registrations of a conference in one hour or
+    day, keyed by websafe conference key, granularity and bucket"""
+    conference    = ndb.StringProperty()
+    granularity   = ndb.StringProperty()
+    bucket        = ndb.DateTimeProperty()
+    registrations = ndb.IntegerProperty(default=0, indexed=False)
+    cancellations = ndb.IntegerProperty(default=0, indexed=False)
+
+class AggregationCheckpoint(ndb.Model):
+    """AggregationCheckpoint -- how far a shard of events has been
+    rolled up into RegistrationStats"""
+    last   = ndb.DateTimeProperty(indexed=False)
+    events = ndb.IntegerProperty(default=0, indexed=False)
+
+class RegistrationStatForm(messages.Message):
+    """RegistrationStatForm -- registrations in one time bucket"""
+    bucket        = messages.StringField(1)
+    registrations = messages.IntegerField(2)
+    cancellations = messages.IntegerField(3)
+    net           = messages.IntegerField(4)
+
+class RegistrationStatsForm(messages.Message):
+    """RegistrationStatsForm -- registration series of a conference"""
+    websafeConferenceKey = messages.StringField(1)
+    granularity          = messages.StringField(2)
+    items                = messages.MessageField(RegistrationStatForm, 3, repeated=True)
+    seatsAvailable       = messages.IntegerField(4)
+    forecastSoldOut      = messages.StringField(5)
+
+# - - - Batch registration - - - - - - - - - - - - - -
+
+class RegistrationOutcome(messages.Enum):
+    """RegistrationOutcome -- result of registering for one conference"""
+    REGISTERED = 1
+    ALREADY_REGISTERED = 2
+    SOLD_OUT = 3
+    NOT_FOUND = 4
+    INVALID_KEY = 5
+    FAILED = 6
+
+class RegistrationBatchForm(messages.Message):
+    """RegistrationBatchForm -- conferences to register for at once"""
+    websafeConferenceKeys = messages.StringField(1, repeated=True)
+
+class RegistrationOutcomeForm(messages.Message):
+    """RegistrationOutcomeForm -- outcome for one conference of a batch"""
+    websafeConferenceKey = messages.StringField(1)
+    outcome              = messages.EnumField('RegistrationOutcome', 2)
+
+class RegistrationOutcomeForms(messages.Message):
+    """RegistrationOutcomeForms -- outcomes of a batch, in request order"""
+    items = messages.MessageField(RegistrationOutcomeForm, 1, repeated=True)
+
+# - - - Seat holds - - - - - - - - - - - - - - - - - -
+
+class SeatHold(ndb.Model):
+    """SeatHold -- seat taken from a conference for a limited time; child
+    of the Conference, keyed by user id"""
+    expires = ndb.DateTimeProperty(required=True)
+    created = ndb.DateTimeProperty(indexed=False)
+
+class SeatHoldForm(messages.Message):
+    """SeatHoldForm -- Seat hold outbound form message"""
+    websafeConferenceKey = messages.StringField(1)
+    expires              = messages.StringField(2)
+
+# - - - Waitlist - - - - - - - - - - - - - - - - - - -
+
+class WaitlistEntry(ndb.Model):
+    """WaitlistEntry -- Profile waiting for a seat at a sold-out conference;
+    each entry is its own entity group, keyed by conference and user"""
+    conference = ndb.KeyProperty(kind=Conference)
+    profile    = ndb.KeyProperty(kind=Profile)
+    created    = ndb.DateTimeProperty(auto_now_add=True)
+
+class WaitlistForm(messages.Message):
+    """WaitlistForm -- Waitlist position outbound form message"""
+    websafeConferenceKey = messages.StringField(1)
+    position             = messages.IntegerField(2)
+
+class RegistrationForm(messages.Message):
+    """RegistrationForm -- Registration outbound form message; users who
+    find the conference sold out are put on its waitlist instead"""
+    data             = messages.BooleanField(1)
+    waitlisted       = messages.BooleanField(2)
+    waitlistPosition = messages.IntegerField(3)
+
 # - - - Speakers - - - - - - - - - - - - - - - - - - -
 
 class Speaker(ndb.Model):
     """Speaker -- Session speaker object"""
     name = ndb.StringProperty()
     bio  = ndb.TextProperty()
+    # user who created the speaker; unset for speakers created before
+    creatorUserId = ndb.StringProperty()
+    # normalized name for case-insensitive prefix searches
+    nameLower = ndb.ComputedProperty(lambda self: (self.name or '').lower())
 
 class SpeakerForm(messages.Message):
     """SpeakerForm -- Speaker outbound form message"""
@@ -125,7 +295,9 @@ class SpeakerMiniForm(messages.Message):
     bio  = messages.StringField(2)
 
 class SpeakerForms(messages.Message):
+    """SpeakerForms -- multiple Speaker outbound form message"""
     items = messages.MessageField(SpeakerForm, 1, repeated=True)
+    nextPageToken = messages.StringField(2)
 
 # - - - Sessions - - - - - - - - - - - - - - - - - - -
 
@@ -146,6 +318,19 @@ class Session(ndb.Model):
     typeOfSession = ndb.StringProperty()
     date          = ndb.DateProperty()
     startTime     = ndb.TimeProperty()
+    # denormalized from the Speaker and the parent Conference
+    speakerName    = ndb.StringProperty(indexed=False)
+    conferenceName = ndb.StringProperty(indexed=False)
+    modified       = ndb.DateTimeProperty(auto_now=True)
+
+class ScheduleSnapshot(ndb.Model):
+    """ScheduleSnapshot -- zlib-compressed SessionForms JSON of a conference,
+    keyed by websafe conference key"""
+    data            = ndb.BlobProperty()
+    # schedule version of the conference the snapshot was built at;
+    # None on snapshots tagged with the conference version instead
+    scheduleVersion = ndb.IntegerProperty(indexed=False)
+    built           = ndb.DateTimeProperty(auto_now=True, indexed=False)
 
 class SessionForm(messages.Message):
     """SessionForm -- Session outbound form message"""
@@ -187,6 +372,72 @@ class SessionQueryBeforeExcludingForm(messages.Message):
 class SessionForms(messages.Message):
     """SessionForms -- multiple Session outbound form message"""
     items = messages.MessageField(SessionForm, 1, repeated=True)
+    etag = messages.StringField(2)
+    notModified = messages.BooleanField(3)
+
+class SessionSlotForm(messages.Message):
+    """SessionSlotForm -- sessions starting in one time slot"""
+    startTime = messages.StringField(1)
+    items     = messages.MessageField(SessionForm, 2, repeated=True)
+
+class SessionSlotForms(messages.Message):
+    """SessionSlotForms -- time slots of a schedule window, in order"""
+    date  = messages.StringField(1)
+    slots = messages.MessageField(SessionSlotForm, 2, repeated=True)
+
+class RelatedSessions(ndb.Model):
+    """RelatedSessions -- sessions most often wishlisted together with a
+    session, best first; keyed by websafe session key"""
+    sessions = ndb.StringProperty(repeated=True, indexed=False)
+    counts   = ndb.IntegerProperty(repeated=True, indexed=False)
+    built    = ndb.DateTimeProperty(auto_now=True)
+
+# - - - Sync - - - - - - - - - - - - - - - - - - - - -
+
+class Tombstone(ndb.Model):
+    """Tombstone -- record of a deleted Conference or Session for delta
+    sync, keyed by its websafe key"""
+    kind       = ndb.StringProperty(indexed=False)
+    conference = ndb.StringProperty()  # websafe key of the (parent) conference
+    deleted    = ndb.DateTimeProperty(auto_now_add=True)
+
+class TombstoneForm(messages.Message):
+    """TombstoneForm -- deleted entity outbound form message"""
+    kind       = messages.StringField(1)
+    websafeKey = messages.StringField(2)
+
+class SyncForm(messages.Message):
+    """SyncForm -- changes since a sync token, one page at a time"""
+    conferences = messages.MessageField(ConferenceForm, 1, repeated=True)
+    sessions    = messages.MessageField(SessionForm, 2, repeated=True)
+    deleted     = messages.MessageField(TombstoneForm, 3, repeated=True)
+    syncToken   = messages.StringField(4)
+    more        = messages.BooleanField(5)
+    reset       = messages.BooleanField(6)
+
+# - - - Migrations - - - - - - - - - - - - - - - - - -
+
+class MigrationStatus(ndb.Model):
+    """MigrationStatus -- checkpoint and progress of a schema migration,
+    keyed by migration name"""
+    state     = ndb.StringProperty(indexed=False)   # running, done
+    dryRun    = ndb.BooleanProperty(default=False, indexed=False)
+    run       = ndb.IntegerProperty(default=0, indexed=False)
+    cursor    = ndb.StringProperty(indexed=False)
+    batches   = ndb.IntegerProperty(default=0, indexed=False)
+    processed = ndb.IntegerProperty(default=0, indexed=False)
+    changed   = ndb.IntegerProperty(default=0, indexed=False)
+    lastError = ndb.TextProperty()
+    started   = ndb.DateTimeProperty(indexed=False)
+    updated   = ndb.DateTimeProperty(auto_now=True, indexed=False)
+    finished  = ndb.DateTimeProperty(indexed=False)
+
+# - - - Profiling - - - - - - - - - - - - - - - - - -
+
+class ProfilingConfig(ndb.Model):
+    """ProfilingConfig -- share of calls to profile per API method name,
+    e.g. {'queryConferences': 0.01}; a single entity"""
+    rates = ndb.JsonProperty(default={})
 
 # needed for topic-related search
 class TopicForm(messages.Message):
@@ -208,4 +459,11 @@ class StringMessage(messages.Message):
 
 class ConflictException(endpoints.ServiceException):
     """ConflictException -- exception mapped to HTTP 409 response"""
-    http_status = httplib.CONFLICT
\ No newline at end of file
+    http_status = httplib.CONFLICT
+
+class TooManyRequestsException(endpoints.ServiceException):
+    """TooManyRequestsException -- exception mapped to HTTP 429 response"""
+    http_status = 429
+
+class SoldOutException(ConflictException):
+    """SoldOutException -- no seats left; mapped to HTTP 409 response"""
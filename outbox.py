@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+
+"""
+outbox.py -- Udacity conference server-side Python App Engine
+    outbound mail pipeline: mail intents are put in a pull queue and
+    drained in batches, coalesced per recipient and deduplicated
+
+"""
+
+import hashlib
+import json
+import logging
+import time
+
+from google.appengine.api import app_identity
+from google.appengine.api import mail
+from google.appengine.api import memcache
+from google.appengine.api import taskqueue
+
+OUTBOX_QUEUE = 'mail-outbox'
+DRAIN_URL = '/tasks/drain_mail_outbox'
+DRAIN_DELAY = 10            # seconds; coalesces drain tasks for new mail
+LEASE_SECONDS = 60
+LEASE_BATCH = 100
+MAX_BATCHES = 10            # per drain run
+MEMCACHE_SENT_PREFIX = 'MAIL_SENT_'
+MEMCACHE_STATS_KEY = 'MAIL_OUTBOX_STATS'
+SENT_TTL = 7 * 24 * 3600
+DIGEST_SUBJECT_TPL = 'You have %d new notifications'
+DIGEST_SEPARATOR = '\r\n\r\n- - - - - - - - - -\r\n\r\n'
+
+
+def _hash(text):
+    if isinstance(text, unicode):
+        text = text.encode('utf-8')
+    return hashlib.sha1(text).hexdigest()
+
+
+def _sender():
+    return 'noreply@%s.appspotmail.com' % app_identity.get_application_id()
+
+
+def enqueueMail(to, subject, body, idempotencyKey=None):
+    """Add a mail intent to the outbox.
+
+    Intents with the same idempotency key are sent at most once; without
+    an explicit key one is derived from the recipient and content.
+    """
+    key = _hash(idempotencyKey or u'\0'.join((to, subject, body)))
+    task = taskqueue.Task(
+        name='mail-%s' % key,
+        payload=json.dumps({'to': to, 'subject': subject, 'body': body,
+                            'key': key}),
+        method='PULL')
+    try:
+        taskqueue.Queue(OUTBOX_QUEUE).add(task)
+    except (taskqueue.TaskAlreadyExistsError, taskqueue.TombstonedTaskError):
+        # the same intent was enqueued before (e.g. a retried request)
+        return
+
+    # make sure a drain runs soon, but only one per DRAIN_DELAY window
+    window = int(time.time()) // DRAIN_DELAY
+    try:
+        taskqueue.add(name='drain-mail-outbox-%d' % window,
+                      url=DRAIN_URL, countdown=DRAIN_DELAY)
+    except (taskqueue.TaskAlreadyExistsError, taskqueue.TombstonedTaskError):
+        pass
+
+
+def _sendDigest(to, intents):
+    """Send one mail to `to` covering all given intents."""
+    if len(intents) == 1:
+        subject = intents[0]['subject']
+        body = intents[0]['body']
+    else:
+        subject = DIGEST_SUBJECT_TPL % len(intents)
+        body = DIGEST_SEPARATOR.join(
+            '%s\r\n\r\n%s' % (i['subject'], i['body']) for i in intents)
+    mail.send_mail(_sender(), to, subject, body)
+
+
+def drain(maxBatches=MAX_BATCHES):
+    """Lease mail intents in batches and send one digest per recipient.
+
+    Intents already sent (e.g. re-leased after a lease expired) are
+    dropped. Intents of recipients whose mail failed stay in the queue
+    and are retried once their lease runs out. Returns a stats dict.
+    """
+    queue = taskqueue.Queue(OUTBOX_QUEUE)
+    started = time.time()
+    leased = sent = duplicates = failed = 0
+
+    for _ in range(maxBatches):
+        tasks = queue.lease_tasks(LEASE_SECONDS, LEASE_BATCH)
+        if not tasks:
+            break
+        leased += len(tasks)
+
+        # coalesce per recipient, dropping repeats within the batch
+        byRecipient = {}
+        seen = set()
+        for task in tasks:
+            intent = json.loads(task.payload)
+            if intent['key'] in seen:
+                duplicates += 1
+                continue
+            seen.add(intent['key'])
+            byRecipient.setdefault(intent['to'], []).append(intent)
+
+        # drop intents that went out in an earlier run
+        alreadySent = memcache.get_multi(list(seen),
+                                         key_prefix=MEMCACHE_SENT_PREFIX)
+
+        done = []
+        for to, intents in byRecipient.items():
+            fresh = [i for i in intents if i['key'] not in alreadySent]
+            duplicates += len(intents) - len(fresh)
+            if fresh:
+                try:
+                    _sendDigest(to, fresh)
+                except Exception:
+                    logging.exception('Sending mail to %s failed', to)
+                    failed += 1
+                    continue
+                memcache.set_multi(dict((i['key'], 1) for i in fresh),
+                                   time=SENT_TTL,
+                                   key_prefix=MEMCACHE_SENT_PREFIX)
+                sent += 1
+            done.append(to)
+
+        queue.delete_tasks([t for t in tasks
+                            if json.loads(t.payload)['to'] in done])
+
+    elapsed = time.time() - started
+    stats = {
+        'leased': leased,
+        'mailsSent': sent,
+        'duplicates': duplicates,
+        'failedRecipients': failed,
+        'seconds': round(elapsed, 3),
+        'intentsPerSecond': round(leased / elapsed, 1) if elapsed else 0,
+        'queueDepth': queue.fetch_statistics().tasks,
+        'finished': int(time.time()),
+    }
+    memcache.set(MEMCACHE_STATS_KEY, stats)
+    logging.info('Mail outbox drained: %s', stats)
+    return stats
+
+
+def outboxStats():
+    """Return the stats of the latest drain (None if they were evicted)
+    and the number of intents waiting in the outbox."""
+    return {
+        'lastDrain': memcache.get(MEMCACHE_STATS_KEY),
+        'queueDepth': taskqueue.Queue(OUTBOX_QUEUE).fetch_statistics().tasks,
+    }
@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+
+"""
+profiling.py -- Udacity conference server-side Python App Engine
+    opt-in cProfile sampling of API methods, aggregated per method in
+    memcache
+
+"""
+
+import cProfile
+import functools
+import logging
+import os
+import pstats
+import random
+import time
+
+import endpoints
+from google.appengine.api import memcache
+from google.appengine.api import oauth
+from google.appengine.ext import ndb
+
+from models import ProfilingConfig
+
+from cache import TwoTierCache
+from cache import casUpdate
+
+# admins send "X-Profile: 1" to profile a single call
+PROFILE_HEADER = 'HTTP_X_PROFILE'
+MEMCACHE_PROFILE_TPL = 'PROFILE_%s'
+MEMCACHE_PROFILE_INDEX_KEY = 'PROFILE_METHODS'
+# functions kept per method; the rest of a sample is dropped, so counts
+# of functions that rarely make the cut are approximate
+PROFILE_FUNCTIONS_KEPT = 200
+PROFILING_CONFIG_KEY = 'rates'
+
+# sample rates are read on every API call; an instance notices a new
+# configuration within the ttl
+PROFILING_CONFIG_CACHE = TwoTierCache('PROFILING_CONFIG', ttl=10)
+
+
+def _loadRates():
+    config = ndb.Key(ProfilingConfig, 'global').get()
+    return config.rates if config else {}
+
+
+def sampleRates():
+    """Return {method name: share of calls profiled}."""
+    return PROFILING_CONFIG_CACHE.get(PROFILING_CONFIG_KEY,
+                                      loader=_loadRates)
+
+
+@ndb.transactional()
+def _storeRate(name, rate):
+    config = ndb.Key(ProfilingConfig, 'global').get() or \
+        ProfilingConfig(id='global')
+    rates = dict(config.rates)
+    if rate > 0:
+        rates[name] = min(rate, 1.0)
+    else:
+        rates.pop(name, None)
+    config.rates = rates
+    config.put()
+    return rates
+
+
+def setSampleRate(name, rate):
+    """Profile a share `rate` of the calls to API method `name` (0 to
+    stop) and return all sample rates."""
+    rates = _storeRate(name, rate)
+    PROFILING_CONFIG_CACHE.set(PROFILING_CONFIG_KEY, rates)
+    return rates
+
+
+def _requestedByAdmin():
+    if not os.environ.get(PROFILE_HEADER):
+        return False
+    try:
+        return oauth.is_current_user_admin(endpoints.EMAIL_SCOPE)
+    except oauth.Error:
+        return False
+
+
+def _wanted(name):
+    rate = sampleRates().get(name)
+    if rate and random.random() < rate:
+        return True
+    return _requestedByAdmin()
+
+
+def _label(filename, line, function):
+    # the last two path components tell apart e.g. the many __init__.py
+    path = '/'.join(filename.split(os.sep)[-2:])
+    return '%s:%d(%s)' % (path, line, function)
+
+
+def _record(name, profile, seconds):
+    """Merge the statistics of one profiled call into its method's."""
+    sample = {}
+    for (filename, line, function), (_, calls, tottime, cumtime, _) in \
+            pstats.Stats(profile).stats.iteritems():
+        sample[_label(filename, line, function)] = (calls, tottime, cumtime)
+
+    def merge(stats):
+        stats = stats or {'samples': 0, 'seconds': 0.0, 'functions': {}}
+        functions = stats['functions']
+        for label, (calls, tottime, cumtime) in sample.iteritems():
+            total = functions.get(label, (0, 0.0, 0.0))
+            functions[label] = (total[0] + calls, total[1] + tottime,
+                                total[2] + cumtime)
+        if len(functions) > PROFILE_FUNCTIONS_KEPT:
+            kept = sorted(functions.iteritems(), key=lambda f: f[1][2],
+                          reverse=True)[:PROFILE_FUNCTIONS_KEPT]
+            stats['functions'] = dict(kept)
+        stats['samples'] += 1
+        stats['seconds'] += seconds
+        return stats
+
+    if not casUpdate(MEMCACHE_PROFILE_TPL % name, merge):
+        logging.info('Dropped a profile of %s: memcache contention', name)
+    casUpdate(MEMCACHE_PROFILE_INDEX_KEY,
+         lambda names: sorted(set(names or []) | set([name])))
+
+
+def profiled(func):
+    """Decorate an API method to run a sampled share of its calls, and
+    calls of admins sending the X-Profile header, under cProfile.
+
+    Unsampled calls only cost a lookup of the sample rates in process
+    memory.
+    """
+    name = func.__name__
+
+    @functools.wraps(func)
+    def wrapper(self, request):
+        if not _wanted(name):
+            return func(self, request)
+        profile = cProfile.Profile()
+        started = time.time()
+        try:
+            return profile.runcall(func, self, request)
+        finally:
+            try:
+                _record(name, profile, time.time() - started)
+            except Exception:
+                # profiling must never fail the call
+                logging.exception('Recording a profile of %s failed', name)
+    return wrapper
+
+
+def profileStats(limit=20):
+    """Return {method: {'samples', 'meanSeconds', 'top'}}, with the top
+    `limit` functions of every profiled method by cumulative time."""
+    names = memcache.get(MEMCACHE_PROFILE_INDEX_KEY) or []
+    found = memcache.get_multi(names, key_prefix=MEMCACHE_PROFILE_TPL % '')
+    report = {}
+    for name, stats in found.iteritems():
+        top = sorted(stats['functions'].iteritems(), key=lambda f: f[1][2],
+                     reverse=True)[:limit]
+        report[name] = {
+            'samples': stats['samples'],
+            'meanSeconds': round(stats['seconds'] / stats['samples'], 4),
+            'top': [{
+                'function': label,
+                'calls': calls,
+                'tottime': round(tottime, 4),
+                'cumtime': round(cumtime, 4),
+                'cumtimePerSample': round(cumtime / stats['samples'], 4),
+            } for label, (calls, tottime, cumtime) in top],
+        }
+    return report
+
+
+def resetProfileStats():
+    """Drop the statistics of all methods."""
+    names = memcache.get(MEMCACHE_PROFILE_INDEX_KEY) or []
+    memcache.delete_multi([MEMCACHE_PROFILE_TPL % name for name in names]
+                          + [MEMCACHE_PROFILE_INDEX_KEY])
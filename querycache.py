@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+
+"""
+querycache.py -- Udacity conference server-side Python App Engine
+    queryConferences results cached in memcache per canonical filter
+    set, under the generation of the conference catalog
+
+"""
+
+import hashlib
+import json
+
+from google.appengine.api import memcache
+from protorpc import protojson
+
+from models import ConferenceForms
+
+import versions
+
+MEMCACHE_QUERY_TPL = 'CONFERENCE_QUERY_%d_%s'     # generation, digest
+MEMCACHE_COUNTER_PREFIX = 'CONFERENCE_QUERY_STATS_'
+COUNTERS = ('hits', 'misses', 'stores', 'storedBytes', 'tooLarge')
+# global queries are eventually consistent: a result read just after a
+# change may miss it, and would otherwise be served until the next one
+QUERY_CACHE_SECONDS = 300
+# memcache values are limited to 1 MB
+QUERY_CACHE_MAX_BYTES = 1000000
+INTEGER_FIELDS = ('month', 'maxAttendees')
+
+
+def canonicalFilters(filters):
+    """Return a canonical string of formatted filters (dicts of field,
+    operator and value): the same filter set in any order, repeated or
+    with the same number spelled differently, gives the same string."""
+    canonical = set()
+    for filtr in filters:
+        value = filtr['value']
+        if filtr['field'] in INTEGER_FIELDS:
+            try:
+                value = int(value)
+            except (TypeError, ValueError):
+                pass
+        canonical.add((filtr['field'], filtr['operator'], value))
+    return json.dumps(sorted(canonical), separators=(',', ':'))
+
+
+def _count(**deltas):
+    memcache.offset_multi(dict((name, delta)
+        for name, delta in deltas.items() if delta),
+        key_prefix=MEMCACHE_COUNTER_PREFIX, initial_value=0)
+
+
+def cachedQuery(filters, run):
+    """Return the ConferenceForms of formatted filters, calling run()
+    to build them on a cache miss.
+
+    Results are cached under the current catalog generation; any change
+    to a conference moves the catalog on, so invalidation is a single
+    increment.
+    """
+    mkey = MEMCACHE_QUERY_TPL % (versions.getCatalogGeneration(),
+        hashlib.sha1(canonicalFilters(filters)).hexdigest())
+    cached = memcache.get(mkey)
+    if cached is not None:
+        _count(hits=1)
+        return protojson.decode_message(ConferenceForms, cached)
+
+    forms = run()
+    encoded = protojson.encode_message(forms)
+    if len(encoded) > QUERY_CACHE_MAX_BYTES:
+        _count(misses=1, tooLarge=1)
+    elif memcache.add(mkey, encoded, time=QUERY_CACHE_SECONDS):
+        _count(misses=1, stores=1, storedBytes=len(encoded))
+    else:
+        _count(misses=1)
+    return forms
+
+
+def queryCacheStats():
+    """Return hit and miss counts, the hit ratio and the size of stored
+    results since the counters were last evicted, and memcache's own
+    totals for the whole app."""
+    counters = memcache.get_multi(COUNTERS,
+                                  key_prefix=MEMCACHE_COUNTER_PREFIX)
+    stats = dict((name, counters.get(name, 0)) for name in COUNTERS)
+    lookups = stats['hits'] + stats['misses']
+    stats['hitRatio'] = round(stats['hits'] / float(lookups), 3) \
+        if lookups else None
+    stats['meanEntryBytes'] = stats['storedBytes'] // stats['stores'] \
+        if stats['stores'] else None
+    stats['generation'] = versions.getCatalogGeneration()
+    stats['memcache'] = memcache.get_stats()
+    return stats
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+
+"""
+ratelimit.py -- Udacity conference server-side Python App Engine
+    per-user rate limits for write endpoints, kept in memcache
+
+"""
+
+import functools
+import logging
+import time
+
+import endpoints
+from google.appengine.api import memcache
+
+from models import TooManyRequestsException
+from settings import RATE_LIMITS
+from utils import getUserId
+
+MEMCACHE_BUCKET_TPL = 'RATELIMIT_%s_%s_%d'     # endpoint, user, window
+MEMCACHE_COUNTER_PREFIX = 'RATELIMIT_STATS_'
+RETRY_MSG_TPL = 'Too many %s requests; retry in %d seconds'
+
+
+def _countCall(name, user_id, burst, rate):
+    """Count a call and return (estimated calls in bucket, seconds left
+    in the current window).
+
+    The bucket holds `burst` tokens and refills at `rate` per second,
+    i.e. it is completely refilled every burst / rate seconds. Calls are
+    counted with an atomic incr per such window; the usage of the bucket
+    is the current window's count plus the share of the previous
+    window's count that has not been refilled yet. The incr and the read
+    of the previous window go out in parallel, so this costs one
+    memcache round trip, except for the first call of a window, which
+    creates the counter with an expiry of two windows.
+    """
+    period = burst / float(rate)
+    now = time.time()
+    window = int(now // period)
+    elapsed = (now % period) / period
+
+    key = MEMCACHE_BUCKET_TPL % (name, user_id, window)
+    client = memcache.Client()
+    current = client.incr_async(key)
+    previous = client.get_multi_async(
+        [MEMCACHE_BUCKET_TPL % (name, user_id, window - 1)])
+
+    count = current.get_result()
+    if count is None:
+        # first call of the window (or a concurrent one created it)
+        if client.add(key, 1, time=int(2 * period) + 1):
+            count = 1
+        else:
+            count = client.incr(key)
+    if count is None:
+        # memcache is unavailable; don't turn that into an outage
+        return 0, 0
+    carried = (previous.get_result() or {}).values()
+    used = count + (carried[0] if carried else 0) * (1 - elapsed)
+    return used, period * (1 - elapsed)
+
+
+def _record(name, outcome):
+    memcache.offset_multi({'%s_%s' % (name, outcome): 1},
+                          key_prefix=MEMCACHE_COUNTER_PREFIX,
+                          initial_value=0)
+
+
+def rateLimitStats():
+    """Return {endpoint: {'admitted': n, 'rejected': n}} since the
+    counters were last evicted."""
+    keys = ['%s_%s' % (name, outcome) for name in RATE_LIMITS
+            for outcome in ('admitted', 'rejected')]
+    counters = memcache.get_multi(keys, key_prefix=MEMCACHE_COUNTER_PREFIX)
+    return dict((name, {
+        'admitted': counters.get('%s_admitted' % name, 0),
+        'rejected': counters.get('%s_rejected' % name, 0),
+    }) for name in RATE_LIMITS)
+
+
+def rateLimited(name):
+    """Decorate an API method with the limit RATE_LIMITS[name].
+
+    Calls over the limit raise TooManyRequestsException before the
+    method runs, so they cost no datastore RPC. Rejected calls count
+    against the bucket too: a client retrying in a tight loop stays
+    rejected until it backs off.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, request):
+            limit = RATE_LIMITS.get(name)
+            user = endpoints.get_current_user()
+            if limit and user:
+                burst, rate = limit
+                used, retryIn = _countCall(name, getUserId(user),
+                                           burst, rate)
+                if used > burst:
+                    _record(name, 'rejected')
+                    logging.info('Rate limited %s for %s (%.1f > %d)',
+                                 name, user.email(), used, burst)
+                    raise TooManyRequestsException(
+                        RETRY_MSG_TPL % (name, max(1, int(retryIn))))
+                _record(name, 'admitted')
+            return func(self, request)
+        return wrapper
+    return decorator
@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+
+"""
+recommendations.py -- Udacity conference server-side Python App Engine
+    "wishlisted together" session recommendations, precomputed from a
+    co-occurrence count of all wishlists
+
+"""
+
+import heapq
+import logging
+import time
+from array import array
+from datetime import datetime
+
+from google.appengine.api import runtime
+from google.appengine.ext import ndb
+
+from models import Profile
+from models import RelatedSessions
+
+RELATED_TOP_K = 10
+PROFILE_PAGE = 500
+PUT_BATCH = 500
+
+
+def conferenceOf(websafeSessionKey):
+    """Return the websafe key of the conference of a session."""
+    return ndb.Key(urlsafe=websafeSessionKey).parent().urlsafe()
+
+
+def topRelated(wishlists, topK=RELATED_TOP_K, conferenceOf=conferenceOf):
+    """Count how often two sessions of the same conference are on the
+    same wishlist and return {session: [(related session, count), ...]}
+    with the topK most frequent, best first.
+
+    Sessions are numbered as they are first seen; the sparse count
+    matrix is a dict from packed (i, j) pairs (i < j) to counts, and
+    each row keeps only a topK heap. Time is linear in the number of
+    wishlists (for bounded wishlist sizes); memory in the number of
+    distinct pairs.
+    """
+    index = {}                  # session -> number
+    sessions = []               # number -> session
+    conferences = array('i')    # number -> conference number
+    conferenceIndex = {}
+    pairs = {}
+
+    for wishlist in wishlists:
+        byConference = {}
+        for wssk in set(wishlist):
+            i = index.get(wssk)
+            if i is None:
+                try:
+                    conference = conferenceOf(wssk)
+                except Exception:
+                    continue        # corrupt key
+                i = index[wssk] = len(sessions)
+                sessions.append(wssk)
+                conferences.append(conferenceIndex.setdefault(
+                    conference, len(conferenceIndex)))
+            byConference.setdefault(conferences[i], []).append(i)
+
+        for numbers in byConference.values():
+            numbers.sort()
+            for n, i in enumerate(numbers):
+                packed = i << 32
+                for j in numbers[n + 1:]:
+                    pairs[packed | j] = pairs.get(packed | j, 0) + 1
+
+    rows = {}                   # number -> heap of (count, -other)
+    for packed, count in pairs.iteritems():
+        i, j = packed >> 32, packed & 0xffffffff
+        for row, other in ((i, j), (j, i)):
+            heap = rows.setdefault(row, [])
+            if len(heap) < topK:
+                heapq.heappush(heap, (count, -other))
+            elif (count, -other) > heap[0]:
+                heapq.heapreplace(heap, (count, -other))
+    del pairs
+
+    return dict((sessions[i], [(sessions[-other], count)
+                 for count, other in sorted(heap, reverse=True)])
+                for i, heap in rows.iteritems())
+
+
+def _wishlists():
+    """Yield the wishlists of all profiles, a page at a time."""
+    cursor = None
+    more = True
+    while more:
+        profiles, cursor, more = Profile.query().fetch_page(PROFILE_PAGE,
+            start_cursor=cursor)
+        more = more and cursor is not None
+        for prof in profiles:
+            if len(prof.sessionWishlist) > 1:
+                yield prof.sessionWishlist
+
+
+def rebuildRelatedSessions():
+    """Recompute the related sessions of all sessions and replace the
+    stored ones; returns a stats dict."""
+    started = time.time()
+    builtAfter = datetime.utcnow()
+    related = topRelated(_wishlists())
+    computed = time.time()
+
+    entities = [RelatedSessions(id=wssk,
+                    sessions=[other for other, _ in items],
+                    counts=[count for _, count in items])
+                for wssk, items in related.iteritems()]
+    for i in range(0, len(entities), PUT_BATCH):
+        ndb.put_multi(entities[i:i + PUT_BATCH])
+    # the query is eventually consistent and may still list rows just
+    # rewritten by this run; only delete rows that really are older
+    candidates = RelatedSessions.query(RelatedSessions.built < builtAfter
+        ).fetch(keys_only=True)
+    stale = []
+    for i in range(0, len(candidates), PUT_BATCH):
+        stale.extend(row.key for row in
+            ndb.get_multi(candidates[i:i + PUT_BATCH])
+            if row and row.built < builtAfter)
+    ndb.delete_multi(stale)
+
+    stats = {
+        'sessions': len(entities),
+        'deleted': len(stale),
+        'computeSeconds': round(computed - started, 3),
+        'totalSeconds': round(time.time() - started, 3),
+        # the sandbox has no resource module; peak memory is measured
+        # by tools/bench_recommendations.py
+        'memoryMb': round(runtime.memory_usage().current(), 1),
+    }
+    logging.info('Rebuilt related sessions: %s', stats)
+    return stats
+
+
+def getRelatedSessions(websafeSessionKey):
+    """Return [(websafe session key, count), ...] of a session, best
+    first."""
+    related = ndb.Key(RelatedSessions, websafeSessionKey).get()
+    if not related:
+        return []
+    return zip(related.sessions, related.counts)
@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+
+"""
+registration.py -- Udacity conference server-side Python App Engine
+    registration bookkeeping shared by the API and its tasks:
+    attendee roster, waitlist promotion and seat hold release
+
+"""
+
+from datetime import datetime
+
+from google.appengine.api import memcache
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+
+from models import Attendee
+from models import SeatHold
+from models import WaitlistEntry
+
+from cache import bumpGeneration
+from cache import getGeneration
+
+import analytics
+import outbox
+import versions
+
+WAITLIST_PROMOTION_BATCH = 20
+SEAT_HOLD_SWEEP_BATCH = 500
+MEMCACHE_WAITLIST_GENERATION_TPL = 'WAITLIST_GENERATION_%s'
+MEMCACHE_WAITLIST_POSITION_TPL = 'WAITLIST_POSITION_%s_%d'  # entry, gen
+# the count behind a position is eventually consistent; a position
+# cached just after a departure may miss it until it expires
+WAITLIST_POSITION_SECONDS = 60
+
+
+def addRegistration(prof, conf, seatTaken=False):
+    """Register a profile for a conference, taking away one seat
+    unless it was already taken (by a seat hold), and add it to the
+    roster; the registration event is recorded after commit. The
+    caller checks seats and puts both entities."""
+    initAttendeeCount(conf)
+    prof.conferenceKeysToAttend.append(conf.key.urlsafe())
+    if not seatTaken:
+        conf.seatsAvailable -= 1
+    conf.attendeeCount += 1
+    Attendee(parent=conf.key, id=prof.key.id(),
+        displayName=prof.displayName, mainEmail=prof.mainEmail).put()
+    analytics.recordRegistrationEvent(conf.key, 1)
+
+
+def removeRegistration(prof, conf):
+    """Unregister a profile from a conference, adding back one seat
+    and removing it from the roster; the cancellation event is recorded
+    after commit. The caller puts both entities."""
+    initAttendeeCount(conf)
+    prof.conferenceKeysToAttend.remove(conf.key.urlsafe())
+    conf.seatsAvailable += 1
+    conf.attendeeCount -= 1
+    ndb.Key(Attendee, prof.key.id(), parent=conf.key).delete()
+    analytics.recordRegistrationEvent(conf.key, -1)
+
+
+def initAttendeeCount(conf):
+    """Derive the attendee count of conferences created before it was
+    kept, from the seats taken other than by seat holds."""
+    if conf.attendeeCount is None:
+        held = SeatHold.query(ancestor=conf.key).count()
+        conf.attendeeCount = (conf.maxAttendees or 0) - \
+            (conf.seatsAvailable or 0) - held
+
+
+@ndb.transactional()
+def releaseSeatHolds(hold_keys):
+    """Give the seats of expired holds of one conference back."""
+    now = datetime.utcnow()
+    expired = [hold.key for hold in ndb.get_multi(hold_keys)
+        if hold and hold.expires < now]
+    if not expired:
+        return 0
+    conf = expired[0].parent().get()
+    if conf:
+        conf.seatsAvailable += len(expired)
+        versions.touchConference(conf)
+        conf.put()
+    ndb.delete_multi(expired)
+    return len(expired)
+
+
+def sweepSeatHolds():
+    """Release all expired seat holds, one transaction per conference,
+    and hand the freed seats to the waitlists."""
+    hold_keys = SeatHold.query(SeatHold.expires < datetime.utcnow()
+        ).fetch(SEAT_HOLD_SWEEP_BATCH, keys_only=True)
+    by_conference = {}
+    for hold_key in hold_keys:
+        by_conference.setdefault(hold_key.parent(), []).append(hold_key)
+    for c_key, keys in by_conference.items():
+        if releaseSeatHolds(keys):
+            enqueueWaitlistPromotion(c_key.urlsafe())
+    if len(hold_keys) == SEAT_HOLD_SWEEP_BATCH:
+        taskqueue.add(url='/crons/release_seat_holds', method='GET')
+
+
+def enqueueWaitlistPromotion(websafeConferenceKey):
+    """Schedule promoting waitlisted users into free seats."""
+    taskqueue.add(params={'websafeConferenceKey': websafeConferenceKey},
+        url='/tasks/promote_waitlist'
+    )
+
+
+def waitlistChanged(c_key):
+    """Invalidate the cached positions of a conference's waitlist after
+    an entry left it. Entries that join never move the others, so
+    they need no invalidation."""
+    bumpGeneration(MEMCACHE_WAITLIST_GENERATION_TPL % c_key.urlsafe())
+
+
+def waitlistPosition(entry):
+    """Return the 1-based position of a waitlist entry.
+
+    Positions are cached per waitlist generation, so users polling
+    their position only count the entries ahead of them again after
+    one of those has left.
+    """
+    mkey = MEMCACHE_WAITLIST_POSITION_TPL % (entry.key.id(), getGeneration(
+        MEMCACHE_WAITLIST_GENERATION_TPL % entry.conference.urlsafe()) or 0)
+    position = memcache.get(mkey)
+    if position is None:
+        position = WaitlistEntry.query(
+            WaitlistEntry.conference == entry.conference,
+            WaitlistEntry.created < entry.created).count(keys_only=True) + 1
+        memcache.set(mkey, position, time=WAITLIST_POSITION_SECONDS)
+    return position
+
+
+@ndb.transactional(xg=True)
+def promoteWaitlistEntry(entry_key):
+    """Give a free seat to one waitlisted user.
+
+    Returns False if the conference has no seats left, True otherwise
+    (including when the entry was already handled).
+    """
+    entry = entry_key.get()
+    if not entry:
+        return True
+    c_key = entry.conference
+    conf = c_key.get()
+    if conf and conf.seatsAvailable <= 0:
+        return False
+    # the entry leaves the waitlist below
+    ndb.get_context().call_on_commit(lambda: waitlistChanged(c_key))
+    if not conf:
+        entry_key.delete()
+        return True
+
+    prof = entry.profile.get()
+    if prof and conf.key.urlsafe() not in prof.conferenceKeysToAttend:
+        addRegistration(prof, conf)
+        versions.touchConference(conf)
+        prof.put()
+        conf.put()
+        email = prof.mainEmail
+        name = conf.name
+        ndb.get_context().call_on_commit(lambda: outbox.enqueueMail(email,
+            'You got a seat!',
+            'A seat became available and you are now registered '
+            'for %s.' % name,
+            idempotencyKey='waitlist-promoted:%s' % entry_key.id()))
+    entry_key.delete()
+    return True
+
+
+def promoteWaitlist(websafeConferenceKey):
+    """Promote waitlisted users of a conference in FIFO order, one
+    transaction each, while seats are available; chains a task for
+    the next batch."""
+    c_key = ndb.Key(urlsafe=websafeConferenceKey)
+    entry_keys = WaitlistEntry.query(WaitlistEntry.conference == c_key
+        ).order(WaitlistEntry.created
+        ).fetch(WAITLIST_PROMOTION_BATCH, keys_only=True)
+    for entry_key in entry_keys:
+        if not promoteWaitlistEntry(entry_key):
+            return
+    if len(entry_keys) == WAITLIST_PROMOTION_BATCH:
+        enqueueWaitlistPromotion(websafeConferenceKey)
@@ -0,0 +1,260 @@
+#!/usr/bin/env python
+
+"""
+schedule.py -- Udacity conference server-side Python App Engine
+    session serialization, precomputed schedule snapshots and
+    the fan-out of denormalized session names
+
+"""
+
+import logging
+import time
+import zlib
+
+from protorpc import protojson
+
+from google.appengine.api import memcache
+from google.appengine.api import taskqueue
+from google.appengine.datastore.datastore_query import Cursor
+from google.appengine.ext import ndb
+
+from models import ScheduleSnapshot
+from models import Session
+from models import SessionForm
+from models import SessionForms
+from models import SessionType
+
+from cache import casUpdate
+
+import versions
+
+MEMCACHE_SESSION_NAMES_STATS_KEY = "SESSION_NAMES_FANOUT_STATS"
+FAN_OUT_STATS = {'fanOuts': 0, 'totalLagSeconds': 0.0, 'maxLagSeconds': 0.0,
+                 'last': None, 'sweepRepairs': 0}
+MEMCACHE_SCHEDULE_SNAPSHOT_KEY = "SCHEDULE_SNAPSHOT_%s"
+SESSION_NAMES_BATCH = 100
+# speaker fan-outs find sessions with an eventually consistent query;
+# one more pass this much later catches sessions it did not see yet
+SESSION_NAMES_SWEEP_SECONDS = 60
+
+
+def copySessionToForm(session):
+    """Copy relevant fields from Session to SessionForm."""
+    sf = SessionForm()
+    for field in sf.all_fields():
+        if hasattr(session, field.name):
+            # convert Date to date string and Time to time string
+            if field.name.endswith('date') or field.name.endswith('Time'):
+                setattr(sf, field.name, str(getattr(session, field.name)))
+            # convert session typeOfSession string to Enum; 
+            elif field.name == 'typeOfSession':
+                #setattr(sf, field.name, getattr(session, field.name))
+                setattr(sf, field.name, getattr(SessionType, getattr(session, field.name)))               
+            # just copy others                   
+            else:
+                setattr(sf, field.name, getattr(session, field.name))
+
+    # show the session's own websafe key
+    setattr(sf, 'websafeKey', session.key.urlsafe())
+
+    # conference and speaker names are denormalized onto the session;
+    # only sessions written before that need to look them up
+    if not session.conferenceName:
+        if session.key and session.key.parent():
+            conf = session.key.parent().get()
+            setattr(sf, 'conferenceName', getattr(conf, 'name'))
+        else:
+            setattr(sf, 'conferenceName', 'not set')
+
+    # if the session has a speaker assigned, show their name and websafe key
+    sp_key = getattr(session, 'speaker', None)
+    if sp_key:
+        setattr(sf, 'websafeSpeakerKey', sp_key.urlsafe())
+        if not session.speakerName:
+            speaker = sp_key.get()
+            setattr(sf, 'speakerName', getattr(speaker, 'name'))
+
+    sf.check_initialized()
+    return sf
+
+
+def sessionsChanged(c_key):
+    """Record that the sessions of a conference have changed: bump its
+    version and schedule version, and have its schedule snapshot
+    rebuilt."""
+    versions.bumpConferenceVersion(c_key)
+    wsck = c_key.urlsafe()
+    memcache.delete(MEMCACHE_SCHEDULE_SNAPSHOT_KEY % wsck)
+    taskqueue.add(params={'websafeConferenceKey': wsck},
+        url='/tasks/build_schedule_snapshot'
+    )
+
+
+def enqueueScheduleSnapshot(websafeConferenceKey, scheduleVersion):
+    """Have the snapshot of a schedule version built, once: readers
+    missing the same snapshot share a single named task."""
+    try:
+        taskqueue.add(name='schedule-%s-%d' % (websafeConferenceKey,
+                scheduleVersion),
+            params={'websafeConferenceKey': websafeConferenceKey},
+            url='/tasks/build_schedule_snapshot'
+        )
+    except (taskqueue.TaskAlreadyExistsError, taskqueue.TombstonedTaskError):
+        pass
+
+
+@ndb.transactional()
+def _storeScheduleSnapshot(websafeConferenceKey, scheduleVersion, blob):
+    """Store a snapshot unless one of a later schedule version is stored
+    already; returns whether it was stored. Only the snapshot's own
+    entity group is part of the transaction."""
+    snapshot = ndb.Key(ScheduleSnapshot, websafeConferenceKey).get()
+    if snapshot and snapshot.scheduleVersion is not None and \
+            snapshot.scheduleVersion > scheduleVersion:
+        return False
+    ScheduleSnapshot(id=websafeConferenceKey, data=blob,
+                     scheduleVersion=scheduleVersion).put()
+    return True
+
+
+def buildScheduleSnapshot(websafeConferenceKey):
+    """Serialize, compress and store the schedule of a conference in
+    memcache and the datastore (run as a task); returns the compressed
+    bytes.
+
+    The snapshot is tagged with the schedule version read before the
+    sessions, so if a session changes meanwhile, readers reject the
+    snapshot until the rebuild that change enqueued has run.
+    """
+    started = time.time()
+    c_key = ndb.Key(urlsafe=websafeConferenceKey)
+    conf = c_key.get()
+    if not conf:
+        return None
+    scheduleVersion = conf.scheduleVersion or 0
+    forms = SessionForms(items=[copySessionToForm(session)
+        for session in Session.query(ancestor=c_key)])
+    blob = zlib.compress(protojson.encode_message(forms))
+    if not _storeScheduleSnapshot(websafeConferenceKey, scheduleVersion,
+                                  blob):
+        logging.info('Dropped stale schedule snapshot of %s (version %d)',
+            websafeConferenceKey, scheduleVersion)
+        return blob
+    memcache.set(MEMCACHE_SCHEDULE_SNAPSHOT_KEY % websafeConferenceKey,
+        (scheduleVersion, blob))
+    logging.info('Built schedule snapshot of %s: %d sessions, %d bytes, '
+        '%.1fms', websafeConferenceKey, len(forms.items), len(blob),
+        (time.time() - started) * 1000)
+    return blob
+
+
+def getScheduleSnapshot(websafeConferenceKey, scheduleVersion):
+    """Return the schedule snapshot of a conference at `scheduleVersion`
+    as SessionForms, or None if there is none for that version."""
+    mkey = MEMCACHE_SCHEDULE_SNAPSHOT_KEY % websafeConferenceKey
+    cached = memcache.get(mkey)
+    if cached is None or cached[0] != scheduleVersion:
+        snapshot = ndb.Key(ScheduleSnapshot, websafeConferenceKey).get()
+        if not snapshot or snapshot.scheduleVersion != scheduleVersion:
+            return None
+        cached = (scheduleVersion, snapshot.data)
+        memcache.set(mkey, cached)
+    return protojson.decode_message(SessionForms, zlib.decompress(cached[1]))
+
+
+def enqueueSessionNamesFanOut(kind, websafeKey, transactional=False):
+    """Schedule rewriting the denormalized names of all sessions of a
+    renamed conference or speaker (kind 'conference' or 'speaker')."""
+    taskqueue.add(params={'kind': kind, 'websafeKey': websafeKey,
+            'enqueued': repr(time.time())},
+        url='/tasks/update_session_names',
+        transactional=transactional
+    )
+
+
+def _recordFanOut(kind=None, websafeKey=None, lag=None, repaired=0):
+    """Add a finished fan-out (with its lag in seconds) or the sessions
+    repaired by a sweep to the fan-out stats."""
+    def merge(stats):
+        stats = stats or dict(FAN_OUT_STATS)
+        if lag is not None:
+            stats['fanOuts'] += 1
+            stats['totalLagSeconds'] += lag
+            stats['maxLagSeconds'] = max(stats['maxLagSeconds'], lag)
+            stats['last'] = {'kind': kind, 'websafeKey': websafeKey,
+                'lagSeconds': round(lag, 3), 'finished': int(time.time())}
+        stats['sweepRepairs'] += repaired
+        return stats
+
+    if not casUpdate(MEMCACHE_SESSION_NAMES_STATS_KEY, merge):
+        logging.info('Session name fan-out stats not recorded: memcache '
+            'contention')
+
+
+def sessionNamesFanOutStats():
+    """Return the number of finished fan-outs, their mean and maximum
+    lag from rename to last batch, the latest one and the sessions
+    sweeps still had to repair, since the stats were last evicted."""
+    stats = memcache.get(MEMCACHE_SESSION_NAMES_STATS_KEY) or \
+        dict(FAN_OUT_STATS)
+    stats['meanLagSeconds'] = round(stats['totalLagSeconds'] /
+        stats['fanOuts'], 3) if stats['fanOuts'] else None
+    return stats
+
+
+def fanOutSessionNames(kind, websafeKey, enqueued, cursor=None, sweep=False):
+    """Rewrite one batch of sessions with the current name of their
+    conference or speaker, chaining a task for the next batch.
+
+    The name is read when the batch runs, so the latest rename wins
+    even if fan-outs overlap. The time from the rename to the last
+    batch is logged and added to sessionNamesFanOutStats().
+
+    Sessions of a speaker are found with a global query, which may miss
+    sessions written just before the rename; a second pass (`sweep`)
+    runs SESSION_NAMES_SWEEP_SECONDS after the first one has finished
+    and logs the sessions it still had to repair.
+    """
+    key = ndb.Key(urlsafe=websafeKey)
+    entity = key.get()
+    if not entity:
+        return
+    if kind == 'conference':
+        field = 'conferenceName'
+        q = Session.query(ancestor=key)
+    else:
+        field = 'speakerName'
+        q = Session.query(Session.speaker == key)
+
+    s_keys, next_cursor, more = q.fetch_page(SESSION_NAMES_BATCH,
+        keys_only=True,
+        start_cursor=Cursor(urlsafe=cursor) if cursor else None)
+    stale = [session for session in ndb.get_multi(s_keys)
+        if session and getattr(session, field) != entity.name]
+    for session in stale:
+        setattr(session, field, entity.name)
+    ndb.put_multi(stale)
+    if sweep and stale:
+        logging.warning('Session %s sweep for %s repaired %d sessions',
+            field, websafeKey, len(stale))
+        _recordFanOut(repaired=len(stale))
+
+    # session lists of these conferences have changed
+    for c_key in set(session.key.parent() for session in stale):
+        sessionsChanged(c_key)
+
+    params = {'kind': kind, 'websafeKey': websafeKey, 'enqueued': enqueued}
+    if sweep:
+        params['sweep'] = '1'
+    if more and next_cursor:
+        params['cursor'] = next_cursor.urlsafe()
+        taskqueue.add(params=params, url='/tasks/update_session_names')
+    elif not sweep:
+        lag = time.time() - float(enqueued)
+        _recordFanOut(kind=kind, websafeKey=websafeKey, lag=lag)
+        logging.info('Session %s fan-out for %s done after %.1fs',
+            field, websafeKey, lag)
+        if kind == 'speaker':
+            params['sweep'] = '1'
+            taskqueue.add(params=params, url='/tasks/update_session_names',
+                countdown=SESSION_NAMES_SWEEP_SECONDS)
@@ -13,3 +13,23 @@ ANDROID_CLIENT_ID = 'replace with Android client ID'
 IOS_CLIENT_ID = 'replace with iOS client ID'
 ANDROID_AUDIENCE = WEB_CLIENT_ID
 
+
+# Per-user rate limits for write endpoints, by endpoint name:
+# (burst, refill rate in calls per second). Endpoints not listed here
+# are not limited.
+RATE_LIMITS = {
+    'createSession': (10, 1.0),
+    'registerForConference': (5, 0.5),
+    'registerForConferences': (2, 0.1),
+    'holdSeat': (5, 0.5),
+    'addSessionToWishlist': (10, 1.0),
+}
+
+# Retry budgets of instrumented transactions, by transaction name:
+# (retries after the first attempt, seconds after which no retry is
+# started). Transactions not listed here get DEFAULT_TRANSACTION_RETRY.
+DEFAULT_TRANSACTION_RETRY = (3, 5.0)
+TRANSACTION_RETRIES = {
+    'conferenceRegistration': (5, 5.0),
+    'updateConference': (3, 5.0),
+}
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+
+"""
+stream.py -- Udacity conference server-side Python App Engine
+    read-only handlers streaming large result sets as NDJSON, one
+    batch at a time; loaded lazily by main.py
+
+"""
+
+import logging
+
+import endpoints
+import webapp2
+from protorpc import protojson
+
+from google.appengine.api import oauth
+from google.appengine.ext import ndb
+
+from models import Session
+from settings import WEB_CLIENT_ID
+from settings import ANDROID_CLIENT_ID
+from settings import IOS_CLIENT_ID
+
+import schedule
+
+STREAM_BATCH = 200
+ALLOWED_CLIENT_IDS = (WEB_CLIENT_ID, ANDROID_CLIENT_ID, IOS_CLIENT_ID,
+                      endpoints.API_EXPLORER_CLIENT_ID)
+
+
+def _currentUser():
+    """Return the user of the request's OAuth token if it was issued to
+    one of our clients with the email scope (as for the Endpoints API),
+    else None."""
+    try:
+        user = oauth.get_current_user(endpoints.EMAIL_SCOPE)
+        client_id = oauth.get_client_id(endpoints.EMAIL_SCOPE)
+    except oauth.Error:
+        return None
+    if client_id not in ALLOWED_CLIENT_IDS:
+        logging.warning('Client id %s not allowed', client_id)
+        return None
+    return user
+
+
+def _sessionLines(conf):
+    """Yield the sessions of a conference as NDJSON, one batch per
+    chunk; only one batch is held in memory at a time."""
+    query = Session.query(ancestor=conf.key)
+    cursor = None
+    more = True
+    while more:
+        # keep batches out of the in-context cache, which would hold
+        # every entity fetched until the request ends
+        sessions, cursor, more = query.fetch_page(STREAM_BATCH,
+            start_cursor=cursor, use_cache=False, use_memcache=False)
+        more = more and cursor is not None
+
+        # resolve speaker names of sessions written before they were
+        # denormalized, for the whole batch at once
+        sp_keys = set(s.speaker for s in sessions
+            if s.speaker and not s.speakerName)
+        names = dict((sp.key, sp.name)
+            for sp in ndb.get_multi(sp_keys, use_cache=False,
+                use_memcache=False) if sp)
+        for session in sessions:
+            if session.speaker in names:
+                session.speakerName = names[session.speaker]
+            if not session.conferenceName:
+                session.conferenceName = conf.name
+
+        yield ''.join(
+            protojson.encode_message(schedule.copySessionToForm(session))
+            + '\n' for session in sessions)
+
+
+class ConferenceSessionsHandler(webapp2.RequestHandler):
+    def get(self, websafeConferenceKey):
+        """Stream all sessions of a conference as NDJSON."""
+        if not _currentUser():
+            self.abort(401, 'Authorization required')
+        try:
+            c_key = ndb.Key(urlsafe=websafeConferenceKey)
+        except Exception:
+            self.abort(400, 'websafeConferenceKey given is corrupted')
+        conf = c_key.get()
+        if not conf:
+            self.abort(404, 'Conference with this key does not exist')
+
+        self.response.content_type = 'application/x-ndjson'
+        self.response.app_iter = _sessionLines(conf)
@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+
+"""
+sync.py -- Udacity conference server-side Python App Engine
+    delta sync: conferences and sessions changed or deleted since an
+    opaque sync token, a page at a time
+
+"""
+
+import base64
+import json
+from datetime import datetime
+from datetime import timedelta
+
+from google.appengine.api import datastore_errors
+from google.appengine.api import taskqueue
+from google.appengine.datastore.datastore_query import Cursor
+from google.appengine.ext import ndb
+
+from models import Conference
+from models import Session
+from models import Tombstone
+
+SYNC_PAGE_SIZE = 100
+# changes are looked for from this long before the previous sync
+# started, to cover writes that were in flight (or not yet visible to
+# queries) then; clients may see such entities twice
+SYNC_OVERLAP = timedelta(seconds=60)
+# tokens older than this cannot be served from tombstones any more
+TOMBSTONE_TTL = timedelta(days=30)
+TOMBSTONE_PURGE_BATCH = 500
+EPOCH = datetime(1970, 1, 1)
+
+# parts of a sync, in order
+PHASES = ('conferences', 'sessions', 'deleted')
+
+
+def tombstone(key, c_key):
+    """Return the Tombstone recording the deletion of the entity `key`
+    of the conference `c_key`; the caller puts it."""
+    return Tombstone(id=key.urlsafe(), kind=key.kind(),
+                     conference=c_key.urlsafe())
+
+
+def _micros(dt):
+    return int((dt - EPOCH).total_seconds() * 1000000)
+
+
+def _datetime(micros):
+    return EPOCH + timedelta(microseconds=micros)
+
+
+def _encodeToken(state):
+    return base64.urlsafe_b64encode(json.dumps(state))
+
+
+def _decodeToken(token):
+    """Return the state in a sync token (since as a datetime, cursor as
+    a Cursor); raise ValueError if it is not one."""
+    try:
+        state = json.loads(base64.urlsafe_b64decode(str(token)))
+        since, until, phase, cursor, scope = (state['since'],
+            state['until'], int(state['phase']), state['cursor'],
+            state['scope'])
+        if not 0 <= phase <= len(PHASES) or \
+                (until is None and (phase or cursor)):
+            raise ValueError('inconsistent sync token')
+        return (_datetime(int(since)) if since is not None else None,
+                int(until) if until is not None else None, phase,
+                Cursor(urlsafe=cursor) if cursor else None, scope)
+    except (TypeError, KeyError, ValueError, OverflowError,
+            datastore_errors.BadValueError):
+        raise ValueError('not a sync token')
+
+
+def _query(phase, since, c_key):
+    """Return the query of a phase, ordered by modification time; for a
+    full sync (since None), ordered by key, so that entities written
+    before they had a modification time are included too."""
+    if phase == 'conferences':
+        model, prop = Conference, Conference.modified
+        q = Conference.query()
+    elif phase == 'sessions':
+        model, prop = Session, Session.modified
+        q = Session.query(ancestor=c_key) if c_key else Session.query()
+    else:
+        model, prop = Tombstone, Tombstone.deleted
+        q = Tombstone.query()
+        if c_key:
+            q = q.filter(Tombstone.conference == c_key.urlsafe())
+    if since is None:
+        # entities written during the round have a modification time
+        # after it started, so the next round picks them up
+        return q.order(model.key)
+    return q.filter(prop > since).order(prop)
+
+
+def changesSince(token, c_key=None, limit=SYNC_PAGE_SIZE):
+    """Return one page of changes since a sync token (None for a full
+    sync), optionally of one conference only.
+
+    Returns (changes, nextToken, more, reset): changes maps each phase
+    to a list of Conference, Session or Tombstone entities; reset is
+    True if the client has to drop its data first (a full sync). Pass
+    nextToken back while more is True, and next time a sync is due.
+    """
+    now = datetime.utcnow()
+    scope = c_key.urlsafe() if c_key else ''
+    if token:
+        since, until, phase, cursor, tokenScope = _decodeToken(token)
+        if tokenScope != scope:
+            raise ValueError('sync token is for another conference')
+    else:
+        since, phase, cursor = None, 0, None
+    if phase == 0 and cursor is None:
+        # a new round; what changes from now on is left to the next one
+        until = _micros(now)
+
+    reset = since is None and phase == 0 and cursor is None
+    if since is not None and since < now - TOMBSTONE_TTL:
+        # deletions that old may be purged; start over
+        since, until, phase, cursor = None, _micros(now), 0, None
+        reset = True
+
+    changes = dict((name, []) for name in PHASES)
+    remaining = limit
+    while phase < len(PHASES) and remaining > 0:
+        name = PHASES[phase]
+        if name == 'deleted' and since is None:
+            pass        # nothing to delete after a full sync
+        elif name == 'conferences' and c_key:
+            conf = c_key.get()
+            if conf and (since is None or
+                    (conf.modified and conf.modified > since)):
+                changes[name].append(conf)
+                remaining -= 1
+        else:
+            items, next_cursor, more = _query(name, since, c_key
+                ).fetch_page(remaining, start_cursor=cursor)
+            changes[name].extend(items)
+            remaining -= len(items)
+            if more and next_cursor:
+                cursor = next_cursor
+                break
+        phase += 1
+        cursor = None
+
+    if phase < len(PHASES):
+        more = True
+        state = {'since': _micros(since) if since is not None else None,
+                 'until': until, 'phase': phase,
+                 'cursor': cursor.urlsafe() if cursor else None,
+                 'scope': scope}
+    else:
+        more = False
+        state = {'since': _micros(_datetime(until) - SYNC_OVERLAP),
+                 'until': None, 'phase': 0, 'cursor': None, 'scope': scope}
+    return changes, _encodeToken(state), more, reset
+
+
+def purgeTombstones():
+    """Delete tombstones older than TOMBSTONE_TTL; chains itself while
+    there are more."""
+    keys = Tombstone.query(
+        Tombstone.deleted < datetime.utcnow() - TOMBSTONE_TTL
+        ).fetch(TOMBSTONE_PURGE_BATCH, keys_only=True)
+    ndb.delete_multi(keys)
+    if len(keys) == TOMBSTONE_PURGE_BATCH:
+        taskqueue.add(url='/crons/purge_tombstones', method='GET')
@@ -0,0 +1,230 @@
+#!/usr/bin/env python
+
+"""
+tasks.py -- Udacity conference server-side Python App Engine
+    task queue & cron handlers; loaded lazily by main.py and kept
+    free of the Endpoints API. Handlers import the helper modules
+    they use, so an instance pays only for the tasks it runs
+
+"""
+
+import json
+import logging
+
+import webapp2
+
+class SetAnnouncementHandler(webapp2.RequestHandler):
+    def get(self):
+        """Set Announcement in Memcache."""
+        import announcements
+        announcements.cacheAnnouncement()
+        self.response.set_status(204)
+
+class CheckFeaturedSpeakerHandler(webapp2.RequestHandler):
+    def post(self):
+        """Set Featured Speaker in Memcache"""
+        import announcements
+        announcements.cacheFeaturedSpeaker(
+            self.request.get('websafeConferenceKey'), 
+            self.request.get('websafeSpeakerKey'))
+        logging.info('Featured speaker tasks: %s',
+            announcements.featuredSpeakerTaskStats())
+
+class UpdateSessionNamesHandler(webapp2.RequestHandler):
+    def post(self):
+        """Rewrite denormalized names on sessions after a rename."""
+        import schedule
+        schedule.fanOutSessionNames(
+            self.request.get('kind'),
+            self.request.get('websafeKey'),
+            self.request.get('enqueued'),
+            self.request.get('cursor') or None,
+            sweep=bool(self.request.get('sweep')))
+
+class PromoteWaitlistHandler(webapp2.RequestHandler):
+    def post(self):
+        """Give free seats to waitlisted users."""
+        import registration
+        registration.promoteWaitlist(
+            self.request.get('websafeConferenceKey'))
+
+class ReleaseSeatHoldsHandler(webapp2.RequestHandler):
+    def get(self):
+        """Give seats of expired holds back."""
+        import registration
+        registration.sweepSeatHolds()
+        self.response.set_status(204)
+
+class ApplyFacetDeltaHandler(webapp2.RequestHandler):
+    def post(self):
+        """Apply a conference's change to the facet counts."""
+        import facets
+        try:
+            facets.applyFacetDelta(json.loads(self.request.body))
+        except facets.FacetRebuildInProgress as e:
+            # fail the task so that the queue retries it later
+            logging.info('Facet delta postponed: %s', e)
+            self.response.set_status(503)
+
+class RebuildFacetsHandler(webapp2.RequestHandler):
+    def get(self):
+        """Recount the facet counts from scratch."""
+        import facets
+        facets.rebuildFacets()
+        self.response.set_status(204)
+
+class RebuildRelatedSessionsHandler(webapp2.RequestHandler):
+    def get(self):
+        """Recompute related sessions from all wishlists, reporting stats."""
+        import recommendations
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.write(json.dumps(
+            recommendations.rebuildRelatedSessions()))
+
+class BuildScheduleSnapshotHandler(webapp2.RequestHandler):
+    def post(self):
+        """Rebuild the schedule snapshot of a conference."""
+        import schedule
+        schedule.buildScheduleSnapshot(
+            self.request.get('websafeConferenceKey'))
+
+class SendConfirmationEmailHandler(webapp2.RequestHandler):
+    def post(self):
+        """Move a queued confirmation email into the mail outbox."""
+        import outbox
+        outbox.enqueueMail(
+            self.request.get('email'),
+            'You created a new Conference!',
+            'Hi, you have created a following '
+            'conference:\r\n\r\n%s' % self.request.get(
+                'conferenceInfo')
+        )
+
+class DrainMailOutboxHandler(webapp2.RequestHandler):
+    def get(self):
+        """Send pending mail from the outbox (cron), reporting stats."""
+        import outbox
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.write(json.dumps(outbox.drain()))
+
+    post = get
+
+class MailOutboxStatsHandler(webapp2.RequestHandler):
+    def get(self):
+        """Report the stats of the latest outbox drain and the mail
+        waiting to be sent."""
+        import outbox
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.write(json.dumps(outbox.outboxStats()))
+
+class DeleteConferenceHandler(webapp2.RequestHandler):
+    def post(self):
+        """Clean up one batch after a deleted conference."""
+        import deletion
+        deletion.deleteConferenceBatch(
+            self.request.get('websafeConferenceKey'),
+            self.request.get('phase'),
+            deletion.parseCursor(self.request.get('cursor')))
+
+class PurgeTombstonesHandler(webapp2.RequestHandler):
+    def get(self):
+        """Delete tombstones too old for any sync token."""
+        import sync
+        sync.purgeTombstones()
+        self.response.set_status(204)
+
+class StartRegistrationAggregationHandler(webapp2.RequestHandler):
+    def get(self):
+        """Roll new registration events up into stats (cron)."""
+        import analytics
+        analytics.startAggregation()
+        self.response.set_status(204)
+
+class AggregateRegistrationsHandler(webapp2.RequestHandler):
+    def post(self):
+        """Roll up registration events of one shard."""
+        import analytics
+        analytics.aggregateShard(int(self.request.get('shard')))
+
+class QueryCacheStatsHandler(webapp2.RequestHandler):
+    def get(self):
+        """Report hit ratio and memory footprint of the queryConferences
+        result cache."""
+        import querycache
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.write(json.dumps(querycache.queryCacheStats()))
+
+class TransactionStatsHandler(webapp2.RequestHandler):
+    def get(self):
+        """Report the entity groups with the most transaction conflicts
+        in the latest hours."""
+        import contention
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.write(json.dumps(contention.transactionStats(
+            windows=int(self.request.get('hours') or 2),
+            limit=int(self.request.get('limit') or 20))))
+
+class ProfilingHandler(webapp2.RequestHandler):
+    def get(self):
+        """Report sample rates and the top functions by cumulative time
+        of every profiled API method."""
+        import profiling
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.write(json.dumps({
+            'sampleRates': profiling.sampleRates(),
+            'methods': profiling.profileStats(
+                int(self.request.get('limit') or 20)),
+        }))
+
+    def post(self):
+        """Set the sample rate of a method (rate=0 to stop profiling
+        it), or drop all statistics (reset=1)."""
+        import profiling
+        if self.request.get('reset'):
+            profiling.resetProfileStats()
+        name = self.request.get('method')
+        if name:
+            try:
+                rate = float(self.request.get('rate') or 0)
+            except ValueError:
+                self.abort(400, 'rate must be a number')
+            profiling.setSampleRate(name, rate)
+
+class RunMigrationHandler(webapp2.RequestHandler):
+    def post(self):
+        """Run one batch of a schema migration."""
+        import migrations
+        migrations.runMigrationBatch(self.request.get('name'),
+            int(self.request.get('run')), int(self.request.get('batch')))
+
+class MigrationsHandler(webapp2.RequestHandler):
+    def get(self):
+        """Report the progress of all schema migrations."""
+        import migrations
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.write(json.dumps(migrations.migrationProgress()))
+
+    def post(self):
+        """Start a schema migration (dryRun=1 to only count changes)."""
+        import migrations
+        try:
+            migrations.startMigration(self.request.get('name'),
+                dryRun=self.request.get('dryRun') in ('1', 'true'))
+        except ValueError as e:
+            self.abort(400, str(e))
+        self.response.set_status(202)
+
+class RateLimitStatsHandler(webapp2.RequestHandler):
+    def get(self):
+        """Report admitted and rejected calls per rate-limited endpoint."""
+        import ratelimit
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.write(json.dumps(ratelimit.rateLimitStats()))
+
+class FanOutStatsHandler(webapp2.RequestHandler):
+    def get(self):
+        """Report the lag of session name fan-outs and the sessions their
+        sweeps had to repair."""
+        import schedule
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.write(json.dumps(schedule.sessionNamesFanOutStats()))
@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+
+"""
+_local.py -- shared set-up of the tools that run the app against the
+local service stubs
+
+"""
+
+import os
+import sys
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def setUp(sdk, mail=False, users=False, consistency=None):
+    """Put the SDK and the app on the path and activate the datastore,
+    memcache, task queue and app identity stubs, plus the mail and
+    users stubs if asked for; returns the active Testbed.
+
+    `consistency` is the probability that a global query sees a write
+    right away (None for the stub's default).
+    """
+    sys.path.insert(0, sdk)
+    import dev_appserver
+    dev_appserver.fix_sys_path()
+    sys.path.insert(0, APP_DIR)
+
+    from google.appengine.datastore import datastore_stub_util
+    from google.appengine.ext import testbed
+
+    tb = testbed.Testbed()
+    tb.activate()
+    tb.setup_env(app_id='the-conference')
+    if consistency is None:
+        tb.init_datastore_v3_stub()
+    else:
+        tb.init_datastore_v3_stub(
+            consistency_policy=datastore_stub_util.PseudoRandomHRConsistencyPolicy(
+                probability=consistency))
+    tb.init_memcache_stub()
+    tb.init_taskqueue_stub(root_path=APP_DIR)
+    tb.init_app_identity_stub()
+    if mail:
+        tb.init_mail_stub()
+    if users:
+        tb.init_user_stub()
+    return tb
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+
+"""
+bench_recommendations.py -- runtime and memory of the wishlist
+co-occurrence job on synthetic wishlists
+
+Every size runs in a fresh interpreter, so peak memory (max RSS) is
+that of one run. Wishlists hold 0-15 sessions from one to three
+conferences, with a skew towards popular sessions; the datastore is
+not involved, only recommendations.topRelated().
+
+Usage: python tools/bench_recommendations.py --sdk ~/google_appengine
+           [--profiles 25000,50000,100000] [--conferences 50]
+           [--sessions 200]
+
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHILD = '''
+import json, random, resource, sys, time
+sys.path.insert(0, %(sdk)r)
+import dev_appserver
+dev_appserver.fix_sys_path()
+sys.path.insert(0, %(app)r)
+
+import recommendations
+
+def wishlists(rng):
+    for _ in range(%(profiles)d):
+        wishlist = []
+        size = rng.randint(0, 15)
+        confs = [rng.randrange(%(conferences)d)
+                 for _ in range(rng.randint(1, 3))]
+        for _ in range(size):
+            # square of a uniform variate: popular sessions come first
+            session = int(%(sessions)d * rng.random() ** 2)
+            wishlist.append('c%%d-s%%d' %% (rng.choice(confs), session))
+        yield wishlist
+
+baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+started = time.time()
+related = recommendations.topRelated(wishlists(random.Random(0)),
+    conferenceOf=lambda wssk: wssk.split('-')[0])
+elapsed = time.time() - started
+print(json.dumps({
+    'seconds': elapsed,
+    'peakKb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    'baselineKb': baseline,
+    'sessions': len(related),
+}))
+'''
+
+
+def sample(sdk, profiles, conferences, sessions):
+    code = CHILD % {'sdk': sdk, 'app': APP_DIR, 'profiles': profiles,
+                    'conferences': conferences, 'sessions': sessions}
+    output = subprocess.check_output([sys.executable, '-c', code],
+                                     cwd=APP_DIR)
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--sdk', required=True,
+                        help='path of the App Engine Python SDK')
+    parser.add_argument('--profiles', default='25000,50000,100000',
+                        help='comma-separated dataset sizes')
+    parser.add_argument('--conferences', type=int, default=50)
+    parser.add_argument('--sessions', type=int, default=200,
+                        help='sessions per conference')
+    args = parser.parse_args()
+
+    print('%10s %10s %12s %14s %10s' % (
+        'profiles', 'seconds', 'us/profile', 'peak MB (+job)', 'sessions'))
+    for profiles in [int(n) for n in args.profiles.split(',')]:
+        s = sample(args.sdk, profiles, args.conferences, args.sessions)
+        print('%10d %10.2f %12.1f %7.1f (+%.1f) %10d' % (
+            profiles, s['seconds'], s['seconds'] / profiles * 1e6,
+            s['peakKb'] / 1024.0, (s['peakKb'] - s['baselineKb']) / 1024.0,
+            s['sessions']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+
+"""
+bench_schedule.py -- cold vs warm latency of getConferenceSessions
+against the local service stubs
+
+Seeds one conference with --sessions sessions (500 by default) and
+calls getConferenceSessions through the ConferenceApi method, in three
+states of the schedule snapshot:
+
+  cold       no snapshot: ancestor query and per-session forms (the
+             snapshot itself is built by a task)
+  datastore  snapshot entity only (memcache flushed)
+  warm       snapshot in memcache
+
+Numbers are only comparable between runs on the same machine: the
+stubs are in-process and much faster than the real services, so the
+difference understates what a cold request costs in production.
+
+Usage: python tools/bench_schedule.py --sdk ~/google_appengine
+           [--sessions 500] [--speakers 50] [--runs 20]
+
+"""
+
+import argparse
+import time
+from datetime import date
+from datetime import time as dtime
+
+from _local import setUp
+
+
+def seed(sessions, speakers):
+    """Create a conference with `sessions` sessions; returns its
+    websafe key."""
+    from google.appengine.ext import ndb
+    from models import Conference, Profile, Session, Speaker
+
+    organizer = ndb.Key(Profile, 'organizer@example.com')
+    c_key = Conference(parent=organizer, name='Benchmark',
+                       organizerUserId=organizer.id(), maxAttendees=100,
+                       seatsAvailable=100, attendeeCount=0).put()
+    sp_keys = ndb.put_multi([Speaker(name='Speaker %d' % i)
+                             for i in range(speakers)])
+    ndb.put_multi([Session(parent=c_key, sessionName='Session %d' % i,
+                           highlights='Highlights of session %d' % i,
+                           speaker=sp_keys[i % speakers],
+                           speakerName='Speaker %d' % (i % speakers),
+                           conferenceName='Benchmark', duration=45,
+                           typeOfSession='LECTURE', date=date(2026, 6, 1),
+                           startTime=dtime(9 + i % 9, 0))
+                   for i in range(sessions)])
+    return c_key.urlsafe()
+
+
+def _call(wsck):
+    import conference
+    request = conference.SESSION_QUERY_REQUEST.combined_message_class(
+        websafeConferenceKey=wsck)
+    started = time.time()
+    forms = conference.ConferenceApi.getConferenceSessions.remote.method(
+        conference.ConferenceApi(), request)
+    return time.time() - started, len(forms.items)
+
+
+def measure(wsck, state, runs):
+    """Return the latencies of `runs` calls in snapshot state `state`."""
+    from google.appengine.api import memcache
+    from google.appengine.ext import ndb
+    from models import ScheduleSnapshot
+    import schedule
+
+    schedule.buildScheduleSnapshot(wsck)    # as the task would
+    latencies = []
+    for _ in range(runs):
+        if state == 'cold':
+            ndb.Key(ScheduleSnapshot, wsck).delete()
+            memcache.flush_all()
+        elif state == 'datastore':
+            memcache.flush_all()
+        # the in-context cache would hide the datastore reads
+        ndb.get_context().clear_cache()
+        seconds, count = _call(wsck)
+        latencies.append(seconds)
+    return latencies, count
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--sdk', required=True,
+                        help='path of the App Engine Python SDK')
+    parser.add_argument('--sessions', type=int, default=500)
+    parser.add_argument('--speakers', type=int, default=50)
+    parser.add_argument('--runs', type=int, default=20)
+    args = parser.parse_args()
+
+    tb = setUp(args.sdk, users=True, consistency=1)
+    wsck = seed(args.sessions, args.speakers)
+
+    print('%-10s %8s %8s %8s %8s' % ('snapshot', 'sessions', 'p50 ms',
+                                     'p90 ms', 'mean ms'))
+    p50s = {}
+    for state in ('cold', 'datastore', 'warm'):
+        latencies, count = measure(wsck, state, args.runs)
+        p50s[state] = percentile(latencies, 0.5)
+        print('%-10s %8d %8.1f %8.1f %8.1f' % (state, count,
+            p50s[state] * 1000, percentile(latencies, 0.9) * 1000,
+            sum(latencies) / len(latencies) * 1000))
+    print('cold/warm p50: %.1fx' % (p50s['cold'] / p50s['warm']))
+    tb.deactivate()
+
+
+if __name__ == '__main__':
+    main()
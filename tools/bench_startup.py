@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+
+"""
+bench_startup.py -- cold-start benchmark for the API and task entry points
+
+Every sample runs in a fresh interpreter, so nothing is imported yet:
+
+  import     time to import the entry module (conference / main)
+  first      import plus serving one request through its WSGI app,
+             against the testbed service stubs
+
+Usage: python tools/bench_startup.py --sdk ~/google_appengine [--runs 5]
+
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+ENTRY_POINTS = {
+    # name: (module, WSGI app attribute, method, path, body)
+    'api': ('conference', 'api', 'POST',
+            '/_ah/spi/ConferenceApi.getAnnouncement', '{}'),
+    'tasks': ('main', 'app', 'GET', '/crons/set_announcement', ''),
+}
+
+CHILD = '''
+import json, sys, time
+sys.path.insert(0, %(sdk)r)
+import dev_appserver
+dev_appserver.fix_sys_path()
+sys.path.insert(0, %(app)r)
+
+from google.appengine.ext import testbed
+tb = testbed.Testbed()
+tb.activate()
+tb.setup_env(app_id='the-conference')
+tb.init_datastore_v3_stub()
+tb.init_memcache_stub()
+tb.init_taskqueue_stub(root_path=%(app)r)
+tb.init_app_identity_stub()
+tb.init_urlfetch_stub()
+tb.init_user_stub()
+
+import webapp2
+
+started = time.time()
+module = __import__(%(module)r)
+imported = time.time()
+request = webapp2.Request.blank(%(path)r, method=%(method)r,
+                                body=%(body)r,
+                                content_type='application/json')
+response = request.get_response(getattr(module, %(attr)r))
+served = time.time()
+print(json.dumps({'import': imported - started, 'first': served - started,
+                  'status': response.status_int}))
+'''
+
+
+def sample(sdk, name):
+    module, attr, method, path, body = ENTRY_POINTS[name]
+    code = CHILD % {'sdk': sdk, 'app': APP_DIR, 'module': module,
+                    'attr': attr, 'method': method, 'path': path,
+                    'body': body}
+    output = subprocess.check_output([sys.executable, '-c', code],
+                                     cwd=APP_DIR)
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--sdk', required=True,
+                        help='path of the App Engine Python SDK')
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    print('%-6s %12s %12s  %s' % ('entry', 'import ms', 'first ms', 'status'))
+    for name in sorted(ENTRY_POINTS):
+        samples = [sample(args.sdk, name) for _ in range(args.runs)]
+        print('%-6s %12.1f %12.1f  %s' % (
+            name,
+            median([s['import'] for s in samples]) * 1000,
+            median([s['first'] for s in samples]) * 1000,
+            ','.join(sorted(set(str(s['status']) for s in samples)))))
+
+
+if __name__ == '__main__':
+    main()
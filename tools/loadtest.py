@@ -0,0 +1,298 @@
+#!/usr/bin/env python
+
+"""
+loadtest.py -- registration-storm load test against the local service stubs
+
+Simulated users register for and unregister from a few conferences
+from many threads, through the ConferenceApi methods, against the
+testbed datastore (with real optimistic-concurrency conflicts),
+memcache and task queue stubs. Reported per client class:
+
+  ops/s      completed operations per second
+  attempts   datastore transactions begun per operation, retries
+             included (without retries: 1 for xg, 2 for hold)
+  failed     operations that gave up on contention
+  p50..max   latency in milliseconds
+
+Abusers (--abusers) register and unregister on the busiest conference
+in a tight loop, to see how they affect everybody else; pass
+--rate-limit to keep settings.RATE_LIMITS in force.
+
+At the end every conference must satisfy
+    seatsAvailable + registrations + seat holds == maxAttendees
+and match its roster, and no profile may list a conference twice.
+
+Numbers are only comparable between runs on the same machine: the
+stubs are in-process and share the GIL. Registration designs are
+pluggable, see DESIGNS.
+
+Usage: python tools/loadtest.py --sdk ~/google_appengine [--design xg]
+           [--threads 20] [--users 500] [--conferences 5] [--seats 100]
+           [--ops 2000] [--unregister 0.2] [--abusers 0] [--rate-limit]
+
+"""
+
+import argparse
+import collections
+import random
+import sys
+import threading
+import time
+
+from _local import setUp as setUpStubs
+
+_local = threading.local()
+
+
+def setUp(sdk):
+    """Activate the stubs, counting transactions and keeping the
+    current user per thread."""
+    tb = setUpStubs(sdk, mail=True, users=True, consistency=1)
+    from google.appengine.api import apiproxy_stub_map
+
+    # every transaction attempt (including ndb's retries) begins one
+    apiproxy_stub_map.apiproxy.GetPreCallHooks().Append(
+        'loadtest', _countTransactions, 'datastore_v3')
+
+    # endpoints keeps the current user in os.environ, which is shared by
+    # all threads; give every simulated user its own thread instead
+    import endpoints
+    endpoints.get_current_user = lambda: _local.user
+    return tb
+
+
+def _countTransactions(service, call, request, response):
+    if call == 'BeginTransaction':
+        _local.attempts = getattr(_local, 'attempts', 0) + 1
+
+
+# - - - registration designs - - - - - - - - - - - - - - - - - - - - -
+
+def _call(method, wsck):
+    """Call an API method directly, bypassing the endpoints plumbing
+    but not the decorators of the method itself."""
+    import conference
+    request = conference.CONF_GET_REQUEST.combined_message_class(
+        websafeConferenceKey=wsck)
+    return method.remote.method(conference.ConferenceApi(), request)
+
+
+def _xgRegister(wsck):
+    import conference
+    form = _call(conference.ConferenceApi.registerForConference, wsck)
+    return 'waitlisted' if form.waitlisted else None
+
+
+def _holdRegister(wsck):
+    import conference
+    _call(conference.ConferenceApi.holdSeat, wsck)
+    _call(conference.ConferenceApi.confirmSeatHold, wsck)
+
+
+def _unregister(wsck):
+    import conference
+    _call(conference.ConferenceApi.unregisterFromConference, wsck)
+
+
+# design: (register, unregister)
+DESIGNS = {
+    'xg': (_xgRegister, _unregister),
+    'hold': (_holdRegister, _unregister),
+}
+
+
+# - - - workload - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+class Results(object):
+    """Outcomes and latencies per client class, shared by all threads."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = collections.defaultdict(list)
+        self.outcomes = collections.defaultdict(collections.Counter)
+        self.attempts = collections.Counter()
+        self.transactional = collections.Counter()
+
+    def record(self, kind, outcome, seconds, attempts):
+        with self.lock:
+            self.latencies[kind].append(seconds)
+            self.outcomes[kind][outcome] += 1
+            self.attempts[kind] += attempts
+            if attempts:
+                self.transactional[kind] += 1
+
+
+def _run(results, kind, user, func, wsck):
+    """Run one operation as `user` and record how it went."""
+    from google.appengine.api import datastore_errors
+    import endpoints
+    from models import ConflictException
+    from models import TooManyRequestsException
+
+    _local.user = user
+    _local.attempts = 0
+    started = time.time()
+    try:
+        outcome = func(wsck) or 'ok'
+    except TooManyRequestsException:
+        outcome = 'limited'
+    except ConflictException:
+        outcome = 'conflict'    # sold out, or already (un)registered
+    except datastore_errors.TransactionFailedError:
+        outcome = 'failed'
+    except endpoints.ServiceException:
+        outcome = 'error'
+    results.record(kind, outcome, time.time() - started, _local.attempts)
+
+
+def _user(i):
+    from google.appengine.api import users
+    return users.User('user%d@example.com' % i)
+
+
+def _worker(results, design, wskeys, users, ops, unregister, seed):
+    register, unreg = DESIGNS[design]
+    rng = random.Random(seed)
+    for _ in range(ops):
+        func = unreg if rng.random() < unregister else register
+        _run(results, 'users', rng.choice(users), func, rng.choice(wskeys))
+
+
+def _abuser(results, design, wsck, user, done):
+    register, unreg = DESIGNS[design]
+    while not done.is_set():
+        _run(results, 'abusers', user, register, wsck)
+        _run(results, 'abusers', user, unreg, wsck)
+
+
+def createConferences(count, seats):
+    from google.appengine.ext import ndb
+    from models import Conference, Profile
+    organizer = ndb.Key(Profile, 'organizer@example.com')
+    confs = [Conference(parent=organizer, name='Load test %d' % i,
+                        organizerUserId=organizer.id(),
+                        maxAttendees=seats, seatsAvailable=seats,
+                        attendeeCount=0)
+             for i in range(count)]
+    return [key.urlsafe() for key in ndb.put_multi(confs)]
+
+
+# - - - invariants - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+def checkInvariants(wskeys):
+    """Return a list of violated invariants (empty if all hold)."""
+    from google.appengine.ext import ndb
+    from models import Attendee, Profile, SeatHold
+
+    errors = []
+    registered = collections.Counter()
+    for prof in Profile.query():
+        counts = collections.Counter(prof.conferenceKeysToAttend)
+        for wsck, n in counts.items():
+            if n > 1:
+                errors.append('%s lists %s %d times'
+                              % (prof.key.id(), wsck, n))
+        registered.update(counts)
+
+    for wsck in wskeys:
+        c_key = ndb.Key(urlsafe=wsck)
+        conf = c_key.get()
+        holds = SeatHold.query(ancestor=c_key).count()
+        roster = Attendee.query(ancestor=c_key).count()
+        if conf.seatsAvailable + registered[wsck] + holds != conf.maxAttendees:
+            errors.append('%s: %d seats + %d registrations + %d holds != %d'
+                          % (conf.name, conf.seatsAvailable, registered[wsck],
+                             holds, conf.maxAttendees))
+        if not roster == conf.attendeeCount == registered[wsck]:
+            errors.append('%s: roster %d, attendeeCount %d, registrations %d'
+                          % (conf.name, roster, conf.attendeeCount,
+                             registered[wsck]))
+    return errors
+
+
+# - - - report - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def report(results, elapsed):
+    print('%-8s %8s %8s %8s %8s %8s %8s %8s  %s' % (
+        'clients', 'ops/s', 'attempts', 'failed', 'p50', 'p90', 'p99',
+        'max', 'outcomes'))
+    for kind in sorted(results.latencies):
+        latencies = results.latencies[kind]
+        outcomes = results.outcomes[kind]
+        print('%-8s %8.1f %8.2f %7.2f%% %8.1f %8.1f %8.1f %8.1f  %s' % (
+            kind,
+            len(latencies) / elapsed,
+            float(results.attempts[kind]) /
+                max(1, results.transactional[kind]),
+            100.0 * outcomes['failed'] / len(latencies),
+            percentile(latencies, 0.5) * 1000,
+            percentile(latencies, 0.9) * 1000,
+            percentile(latencies, 0.99) * 1000,
+            max(latencies) * 1000,
+            ' '.join('%s=%d' % item for item in sorted(outcomes.items()))))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--sdk', required=True,
+                        help='path of the App Engine Python SDK')
+    parser.add_argument('--design', choices=sorted(DESIGNS), default='xg')
+    parser.add_argument('--threads', type=int, default=20)
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--conferences', type=int, default=5)
+    parser.add_argument('--seats', type=int, default=100)
+    parser.add_argument('--ops', type=int, default=2000,
+                        help='operations of well-behaved users, in total')
+    parser.add_argument('--unregister', type=float, default=0.2,
+                        help='share of operations that unregister')
+    parser.add_argument('--abusers', type=int, default=0)
+    parser.add_argument('--rate-limit', action='store_true')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    tb = setUp(args.sdk)
+    if not args.rate_limit:
+        import settings
+        settings.RATE_LIMITS.clear()
+
+    wskeys = createConferences(args.conferences, args.seats)
+    users = [_user(i) for i in range(args.users)]
+    results = Results()
+    done = threading.Event()
+
+    abusers = [threading.Thread(target=_abuser, args=(
+                   results, args.design, wskeys[0], _user(args.users + i),
+                   done))
+               for i in range(args.abusers)]
+    workers = [threading.Thread(target=_worker, args=(
+                   results, args.design, wskeys, users,
+                   args.ops // args.threads, args.unregister, args.seed + i))
+               for i in range(args.threads)]
+
+    started = time.time()
+    for thread in abusers + workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    done.set()
+    for thread in abusers:
+        thread.join()
+    elapsed = time.time() - started
+
+    report(results, elapsed)
+    errors = checkInvariants(wskeys)
+    for error in errors:
+        print('INVARIANT VIOLATED: %s' % error)
+    if not errors:
+        print('invariants hold for %d conferences' % len(wskeys))
+    tb.deactivate()
+    sys.exit(1 if errors else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+
+"""
+migrate_local.py -- run all schema migrations end to end against the
+local service stubs
+
+Seeds the testbed datastore with entities in their oldest shape (raw
+entities without the properties that later migrations add), starts
+every registered migration in version order and drains the
+`migrations` queue through main.app, as the task queue would. Each
+batch task is delivered twice, to check that a duplicate delivery is
+harmless. Prints the progress of every migration and checks that the
+data ends up migrated (or, with --dry-run, untouched).
+
+Usage: python tools/migrate_local.py --sdk ~/google_appengine
+           [--conferences 20] [--sessions 30] [--speakers 50]
+           [--profiles 200] [--batch 25] [--dry-run]
+
+"""
+
+import argparse
+import random
+import urlparse
+
+from _local import setUp
+
+
+def seed(conferences, sessions, speakers, profiles):
+    """Write legacy entities, bypassing the ndb models."""
+    from google.appengine.api import datastore
+
+    rng = random.Random(0)
+    confKeys = []
+    speakerKeys = []
+    for n in range(speakers):
+        speaker = datastore.Entity('Speaker')
+        speaker['name'] = 'Speaker %d' % n
+        speakerKeys.append(datastore.Put(speaker))
+
+    for n in range(conferences):
+        conf = datastore.Entity('Conference')
+        conf['name'] = 'Conference %d' % n
+        conf['maxAttendees'] = 100
+        conf['seatsAvailable'] = rng.randint(0, 100)
+        c_key = datastore.Put(conf)
+        confKeys.append(c_key)
+        for m in range(sessions):
+            session = datastore.Entity('Session', parent=c_key)
+            session['sessionName'] = 'Session %d' % m
+            session['duration'] = 60
+            if rng.random() < 0.8:
+                session['speaker'] = rng.choice(speakerKeys)
+            datastore.Put(session)
+
+    # registrations from before rosters were kept: no Attendee entities
+    for n in range(profiles):
+        prof = datastore.Entity('Profile', name='user%d@example.com' % n)
+        prof['displayName'] = 'User %d' % n
+        prof['mainEmail'] = 'user%d@example.com' % n
+        prof['conferenceKeysToAttend'] = [str(key) for key in
+            rng.sample(confKeys, min(len(confKeys), rng.randint(0, 5)))]
+        datastore.Put(prof)
+
+
+def drain(app, stub):
+    """Run queued migration batches until the queue is empty; returns
+    the number of tasks run."""
+    import webapp2
+
+    ran = 0
+    while True:
+        tasks = stub.get_filtered_tasks(queue_names=['migrations'])
+        if not tasks:
+            return ran
+        for task in tasks:
+            stub.DeleteTask('migrations', task.name)
+            params = dict(urlparse.parse_qsl(task.payload))
+            # deliver every task twice; the second run must be a no-op
+            for _ in range(2):
+                response = webapp2.Request.blank(task.url,
+                    POST=params).get_response(app)
+                if response.status_int != 200:
+                    raise SystemExit('%s %s failed: %s' % (task.url,
+                        params, response.status))
+            ran += 1
+
+
+def check(dryRun):
+    """Return a list of problems with the migrated (or, for a dry run,
+    unmigrated) data."""
+    from google.appengine.api import datastore
+
+    problems = []
+
+    def expect(ok, message):
+        if ok == dryRun:
+            problems.append(message)
+
+    for speaker in datastore.Query('Speaker').Run():
+        expect('nameLower' in speaker,
+            'Speaker %s: nameLower' % speaker.key().id())
+    for session in datastore.Query('Session').Run():
+        label = 'Session %s' % session.key().id()
+        expect('conferenceName' in session, label + ': conferenceName')
+        expect('modified' in session, label + ': modified')
+        if 'speaker' in session:
+            expect('speakerName' in session, label + ': speakerName')
+    for conf in datastore.Query('Conference').Run():
+        label = 'Conference %s' % conf.key().id()
+        expect('modified' in conf, label + ': modified')
+        expect(conf.get('attendeeCount') ==
+               conf['maxAttendees'] - conf['seatsAvailable'],
+               label + ': attendeeCount')
+    for prof in datastore.Query('Profile').Run():
+        for wsck in prof.get('conferenceKeysToAttend') or []:
+            a_key = datastore.Key.from_path('Attendee', prof.key().name(),
+                parent=datastore.Key(wsck))
+            expect(bool(datastore.Get([a_key])[0]),
+                'Profile %s: Attendee of %s' % (prof.key().name(), wsck))
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--sdk', required=True,
+                        help='path of the App Engine Python SDK')
+    parser.add_argument('--conferences', type=int, default=20)
+    parser.add_argument('--sessions', type=int, default=30,
+                        help='sessions per conference')
+    parser.add_argument('--speakers', type=int, default=50)
+    parser.add_argument('--profiles', type=int, default=200)
+    parser.add_argument('--batch', type=int, default=25,
+                        help='entities per migration batch')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='only count the entities that would change')
+    args = parser.parse_args()
+
+    from google.appengine.ext import testbed
+    tb = setUp(args.sdk, mail=True, users=True, consistency=1)
+    seed(args.conferences, args.sessions, args.speakers, args.profiles)
+
+    import main as app_main
+    import migrations
+    stub = tb.get_stub(testbed.TASKQUEUE_SERVICE_NAME)
+
+    print('%3s %-26s %-10s %8s %8s %8s %7s' % ('v', 'migration', 'kind',
+        'tasks', 'entities', 'changed', 'state'))
+    for m in migrations.registeredMigrations():
+        m.batch = args.batch
+        migrations.startMigration(m.name, dryRun=args.dry_run)
+        tasks = drain(app_main.app, stub)
+        progress = dict((p['name'], p)
+                        for p in migrations.migrationProgress())[m.name]
+        print('%3d %-26s %-10s %8d %8d %8d %7s' % (m.version, m.name,
+            progress['kind'], tasks, progress['processed'],
+            progress['changed'], progress['state']))
+        if progress['state'] != 'done':
+            raise SystemExit('Migration %s did not finish: %s' % (m.name,
+                progress['lastError']))
+
+    problems = check(args.dry_run)
+    for problem in problems[:20]:
+        print('FAIL %s' % problem)
+    if problems:
+        raise SystemExit('%d problems' % len(problems))
+    print('OK: data %s' % ('untouched' if args.dry_run else 'migrated'))
+    tb.deactivate()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+
+"""
+outbox_local.py -- run the mail outbox end to end against the local
+mail and task queue stubs
+
+Enqueues --intents mail intents for each of --recipients recipients,
+every one of them twice (as a retried request would), and drains the
+outbox in three rounds:
+
+  first    the first --failing recipients cannot be mailed; everyone
+           else gets a single mail (a digest when they have several
+           intents), the failed intents stay in the queue
+  retry    once the leases ran out, the failed recipients get their
+           mail
+  replay   all intents are enqueued again; nothing is sent twice
+
+Prints the stats of every drain and checks the mails the stub got.
+
+Usage: python tools/outbox_local.py --sdk ~/google_appengine
+           [--recipients 20] [--intents 3] [--failing 3]
+
+"""
+
+import argparse
+import time
+
+from _local import setUp
+
+# leases are shortened so that the retry round need not wait a minute
+LEASE_SECONDS = 1
+
+
+def _recipient(n):
+    return 'user%d@example.com' % n
+
+
+def enqueue(recipients, intents):
+    """Enqueue every intent twice: half of them with an idempotency key,
+    half with the key derived from their content."""
+    import outbox
+
+    for n in range(recipients):
+        for m in range(intents):
+            subject = 'Notification %d' % m
+            body = 'Notification %d for user %d' % (m, n)
+            key = 'local:%d:%d' % (n, m) if m % 2 else None
+            for _ in range(2):
+                outbox.enqueueMail(_recipient(n), subject, body,
+                                   idempotencyKey=key)
+
+
+def drain(failing):
+    """Drain the outbox with mail to the recipients in `failing`
+    raising, as a mail service outage would; returns the stats."""
+    from google.appengine.api import mail
+    import outbox
+
+    send_mail = mail.send_mail
+
+    def flaky(sender, to, subject, body, **kwds):
+        if to in failing:
+            raise mail.Error('%s is unreachable' % to)
+        return send_mail(sender, to, subject, body, **kwds)
+
+    mail.send_mail = flaky
+    try:
+        return outbox.drain()
+    finally:
+        mail.send_mail = send_mail
+
+
+def check(mailStub, recipients, intents, delivered):
+    """Return a list of problems with the mails the stub got; exactly
+    the recipients in `delivered` must have one mail each."""
+    import outbox
+
+    problems = []
+    for n in range(recipients):
+        to = _recipient(n)
+        messages = mailStub.get_sent_messages(to=to)
+        expected = 1 if to in delivered else 0
+        if len(messages) != expected:
+            problems.append('%s: %d mails, expected %d' % (to,
+                len(messages), expected))
+            continue
+        if not messages:
+            continue
+        body = messages[0].body.decode()
+        subject = messages[0].subject
+        if intents > 1 and subject != outbox.DIGEST_SUBJECT_TPL % intents:
+            problems.append('%s: not a digest: %s' % (to, subject))
+        for m in range(intents):
+            if 'Notification %d for user %d' % (m, n) not in body:
+                problems.append('%s: notification %d missing' % (to, m))
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--sdk', required=True,
+                        help='path of the App Engine Python SDK')
+    parser.add_argument('--recipients', type=int, default=20)
+    parser.add_argument('--intents', type=int, default=3,
+                        help='intents per recipient')
+    parser.add_argument('--failing', type=int, default=3,
+                        help='recipients whose first mail fails')
+    args = parser.parse_args()
+
+    from google.appengine.ext import testbed
+    tb = setUp(args.sdk, mail=True)
+    mailStub = tb.get_stub(testbed.MAIL_SERVICE_NAME)
+
+    import outbox
+    outbox.LEASE_SECONDS = LEASE_SECONDS
+    everyone = set(_recipient(n) for n in range(args.recipients))
+    failing = set(_recipient(n) for n in range(args.failing))
+
+    print('%-8s %7s %6s %11s %7s %6s' % ('round', 'leased', 'sent',
+        'duplicates', 'failed', 'queue'))
+    problems = []
+    for name, delivered in (('first', everyone - failing),
+                            ('retry', everyone),
+                            ('replay', everyone)):
+        if name == 'retry':
+            time.sleep(LEASE_SECONDS + 0.5)
+        else:
+            enqueue(args.recipients, args.intents)
+        stats = drain(failing if name == 'first' else set())
+        print('%-8s %7d %6d %11d %7d %6d' % (name, stats['leased'],
+            stats['mailsSent'], stats['duplicates'],
+            stats['failedRecipients'], stats['queueDepth']))
+        expectedDepth = args.failing * args.intents if name == 'first' else 0
+        if stats['queueDepth'] != expectedDepth:
+            problems.append('%s: %d intents left in the queue, expected %d'
+                            % (name, stats['queueDepth'], expectedDepth))
+        problems.extend('%s: %s' % (name, problem) for problem in
+            check(mailStub, args.recipients, args.intents, delivered))
+
+    for problem in problems[:20]:
+        print('FAIL %s' % problem)
+    if problems:
+        raise SystemExit('%d problems' % len(problems))
+    print('OK: one mail per recipient, duplicates dropped, failures retried')
+    tb.deactivate()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+
+"""
+versions.py -- Udacity conference server-side Python App Engine
+    per-conference version counters behind the ETags of conferences
+    and their session lists, and a generation of the whole catalog
+
+"""
+
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+
+from cache import bumpGeneration
+from cache import casUpdate
+from cache import getGeneration
+
+MEMCACHE_CONF_VERSION_KEY = "CONFERENCE_VERSION_%s"
+MEMCACHE_CATALOG_GENERATION_KEY = "CONFERENCE_CATALOG_GENERATION"
+
+
+def getConferenceVersion(websafeConferenceKey):
+    """Return the version of a conference, preferring memcache.
+
+    Falls back to the datastore on a cache miss; returns None if the
+    conference does not exist.
+    """
+    mkey = MEMCACHE_CONF_VERSION_KEY % websafeConferenceKey
+    version = memcache.get(mkey)
+    if version is None:
+        conf = ndb.Key(urlsafe=websafeConferenceKey).get()
+        if not conf:
+            return None
+        version = conf.version or 0
+        memcache.add(mkey, version)
+    return version
+
+
+def publishConferenceVersion(websafeConferenceKey, version):
+    """Raise the memcached version of a conference to `version`.
+
+    The cached value never goes down, so commits finishing out of order
+    cannot bring back an ETag for data that has since changed.
+    """
+    mkey = MEMCACHE_CONF_VERSION_KEY % websafeConferenceKey
+    if not casUpdate(mkey, lambda current: version
+            if current is None or current < version else None, tries=10):
+        # too much contention; let the next reader reload it
+        memcache.delete(mkey)
+
+
+def getCatalogGeneration():
+    """Return the generation of the conference catalog, which changes
+    whenever any conference does."""
+    return getGeneration(MEMCACHE_CATALOG_GENERATION_KEY)
+
+
+def bumpCatalogGeneration():
+    """Move the conference catalog to a new generation, making every
+    value cached under the current one unreachable."""
+    bumpGeneration(MEMCACHE_CATALOG_GENERATION_KEY)
+
+
+def touchConference(conf):
+    """Bump the version of a Conference that is about to be put().
+
+    The new version is published to memcache, and the catalog moved to
+    a new generation, once the surrounding transaction (if any) has
+    committed.
+    """
+    conf.version = (conf.version or 0) + 1
+    wsck = conf.key.urlsafe()
+    version = conf.version
+
+    def publish():
+        publishConferenceVersion(wsck, version)
+        bumpCatalogGeneration()
+
+    ndb.get_context().call_on_commit(publish)
+
+
+@ndb.transactional()
+def bumpConferenceVersion(c_key):
+    """Bump the version, and the schedule version, of a conference
+    whose sessions have changed."""
+    conf = c_key.get()
+    if conf:
+        conf.scheduleVersion = (conf.scheduleVersion or 0) + 1
+        touchConference(conf)
+        conf.put()
+
+
+def primeConferenceVersion(websafeConferenceKey, version):
+    """Cache a conference version just read from the datastore, unless
+    a (newer) one is cached already."""
+    memcache.add(MEMCACHE_CONF_VERSION_KEY % websafeConferenceKey, version)
@@ -0,0 +1,31 @@
+#!/usr/bin/env python
+
+"""
+warmup.py -- Udacity conference server-side Python App Engine
+    /_ah/warmup handler: loads the API and fills instance caches before
+    the instance takes user traffic
+
+"""
+
+import importlib
+import logging
+import time
+
+import webapp2
+
+import announcements
+
+WARMUP_MODULES = ('models', 'conference')
+
+class WarmupHandler(webapp2.RequestHandler):
+    def get(self):
+        """Preload the Endpoints API config, models and hot caches."""
+        started = time.time()
+        # conference builds the Endpoints API config at import time
+        for module in WARMUP_MODULES:
+            importlib.import_module(module)
+        announcements.getAnnouncement()
+        announcements.getFeaturedSpeaker()
+        logging.info('Warmup done in %.1fms',
+            (time.time() - started) * 1000)
+        self.response.set_status(204)